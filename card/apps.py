@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class CardConfig(AppConfig):
     name = 'card'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,557 @@
+"""
+Micro-benchmarks for the hot paths of the study flow.
+
+Scenarios are plain functions registered with ``@scenario`` and are run by the
+``benchmark`` management command against a throwaway test database. Each one
+yields flat dicts of results, which the command prints as text or JSON.
+"""
+import asyncio
+import copy
+import http.client
+import itertools
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+from datetime import timedelta
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, connections, transaction, OperationalError
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from . import mastery, search
+from .models import Deck, Card, Subscription, CardProgress
+
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+def seed_deck(author, size, status=Card.QuestionStatus.MASTERED):
+    deck = Deck.objects.create(name=f'bench-{size}', author=author)
+    Card.objects.bulk_create(
+        (Card(deck=deck, question=f'question {i}', answer=f'answer {i}', status=status, position=i)
+         for i in range(1, size + 1)),
+        batch_size=1000
+    )
+    Deck.update_counters(deck.id, cards=size, mastered=size if status == Card.QuestionStatus.MASTERED else 0)
+    return deck
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {
+        'p50_ms': round(statistics.median(samples), 3),
+        'p99_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 3),
+    }
+
+
+def measure(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return percentiles(samples)
+
+
+@scenario('next-red')
+def next_red(options):
+    """Worst case for the "next red card" lookup: only the last card is still LEARNING."""
+    author = User.objects.create_user('bench-next-red')
+    for size in options['sizes']:
+        deck = seed_deck(author, size)
+        Card.objects.filter(deck=deck, position=size).update(status=Card.QuestionStatus.LEARNING)
+        yield dict(size=size, **measure(lambda: Deck.next_red_card_index(deck.id, 0), options['repeat']))
+
+
+@scenario('due-queue')
+def due_queue(options):
+    """Simulates ``--reviews`` SM-2 reviews, 30 seconds apart, on decks of each size.
+
+    Every step fetches the next due card and grades it with a seeded random
+    grade, so the due queue keeps its real mix of new, failed and scheduled cards.
+    """
+    author = User.objects.create_user('bench-due-queue')
+    grades = random.Random(0)
+    for size in options['sizes']:
+        deck = seed_deck(author, size, status=Card.QuestionStatus.LEARNING)
+        now = timezone.now()
+        fetches = []
+        reviews = 0
+        start = time.perf_counter()
+        for _ in range(options['reviews']):
+            fetch_start = time.perf_counter()
+            card = Deck.due_cards(deck.id, now).first()
+            fetches.append((time.perf_counter() - fetch_start) * 1000)
+            if card is not None:
+                card.review(grades.choice((1, 3, 4, 4, 5)), now)
+                reviews += 1
+            now += timedelta(seconds=30)
+        elapsed = time.perf_counter() - start
+        yield dict(
+            size=size,
+            reviews=reviews,
+            idle_fetches=options['reviews'] - reviews,
+            reviews_per_s=round(options['reviews'] / elapsed, 1),
+            **percentiles(fetches)
+        )
+
+
+@scenario('concurrent-writes')
+def concurrent_writes(options):
+    """Concurrent study sessions flipping card statuses for ``--duration`` seconds.
+
+    Each thread is one learner working through their own deck with the same
+    conditional UPDATE the study API uses, so every step is a real write.
+    Run it once per DATABASE_ENGINE to compare backends.
+    """
+    size = options['sizes'][0]
+    learners = []
+    for n in range(max(options['workers'])):
+        author = User.objects.create_user(f'bench-writer-{n}')
+        learners.append((author, seed_deck(author, size).id))
+
+    def study(author, deck_pk, deadline, samples, errors):
+        try:
+            step = 0
+            while time.perf_counter() < deadline:
+                position = step % size + 1
+                status = Card.QuestionStatus.LEARNING if (step // size) % 2 == 0 else Card.QuestionStatus.MASTERED
+                step += 1
+                start = time.perf_counter()
+                try:
+                    Card.update_status(deck_pk, position, status, author)
+                except OperationalError:
+                    errors.append(position)
+                    continue
+                samples.append((time.perf_counter() - start) * 1000)
+        finally:
+            connections.close_all()
+
+    for workers in options['workers']:
+        samples, errors = [], []
+        deadline = time.perf_counter() + options['duration']
+        threads = [
+            threading.Thread(target=study, args=(author, deck_pk, deadline, samples, errors))
+            for author, deck_pk in learners[:workers]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        yield dict(
+            backend=connection.vendor,
+            workers=workers,
+            writes=len(samples),
+            writes_per_s=round(len(samples) / options['duration'], 1),
+            lock_errors=len(errors),
+            **percentiles(samples or [0])
+        )
+
+
+@scenario('search')
+def search_cards(options):
+    """Ranked two-word searches by one user over a corpus of each size spread over ``--users`` authors.
+
+    Card text is drawn from a seeded 20,000-word vocabulary, so queries hit a
+    realistic mix of rare and common terms.
+    """
+    words = random.Random(0)
+    vocabulary = [f'w{n:x}' for n in range(20000)]
+    for size in options['sizes']:
+        authors = [User.objects.create_user(f'bench-search-{size}-{n}') for n in range(options['users'])]
+        for author in authors:
+            deck = Deck.objects.create(name=f'bench-search-{size}', author=author)
+            Card.objects.bulk_create(
+                (Card(deck=deck, position=i,
+                      question=' '.join(words.choices(vocabulary, k=6)),
+                      answer=' '.join(words.choices(vocabulary, k=12)))
+                 for i in range(1, size // options['users'] + 1)),
+                batch_size=1000
+            )
+            search.index_deck(deck.id)
+        queries = [' '.join(words.choices(vocabulary[:2000], k=2)) for _ in range(options['repeat'])]
+        samples = []
+        for query in queries:
+            start = time.perf_counter()
+            search.search(authors[0], query)
+            samples.append((time.perf_counter() - start) * 1000)
+        yield dict(cards=size, users=options['users'], **percentiles(samples))
+
+
+def study_requests(deck_pk, size, steps):
+    """The requests of one learner: a card page, then a study step flipping its status."""
+    statuses = [Card.QuestionStatus.LEARNING, Card.QuestionStatus.MASTERED]
+    for step in range(steps):
+        position = step % (size - 1) + 1
+        status = statuses[(step // (size - 1)) % 2]
+        data = {'mode': 'next', 'markAsLearned': status, 'markAsLearnedInit': statuses[1 - statuses.index(status)]}
+        yield 'get', reverse('card', args=[deck_pk, position]), {}
+        # Url-encoded, because AsyncClient in Django 3.1 cannot send multipart bodies.
+        yield 'post', reverse('study-step', args=[deck_pk, position]), {
+            'data': urlencode(data), 'content_type': 'application/x-www-form-urlencoded'
+        }
+
+
+def wsgi_learner(client, requests, samples, errors):
+    try:
+        for method, url, kwargs in requests:
+            start = time.perf_counter()
+            if getattr(client, method)(url, **kwargs).status_code != 200:
+                errors.append(url)
+            samples.append((time.perf_counter() - start) * 1000)
+    finally:
+        connections.close_all()
+
+
+async def asgi_learner(client, requests, samples, errors):
+    for method, url, kwargs in requests:
+        start = time.perf_counter()
+        if (await getattr(client, method)(url, **kwargs)).status_code != 200:
+            errors.append(url)
+        samples.append((time.perf_counter() - start) * 1000)
+
+
+async def asgi_learners(learners):
+    await asyncio.gather(*(asgi_learner(*learner) for learner in learners))
+
+
+@scenario('study-entrypoints')
+def study_entrypoints(options):
+    """The study flow through the WSGI and the ASGI entry point, for each ``--workers`` count.
+
+    WSGI serves every learner from its own thread, as a threaded server would;
+    ASGI serves all of them as tasks on a single event loop. Each learner loads
+    a card and posts a study step ``--repeat`` times.
+    """
+    size = options['sizes'][0]
+    decks = []
+    for n in range(max(options['workers'])):
+        author = User.objects.create_user(f'bench-learner-{n}')
+        decks.append((author, seed_deck(author, size).id))
+
+    # The test clients talk to "testserver", which only the test environment allows.
+    setup_test_environment()
+    try:
+        for workers in options['workers']:
+            for entry, client_class in (('wsgi', Client), ('asgi', AsyncClient)):
+                samples, errors = [], []
+                learners = []
+                for author, deck_pk in decks[:workers]:
+                    client = client_class()
+                    client.force_login(author)
+                    learners.append((client, study_requests(deck_pk, size, options['repeat']), samples, errors))
+                start = time.perf_counter()
+                if entry == 'wsgi':
+                    threads = [threading.Thread(target=wsgi_learner, args=learner) for learner in learners]
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+                else:
+                    asyncio.run(asgi_learners(learners))
+                elapsed = time.perf_counter() - start
+                yield dict(
+                    entry=entry,
+                    workers=workers,
+                    requests=len(samples),
+                    errors=len(errors),
+                    requests_per_s=round(len(samples) / elapsed, 1),
+                    **percentiles(samples)
+                )
+    finally:
+        teardown_test_environment()
+
+
+def render_settings(cached_loader, fragments):
+    """TEMPLATES and CACHES with the cached loader and the fragment cache switched on or off."""
+    templates = copy.deepcopy(settings.TEMPLATES)
+    loaders = [
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+    ]
+    templates[0]['OPTIONS']['loaders'] = [('django.template.loaders.cached.Loader', loaders)] if cached_loader else loaders
+    caches = copy.deepcopy(settings.CACHES)
+    if not fragments:
+        caches['template_fragments'] = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+    return override_settings(TEMPLATES=templates, CACHES=caches)
+
+
+@scenario('render')
+def render(options):
+    """Renders a page of the card list of a deck of each size, ``--repeat`` times per setup.
+
+    ``plain`` parses templates on every render and re-renders every card,
+    ``loader`` adds the cached template loader and ``fragments`` also serves
+    the card items from the fragment cache, warmed by one untimed request.
+    """
+    author = User.objects.create_user('bench-render')
+    setup_test_environment()
+    try:
+        for size in options['sizes']:
+            deck = seed_deck(author, size)
+            Card.objects.filter(deck=deck, position__lte=size // 3).update(status=Card.QuestionStatus.LEARNING)
+            url = reverse('card-list', args=[deck.id]) + f'?after={size // 2}'
+            for name, cached_loader, fragments in (('plain', False, False), ('loader', True, False), ('fragments', True, True)):
+                with render_settings(cached_loader, fragments):
+                    client = Client()
+                    client.force_login(author)
+                    client.get(url)
+                    yield dict(size=size, setup=name, **measure(lambda: client.get(url), options['repeat']))
+    finally:
+        teardown_test_environment()
+
+
+def study_deck(author, size):
+    """A mastered deck whose only card still being learned is the last one."""
+    deck = seed_deck(author, size)
+    Card.objects.filter(deck=deck, position=size).update(status=Card.QuestionStatus.LEARNING)
+    Deck.update_counters(deck.id, mastered=-1)
+    return deck
+
+
+def page_requests(deck_pk, size):
+    """Request factories for the deck pages and the study flow, by view name.
+
+    Each factory returns ``(method, url, data)``. The study steps are posted
+    for the middle card and flip its status every time, so each one writes;
+    the "next red card" search then runs through the second half of the deck.
+    """
+    middle = max(1, size // 2)
+    card_id = Card.objects.filter(deck__id=deck_pk, position=middle).values_list('id', flat=True).get()
+    flips = itertools.cycle([
+        (Card.QuestionStatus.LEARNING, Card.QuestionStatus.MASTERED),
+        (Card.QuestionStatus.MASTERED, Card.QuestionStatus.LEARNING),
+    ])
+
+    def page(name, *args, query=''):
+        url = reverse(name, args=args) + query
+        return lambda: ('get', url, {})
+
+    def study(name):
+        url = reverse(name, args=[deck_pk, middle])
+
+        def request():
+            status, initial = next(flips)
+            return 'post', url, {'cardId': card_id, 'cardQty': size, 'markAsLearned': status, 'markAsLearnedInit': initial}
+        return request
+
+    return {
+        'DeckListView': page('deck-list'),
+        'DeckDetailView': page('deck-detail', deck_pk),
+        'CardListVIew': page('card-list', deck_pk, query=f'?after={middle}'),
+        'QACardView': page('card', deck_pk, middle),
+        'next_card': study('next-card'),
+        'next_red_card': study('next-red-card'),
+    }
+
+
+def profile(func, runs=5):
+    """Most queries and highest traced memory peak (KiB) of ``func`` over a few runs."""
+    queries, peak = 0, 0
+    for _ in range(runs):
+        tracemalloc.start()
+        try:
+            with CaptureQueriesContext(connection) as captured:
+                func()
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+        queries = max(queries, len(captured))
+    return {'queries': queries, 'peak_kib': round(peak / 1024, 1)}
+
+
+@scenario('views')
+def views(options):
+    """Every deck page and study step through the test client, on a deck of each size.
+
+    Latencies come from ``--repeat`` timed requests after one warm-up request;
+    queries and peak memory from a few separate, traced requests, so tracing
+    does not slow down the timed ones.
+    """
+    author = User.objects.create_user('bench-views')
+    setup_test_environment()
+    try:
+        for size in options['sizes']:
+            deck = study_deck(author, size)
+            client = Client()
+            client.force_login(author)
+            for view, request in page_requests(deck.id, size).items():
+                def call():
+                    method, url, data = request()
+                    return getattr(client, method)(url, data)
+                call()
+                yield dict(size=size, view=view, **measure(call, options['repeat']), **profile(call))
+    finally:
+        teardown_test_environment()
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    # Headers and body are written separately; with Nagle's algorithm the body
+    # then waits for the client's delayed ACK, adding 40 ms to every response.
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+
+def http_worker(address, headers, requests, deadline, samples, errors):
+    names = itertools.cycle(requests)
+    server = http.client.HTTPConnection(*address, timeout=30)
+    try:
+        while time.perf_counter() < deadline:
+            view = next(names)
+            method, url, data = requests[view]()
+            body = urlencode(data) if method == 'post' else None
+            start = time.perf_counter()
+            try:
+                server.request(method.upper(), url, body, headers)
+                response = server.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                server.close()
+                errors.append(view)
+                continue
+            if response.status >= 400:
+                errors.append(view)
+            samples[view].append((time.perf_counter() - start) * 1000)
+    finally:
+        server.close()
+
+
+@scenario('http')
+def http_load(options):
+    """Real HTTP requests against a local threaded WSGI server, for each ``--workers`` count.
+
+    Every worker is a client looping over the deck pages and study steps of
+    one shared deck of the first ``--sizes`` size for ``--duration`` seconds,
+    logged in with a session cookie and sending a CSRF token with its posts.
+    """
+    size = options['sizes'][0]
+    author = User.objects.create_user('bench-http')
+    deck = study_deck(author, size)
+    client = Client()
+    client.force_login(author)
+    csrf_token = get_random_string(32)
+    headers = {
+        'Cookie': f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}; '
+                  f'{settings.CSRF_COOKIE_NAME}={csrf_token}',
+        'X-CSRFToken': csrf_token,
+        'Content-Type': 'application/x-www-form-urlencoded',
+    }
+    requests = page_requests(deck.id, size)
+
+    server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler)
+    server.set_app(get_wsgi_application())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        for workers in options['workers']:
+            samples = {view: [] for view in requests}
+            errors = []
+            deadline = time.perf_counter() + options['duration']
+            threads = [
+                threading.Thread(target=http_worker, args=(server.server_address, headers, requests, deadline, samples, errors))
+                for _ in range(workers)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            for view, timings in samples.items():
+                yield dict(
+                    size=size,
+                    workers=workers,
+                    view=view,
+                    requests=len(timings),
+                    requests_per_s=round(len(timings) / options['duration'], 1),
+                    errors=errors.count(view),
+                    **percentiles(timings or [0])
+                )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def measure_rolled_back(func, repeat):
+    """Like measure, for writes: each call runs in a transaction rolled back outside the timing."""
+    samples = []
+    for _ in range(repeat):
+        with transaction.atomic():
+            start = time.perf_counter()
+            func()
+            samples.append((time.perf_counter() - start) * 1000)
+            transaction.set_rollback(True)
+    return percentiles(samples)
+
+
+@scenario('progress')
+def subscriber_progress(options):
+    """Deck-wide progress questions of a subscriber, from CardProgress rows and from the bitmap.
+
+    The subscriber mastered every card but the last, the worst case for the
+    "next red card" search. Bitmap timings include reading the bitmap.
+    """
+    author = User.objects.create_user('bench-progress-author')
+    student = User.objects.create_user('bench-progress-student')
+    for size in options['sizes']:
+        deck = seed_deck(author, size, status=Card.QuestionStatus.LEARNING)
+        Deck.objects.filter(id=deck.id).update(shared=True)
+        subscription = Subscription.objects.create(user=student, deck=deck)
+        CardProgress.objects.bulk_create(
+            (CardProgress(subscription=subscription, card_id=card_id, status=Card.QuestionStatus.MASTERED)
+             for card_id in Card.objects.filter(deck=deck, position__lt=size).values_list('id', flat=True)),
+            batch_size=1000
+        )
+        subscription.rebuild_bits()
+        rows = subscription.progress.all()
+        mastered = rows.filter(status=Card.QuestionStatus.MASTERED)
+        page = list(Card.objects.filter(deck=deck, position__gt=size // 2).order_by('position')[:60].values_list(
+            'id', 'position'
+        ))
+
+        def bits():
+            return Subscription.objects.values_list('mastered_bits', flat=True).get(id=subscription.id)
+
+        operations = {
+            'mastered-count': (
+                lambda: mastered.count(),
+                lambda: mastery.count(bits()),
+            ),
+            'next-red': (
+                lambda: Card.objects.filter(deck=deck, position__gt=0).exclude(
+                    id__in=mastered.values('card_id')
+                ).order_by('position').values_list('position', flat=True).first(),
+                lambda: mastery.next_learning(bits(), 0, size),
+            ),
+            'page-statuses': (
+                lambda: dict(rows.filter(card__in=[card_id for card_id, _ in page]).values_list('card_id', 'status')),
+                lambda: [mastery.is_mastered(bitmap, position) for bitmap in [bits()] for _, position in page],
+            ),
+        }
+        for operation, (by_rows, by_bitmap) in operations.items():
+            yield dict(size=size, operation=operation, path='rows', **measure(by_rows, options['repeat']))
+            yield dict(size=size, operation=operation, path='bitmap', **measure(by_bitmap, options['repeat']))
+        yield dict(size=size, operation='reset', path='rows', **measure_rolled_back(
+            lambda: rows.update(status=Card.QuestionStatus.LEARNING), options['repeat']
+        ))
+        yield dict(size=size, operation='reset', path='bitmap', **measure_rolled_back(
+            lambda: Subscription.objects.filter(id=subscription.id).update(mastered_bits=b''), options['repeat']
+        ))
+        yield dict(size=size, operation='storage', bitmap_bytes=len(bits()), progress_rows=rows.count())
@@ -0,0 +1,45 @@
+"""
+Per-user caches for data that is read on every page but rarely written.
+
+Entries are dropped by the signal handlers in ``card.signals`` once the
+transaction that changed the underlying rows has committed.
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Deck
+
+DECK_LIST_KEY = 'deck-list:{}'
+DECK_LIST_TIMEOUT = 60 * 60
+
+
+def deck_list(user):
+    """The user's decks with their images, as a list ready for ``deck_list.html``."""
+    key = DECK_LIST_KEY.format(user.id)
+    decks = cache.get(key)
+    if decks is None:
+        decks = list(Deck.objects.filter(author=user).select_related('img').order_by('id'))
+        cache.set(key, decks, DECK_LIST_TIMEOUT)
+    return decks
+
+
+def invalidate_deck_list(user_id):
+    transaction.on_commit(lambda: cache.delete(DECK_LIST_KEY.format(user_id)))
+
+
+OWNED_DECKS_KEY = 'owned-decks:{}'
+OWNED_DECKS_TIMEOUT = 60 * 60
+
+
+def owned_deck_ids(user):
+    """Ids of the decks ``user`` authored, as a frozenset."""
+    key = OWNED_DECKS_KEY.format(user.id)
+    ids = cache.get(key)
+    if ids is None:
+        ids = frozenset(Deck.objects.filter(author=user).values_list('id', flat=True))
+        cache.set(key, ids, OWNED_DECKS_TIMEOUT)
+    return ids
+
+
+def invalidate_owned_decks(user_id):
+    transaction.on_commit(lambda: cache.delete(OWNED_DECKS_KEY.format(user_id)))
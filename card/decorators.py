@@ -0,0 +1,97 @@
+import hashlib
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from .models import Deck
+
+
+def _with_fresh_connections(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return view(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return wrapper
+
+
+def async_view(view):
+    """Serves a sync view as a coroutine view, so ASGI requests run it in parallel.
+
+    Django 3.1 has no async ORM, and under ASGI its own adapter runs every sync
+    view on one process-wide thread, so requests queue behind each other's
+    queries. Requests coming in through ASGI run the view on the event loop's
+    thread pool instead, with connections recycled around each call the way
+    request_started/request_finished do for sync views. WSGI requests keep
+    running on their own thread.
+    """
+    pooled = sync_to_async(_with_fresh_connections(view), thread_sensitive=False)
+    inline = sync_to_async(view)
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if isinstance(request, ASGIRequest):
+            return await pooled(request, *args, **kwargs)
+        return await inline(request, *args, **kwargs)
+    return wrapper
+
+
+def _revalidates(request):
+    # The pages embed the CSRF token and flash whatever messages are pending,
+    # so a 304 is only safe while the browser still holds the token's cookie
+    # and nothing is waiting to be shown. len() peeks without consuming.
+    return 'CSRF_COOKIE' in request.META and not len(messages.get_messages(request))
+
+
+def deck_condition(deck_url_kwarg='pk'):
+    """ETag and Last-Modified for pages of the deck named by ``deck_url_kwarg``.
+
+    Everything on such a page comes from the deck and its cards, and both
+    stamp Deck.updated_at when they change, so an unchanged page is answered
+    with 304 after one query and without rendering. The ETag also covers the
+    CSRF cookie and the session, and Last-Modified is at least the user's
+    last login, so a page cached before logging in again is not reused with
+    a stale token. Only the deck's author gets validators, and only when no
+    messages are pending; other requests fall through to the view's own
+    checks. The query doubles as an ownership check, recorded in
+    ``request.owned_deck_ids`` for DeckOwnerMixin. Responses are marked
+    ``private, no-cache`` so browsers always revalidate.
+    """
+    def updated_at(request, *args, **kwargs):
+        if not hasattr(request, '_deck_updated_at'):
+            request._deck_updated_at = None
+            if request.user.is_authenticated:
+                deck_pk = kwargs[deck_url_kwarg]
+                request._deck_updated_at = Deck.objects.filter(
+                    id=deck_pk,
+                    author=request.user
+                ).values_list('updated_at', flat=True).first()
+                if request._deck_updated_at is not None:
+                    request.owned_deck_ids = {deck_pk}
+        return request._deck_updated_at
+
+    def last_modified(request, *args, **kwargs):
+        stamp = updated_at(request, *args, **kwargs)
+        if stamp is None or not _revalidates(request):
+            return None
+        return max(stamp, request.user.last_login or stamp)
+
+    def etag(request, *args, **kwargs):
+        stamp = updated_at(request, *args, **kwargs)
+        if stamp is None or not _revalidates(request):
+            return None
+        client = hashlib.sha256(f'{request.META["CSRF_COOKIE"]}:{request.session.session_key}'.encode())
+        return f'{Deck.etag(kwargs[deck_url_kwarg], stamp)}-{client.hexdigest()[:16]}'
+
+    def decorator(view):
+        return cache_control(private=True, no_cache=True)(
+            condition(etag_func=etag, last_modified_func=last_modified)(view)
+        )
+    return decorator
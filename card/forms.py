@@ -1,17 +1,21 @@
-from django.forms import ModelForm, ModelChoiceField
+from django.forms import Form, ModelForm, ModelChoiceField, FileField, ChoiceField, BooleanField, IntegerField, \
+    CharField, Textarea
 
 from .models import Deck, Card, Image
+from .transfer import FORMATS
 
 
 class DeckForm(ModelForm):
     class Meta:
         model = Deck
-        fields = ['name',]
+        fields = ['name', 'shared']
+        labels = {'shared': 'Let other users subscribe to this deck'}
 
     def __init__(self, *args, **kwargs):
         self.author = kwargs.pop('user')
         super().__init__(*args, **kwargs)
         self.fields['name'].widget.attrs.update({'class': 'form-control'})
+        self.fields['shared'].widget.attrs.update({'class': 'form-check-input'})
 
     def save(self, *args, **kwargs):
         self.instance.author = self.author
@@ -22,28 +26,68 @@ class DeckForm(ModelForm):
 class CardForm(ModelForm):
     class Meta:
         model = Card
-        exclude = ['question_img', 'answer_img', 'deck']
+        fields = ['question', 'answer', 'status']
 
     def __init__(self, *args, **kwargs):
-        self.deck = Deck.objects.get(id=kwargs.pop('deck_id'))
+        self.deck_id = kwargs.pop('deck_id')
         super().__init__(*args, **kwargs)
         self.fields['question'].widget.attrs.update({'class': 'form-control', 'rows': '3'})
         self.fields['answer'].widget.attrs.update({'class': 'form-control', 'rows': '3'})
         self.fields['status'].widget.attrs.update({'class': 'form-select'})
 
-    def save(self, *args, **kwargs):
-        self.instance.deck = self.deck
-        card = super().save(*args, **kwargs)
+    def save(self, commit=True):
+        self.instance.deck_id = self.deck_id
+        if self.instance._state.adding or not commit:
+            return super().save(commit)
+        # Position, counters and scheduling may have changed since the form was
+        # loaded, so only the edited columns are written back.
+        card = super().save(commit=False)
+        card.save(update_fields=self.Meta.fields)
         return card
 
 
 class ImageForm(ModelForm):
     class Meta:
         model = Image
-        fields = '__all__'
+        fields = ['img']
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields['img'].required = False
         self.fields['img'].widget.attrs.update({'class': 'form-control'})
         self.fields['img'].label = False
+
+
+class DeckImportForm(Form):
+    file = FileField()
+    format = ChoiceField(
+        choices=[('', 'Detect from file name')] + [(fmt, fmt.upper()) for fmt in FORMATS],
+        required=False
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['file'].widget.attrs.update({'class': 'form-control', 'accept': '.csv,.jsonl'})
+        self.fields['format'].widget.attrs.update({'class': 'form-select'})
+
+
+class StudySessionForm(Form):
+    shuffle = BooleanField(required=False, label='Shuffle')
+    learning_only = BooleanField(required=False, label='Only cards still being learned')
+    sample = IntegerField(required=False, min_value=1, label='Number of cards (all if empty)')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['shuffle'].widget.attrs.update({'class': 'form-check-input'})
+        self.fields['learning_only'].widget.attrs.update({'class': 'form-check-input'})
+        self.fields['sample'].widget.attrs.update({'class': 'form-control'})
+
+
+class CardCopyForm(Form):
+    question = CharField(widget=Textarea)
+    answer = CharField(widget=Textarea)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['question'].widget.attrs.update({'class': 'form-control', 'rows': '3'})
+        self.fields['answer'].widget.attrs.update({'class': 'form-control', 'rows': '3'})
@@ -0,0 +1,84 @@
+"""
+Resized variants of uploaded images.
+
+Every upload gets a thumbnail for deck tiles and a display size for cards, each
+as JPEG (PNG when the source has transparency) and, when Pillow was built with
+WebP support, as WebP. Variants are rendered once, by the image.variants
+background job, and stored next to the original; until then templates fall
+back to the original.
+"""
+import hashlib
+import io
+import os
+import re
+
+from django.core.files.base import ContentFile
+from PIL import Image as PILImage, ImageOps, features
+
+# Field name -> (bounding box, WebP?)
+VARIANTS = {
+    'thumbnail': ((400, 400), False),
+    'thumbnail_webp': ((400, 400), True),
+    'display': ((1024, 1024), False),
+    'display_webp': ((1024, 1024), True),
+}
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+# Files named after their SHA-256 never change, so they can be cached forever.
+CONTENT_ADDRESSED = re.compile(r'^images/[0-9a-f]{2}/[0-9a-f]{64}(_\w+)?\.\w+$')
+
+
+def content_hash(upload):
+    digest = hashlib.sha256()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    upload.seek(0)
+    return digest.hexdigest()
+
+
+def sharded_path(instance, filename):
+    """Spreads files over 256 sub-directories keyed on the leading characters of the name.
+
+    Content-addressed names start with the hex digest, so the shards fill evenly.
+    """
+    return os.path.join('images', filename[:2].lower(), filename)
+
+
+def webp_supported():
+    return features.check('webp')
+
+
+def render(source, size, webp):
+    """Returns ``(extension, bytes)`` of ``source`` scaled down to fit into ``size``."""
+    picture = source.copy()
+    picture.thumbnail(size, PILImage.LANCZOS)
+    output = io.BytesIO()
+    if webp:
+        picture.save(output, 'WEBP', quality=WEBP_QUALITY, method=4)
+        return 'webp', output.getvalue()
+    if picture.mode in ('RGBA', 'LA', 'P'):
+        picture.save(output, 'PNG', optimize=True)
+        return 'png', output.getvalue()
+    picture.convert('RGB').save(output, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return 'jpg', output.getvalue()
+
+
+def generate_variants(image):
+    """Fills the variant fields of ``image`` from its original file without saving the model."""
+    image.img.open('rb')
+    image.img.seek(0)
+    try:
+        with PILImage.open(image.img) as source:
+            source = ImageOps.exif_transpose(source)
+            source.load()
+    except (OSError, PILImage.DecompressionBombError):
+        # Not something Pillow can decode; templates fall back to the original.
+        return
+    finally:
+        image.img.seek(0)
+    stem = os.path.splitext(os.path.basename(image.img.name))[0]
+    for field, (size, webp) in VARIANTS.items():
+        if webp and not webp_supported():
+            continue
+        extension, data = render(source, size, webp)
+        getattr(image, field).save(f'{stem}_{field}.{extension}', ContentFile(data), save=False)
@@ -0,0 +1,176 @@
+"""
+Background jobs for work too slow for the request path.
+
+Views enqueue a job by kind with a JSON payload and return; the handler
+registered for the kind does the work later. Which backend takes the job is
+set by JOB_BACKEND: DatabaseBackend stores it as a Job row for the run_jobs
+worker, ImmediateBackend runs it in the enqueuing process once the current
+transaction commits. Workers claim due jobs with a conditional UPDATE, so
+several of them can share one queue. A failing job is retried with
+exponential backoff up to its max_attempts and then kept as FAILED, along
+with its traceback. Handlers may run more than once and are written to be
+idempotent.
+"""
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+DELETE_BATCH_SIZE = 1000
+
+_backends = {}
+
+
+class PermanentFailure(Exception):
+    """Raised by a handler for errors that retrying cannot fix."""
+
+
+def handler(kind):
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+
+class DatabaseBackend:
+    """Queues jobs in the Job table for the run_jobs worker."""
+
+    def enqueue(self, kind, payload):
+        from .models import Job
+
+        return Job.objects.create(kind=kind, payload=payload, max_attempts=settings.JOB_MAX_ATTEMPTS)
+
+
+class ImmediateBackend:
+    """Runs jobs in-process after the current transaction commits, without retries."""
+
+    def enqueue(self, kind, payload):
+        transaction.on_commit(lambda: self.run(kind, payload))
+
+    def run(self, kind, payload):
+        try:
+            HANDLERS[kind](**payload)
+        except Exception:
+            logger.exception('Job %s failed', kind)
+
+
+def backend():
+    path = settings.JOB_BACKEND
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
+
+
+def enqueue(kind, **payload):
+    if kind not in HANDLERS:
+        raise ValueError(f'No handler for job kind {kind!r}.')
+    return backend().enqueue(kind, payload)
+
+
+def claim(worker, limit):
+    """Locks up to ``limit`` due jobs for ``worker`` and returns them."""
+    from .models import Job
+
+    due = Job.objects.filter(status=Job.Status.QUEUED, run_after__lte=timezone.now())
+    ids = list(due.order_by('run_after', 'id').values_list('id', flat=True)[:limit])
+    if not ids:
+        return []
+    # Another worker may have claimed some of them in between; the status
+    # condition makes sure each job goes to only one.
+    due.filter(id__in=ids).update(
+        status=Job.Status.RUNNING, locked_by=worker, locked_at=timezone.now(), attempts=F('attempts') + 1
+    )
+    return list(Job.objects.filter(id__in=ids, status=Job.Status.RUNNING, locked_by=worker))
+
+
+def run(job):
+    """Runs a claimed job; it is deleted when done and otherwise retried or marked FAILED."""
+    from .models import Job
+
+    function = HANDLERS.get(job.kind)
+    try:
+        if function is None:
+            raise PermanentFailure(f'No handler for job kind {job.kind!r}.')
+        function(**job.payload)
+    except Exception as error:
+        job.last_error = traceback.format_exc()
+        job.locked_by = ''
+        job.locked_at = None
+        if isinstance(error, PermanentFailure) or job.attempts >= job.max_attempts:
+            logger.exception('Job %s %s failed for good', job.id, job.kind)
+            job.status = Job.Status.FAILED
+        else:
+            logger.warning('Job %s %s failed, attempt %s of %s', job.id, job.kind, job.attempts, job.max_attempts)
+            job.status = Job.Status.QUEUED
+            job.run_after = timezone.now() + timedelta(seconds=settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1))
+        job.save(update_fields=['status', 'run_after', 'locked_by', 'locked_at', 'last_error'])
+        return False
+    Job.objects.filter(id=job.id).delete()
+    return True
+
+
+def requeue_stale():
+    """Queues again the jobs whose worker died or hung; returns how many there were."""
+    from .models import Job
+
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT)
+    return Job.objects.filter(status=Job.Status.RUNNING, locked_at__lt=cutoff).update(
+        status=Job.Status.QUEUED, locked_by='', locked_at=None
+    )
+
+
+def run_pending(worker='inline', limit=100):
+    """Runs every due job in this thread and returns how many succeeded."""
+    done = 0
+    while True:
+        jobs = claim(worker, limit)
+        if not jobs:
+            return done
+        done += sum(run(job) for job in jobs)
+
+
+@handler('image.variants')
+def generate_image_variants(image_id):
+    from .models import Image
+
+    image = Image.objects.filter(id=image_id).first()
+    if image is not None and not image.thumbnail:
+        image.generate_variants()
+
+
+@handler('deck.delete')
+def delete_deck(deck_id):
+    """Deletes the cards in short transactions, so writers are never locked out for long."""
+    from .models import Deck, Card
+
+    while True:
+        with transaction.atomic():
+            ids = list(Card.objects.filter(deck_id=deck_id).values_list('id', flat=True)[:DELETE_BATCH_SIZE])
+            if not ids:
+                break
+            Card.objects.filter(id__in=ids).delete()
+    Deck.all_objects.filter(id=deck_id).delete()
+
+
+@handler('deck.import')
+def import_deck(deck_id, path, fmt):
+    from .models import Deck
+    from .transfer import import_cards, ImportFailed
+
+    try:
+        if Deck.objects.filter(id=deck_id).exists():
+            with default_storage.open(path, 'rb') as stream:
+                import_cards(deck_id, stream, fmt)
+    except ImportFailed as error:
+        default_storage.delete(path)
+        raise PermanentFailure(str(error)) from error
+    default_storage.delete(path)
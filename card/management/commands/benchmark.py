@@ -0,0 +1,76 @@
+import json
+import os
+import platform
+import shutil
+import tempfile
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from card import reviews
+from card.benchmarks import SCENARIOS
+
+
+def as_text(result):
+    return ' '.join(f'{key}={value}' for key, value in result.items())
+
+
+class Command(BaseCommand):
+    help = 'Runs a benchmark scenario against a throwaway test database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=sorted(SCENARIOS))
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000])
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--reviews', type=int, default=100000, help='Reviews simulated by due-queue.')
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16],
+                            help='Concurrent learners for concurrent-writes, study-entrypoints and http.')
+        parser.add_argument('--users', type=int, default=100, help='Authors sharing the corpus in search.')
+        parser.add_argument('--duration', type=float, default=5.0, help='Seconds per concurrent-writes and http run.')
+        parser.add_argument('--format', choices=['text', 'json'], default='text',
+                            help='json writes one document with the options, the environment and all results.')
+        parser.add_argument('--output', help='File to write the results to instead of stdout.')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1.')
+        old_name = connection.settings_dict['NAME']
+        directory = None
+        if connection.vendor == 'sqlite':
+            # A real file, so WAL and locking behave as they do in production
+            # rather than as a shared-cache in-memory database.
+            directory = tempfile.mkdtemp(prefix='learn-it-bench-')
+            connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        results = []
+        try:
+            for result in SCENARIOS[options['scenario']](options):
+                results.append(result)
+                if options['format'] == 'text' and not options['output']:
+                    self.stdout.write(as_text(result))
+        finally:
+            reviews.flush()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            if directory:
+                shutil.rmtree(directory, ignore_errors=True)
+        if options['format'] == 'json':
+            report = json.dumps({
+                'scenario': options['scenario'],
+                'options': {name: options[name] for name in ('sizes', 'repeat', 'reviews', 'workers', 'users', 'duration')},
+                'environment': {
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                    'database': connection.vendor,
+                    'machine': platform.machine(),
+                    'cpus': os.cpu_count(),
+                },
+                'results': results,
+            }, indent=2, sort_keys=True, default=str)
+        else:
+            report = '\n'.join(as_text(result) for result in results)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report + '\n')
+        elif options['format'] == 'json':
+            self.stdout.write(report)
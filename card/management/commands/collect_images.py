@@ -0,0 +1,90 @@
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef, ProtectedError, Q
+from django.utils import timezone
+
+from card.models import Image, Deck, Card, CardProgress
+
+
+class Command(BaseCommand):
+    help = 'Deletes images that no deck or card refers to, together with their files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--min-age', type=int, default=60,
+            help='Only collect images uploaded at least this many minutes ago, so uploads '
+                 'that are about to be attached are left alone.'
+        )
+        parser.add_argument(
+            '--sweep-files', action='store_true',
+            help='Also delete files in the image shards that belong to no Image row.'
+        )
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(minutes=options['min_age'])
+        rows, files = self.collect_rows(cutoff, options['batch_size'], options['dry_run'])
+        self.stdout.write(f'{"Would delete" if options["dry_run"] else "Deleted"} {rows} image(s) and {files} file(s).')
+        if options['sweep_files']:
+            swept = self.sweep_files(cutoff, options['batch_size'], options['dry_run'])
+            self.stdout.write(f'{"Would sweep" if options["dry_run"] else "Swept"} {swept} orphaned file(s).')
+
+    def collect_rows(self, cutoff, batch_size, dry_run):
+        unreferenced = Image.objects.filter(uploaded_at__lt=cutoff).filter(
+            ~Exists(Deck.all_objects.filter(img=OuterRef('pk'))),
+            ~Exists(Card.objects.filter(question_img=OuterRef('pk'))),
+            ~Exists(Card.objects.filter(answer_img=OuterRef('pk'))),
+            ~Exists(CardProgress.objects.filter(Q(question_img=OuterRef('pk')) | Q(answer_img=OuterRef('pk')))),
+        )
+        rows = files = 0
+        last_id = 0
+        while True:
+            batch = list(unreferenced.filter(id__gt=last_id).order_by('id')[:batch_size])
+            if not batch:
+                return rows, files
+            last_id = batch[-1].id
+            if not dry_run:
+                try:
+                    with transaction.atomic():
+                        unreferenced.filter(id__in=[image.id for image in batch]).delete()
+                except ProtectedError:
+                    # Re-attached while we were looking; the next run will see it again.
+                    continue
+                kept = set(Image.objects.filter(id__in=[image.id for image in batch]).values_list('id', flat=True))
+                batch = [image for image in batch if image.id not in kept]
+            for image in batch:
+                for name in image.file_names():
+                    if not dry_run:
+                        default_storage.delete(name)
+                    files += 1
+            rows += len(batch)
+
+    def sweep_files(self, cutoff, batch_size, dry_run):
+        """Walks the two-character shard directories one at a time, in ``batch_size`` chunks."""
+        swept = 0
+        try:
+            shards = default_storage.listdir('images')[0]
+        except FileNotFoundError:
+            return swept
+        for shard in sorted(shards):
+            if len(shard) != 2:
+                continue
+            names = [f'images/{shard}/{name}' for name in default_storage.listdir(f'images/{shard}')[1]]
+            for start in range(0, len(names), batch_size):
+                chunk = names[start:start + batch_size]
+                referenced = set()
+                for field in Image.FILE_FIELDS:
+                    referenced.update(
+                        Image.objects.filter(**{f'{field}__in': chunk}).values_list(field, flat=True)
+                    )
+                for name in chunk:
+                    if name in referenced or default_storage.get_modified_time(name) >= cutoff:
+                        continue
+                    if not dry_run:
+                        default_storage.delete(name)
+                    swept += 1
+        return swept
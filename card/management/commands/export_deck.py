@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from card.models import Deck
+from card.transfer import FORMATS, guess_format, export_cards
+
+
+class Command(BaseCommand):
+    help = 'Writes the cards of a deck as CSV or JSON Lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('deck', type=int)
+        parser.add_argument('path', nargs='?', help='Output file (default: standard output).')
+        parser.add_argument('--format', choices=FORMATS)
+
+    def handle(self, *args, **options):
+        if not Deck.objects.filter(id=options['deck']).exists():
+            raise CommandError(f'Deck {options["deck"]} does not exist.')
+        fmt = options['format'] or guess_format(options['path'] or '')
+        if options['path']:
+            with open(options['path'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(export_cards(options['deck'], fmt))
+        else:
+            for chunk in export_cards(options['deck'], fmt):
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from card.models import Deck
+from card.transfer import FORMATS, ImportFailed, guess_format, import_cards
+
+
+class Command(BaseCommand):
+    help = 'Appends the cards of a CSV or JSON Lines file to a deck.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('deck', type=int)
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS)
+
+    def handle(self, *args, **options):
+        if not Deck.objects.filter(id=options['deck']).exists():
+            raise CommandError(f'Deck {options["deck"]} does not exist.')
+        try:
+            with open(options['path'], 'rb') as stream:
+                added = import_cards(options['deck'], stream, options['format'] or guess_format(options['path']))
+        except (OSError, ImportFailed) as error:
+            raise CommandError(error)
+        self.stdout.write(f'Imported {added} card(s).')
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, F
+
+from card.models import Deck, Card, Subscription
+
+
+class Command(BaseCommand):
+    help = 'Numbers the cards of each deck 1, 2, 3... in the order they were created.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('decks', type=int, nargs='*', help='Deck ids to renumber (default: all decks).')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        decks = Deck.all_objects.order_by('id')
+        if options['decks']:
+            decks = decks.filter(id__in=options['decks'])
+        numbered = 0
+        for deck_id in decks.values_list('id', flat=True):
+            numbered += self.number(deck_id, options['batch_size'])
+        self.stdout.write(f'Numbered {numbered} card(s).')
+
+    def number(self, deck_id, batch_size):
+        with transaction.atomic():
+            Deck.all_objects.select_for_update().filter(id=deck_id).first()
+            cards = list(Card.objects.filter(deck_id=deck_id).order_by('id').only('id', 'position'))
+            if not cards:
+                return 0
+            # Park every card above both the old and the new range first, so the
+            # (deck, position) unique constraint, where it exists, holds throughout.
+            last = Card.objects.filter(deck_id=deck_id).aggregate(last=Max('position'))['last']
+            Card.objects.filter(deck_id=deck_id).update(position=F('position') + last + len(cards) + 1)
+            for position, card in enumerate(cards, 1):
+                card.position = position
+            Card.objects.bulk_update(cards, ['position'], batch_size=batch_size)
+            for subscription in Subscription.objects.filter(deck_id=deck_id):
+                subscription.rebuild_bits()
+            Deck.touch(deck_id)
+        return len(cards)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery, Count, Q, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from card.models import Deck, Card
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the card_count and mastered_count columns of decks from their cards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('decks', type=int, nargs='*', help='Deck ids to rebuild (default: all decks).')
+
+    def handle(self, *args, **options):
+        counts = Card.objects.filter(deck=OuterRef('pk')).order_by().values('deck').annotate(
+            cards=Count('id'),
+            mastered=Count('id', filter=Q(status=Card.QuestionStatus.MASTERED))
+        )
+        decks = Deck.objects.all()
+        if options['decks']:
+            decks = decks.filter(id__in=options['decks'])
+        updated = decks.update(
+            card_count=Coalesce(Subquery(counts.values('cards')), Value(0)),
+            mastered_count=Coalesce(Subquery(counts.values('mastered')), Value(0)),
+            # Deck ETags and cached fragments are keyed on updated_at.
+            updated_at=timezone.now()
+        )
+        self.stdout.write(f'Rebuilt counters for {updated} deck(s).')
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from card import search
+
+
+class Command(BaseCommand):
+    help = 'Creates the full-text search index if needed and refills it from all cards.'
+
+    def handle(self, *args, **options):
+        search.create_index()
+        search.rebuild()
+        self.stdout.write('Rebuilt the card search index.')
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, Count, Q, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from card import reviews
+from card.models import Deck, Card, DeckDay, ReviewEvent
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the daily deck rollups and card lapses from the review log.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('decks', type=int, nargs='*', help='Deck ids to rebuild (default: all decks).')
+
+    def handle(self, *args, **options):
+        reviews.flush()
+        decks = Deck.objects.all()
+        if options['decks']:
+            decks = decks.filter(id__in=options['decks'])
+        events = ReviewEvent.objects.filter(card__deck__in=decks)
+        days = events.annotate(
+            day=TruncDate('reviewed_at', tzinfo=timezone.get_current_timezone())
+        ).order_by().values('card__deck_id', 'day').annotate(
+            reviews=Count('id'),
+            learned=Count('id', filter=Q(mastered=True)),
+            forgotten=Count('id', filter=Q(mastered=False))
+        )
+        lapses = events.filter(card=OuterRef('pk'), mastered=False).order_by().values('card').annotate(n=Count('id'))
+        with transaction.atomic():
+            DeckDay.objects.filter(deck__in=decks).delete()
+            rows = DeckDay.objects.bulk_create((
+                DeckDay(deck_id=day['card__deck_id'], day=day['day'], reviews=day['reviews'],
+                        learned=day['learned'], forgotten=day['forgotten'])
+                for day in days
+            ), batch_size=1000)
+            # Past mastery snapshots are not in the log; the latest day gets the current count.
+            for deck in decks.only('id', 'mastered_count'):
+                DeckDay.objects.filter(id__in=Subquery(
+                    DeckDay.objects.filter(deck=deck).order_by('-day').values('id')[:1]
+                )).update(mastered=deck.mastered_count)
+            Card.objects.filter(deck__in=decks).update(lapses=Coalesce(Subquery(lapses.values('n')), Value(0)))
+        self.stdout.write(f'Rebuilt {len(rows)} daily rollup(s).')
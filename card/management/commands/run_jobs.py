@@ -0,0 +1,61 @@
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from card import jobs, reviews
+
+
+def run_job(job):
+    try:
+        return jobs.run(job)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background jobs until interrupted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.JOB_CONCURRENCY,
+                            help='Jobs run at the same time.')
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds between looks at an empty queue.')
+        parser.add_argument('--once', action='store_true', help='Run the jobs that are due now, then exit.')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be at least 1.')
+        worker = f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+        if options['once']:
+            jobs.requeue_stale()
+            done = jobs.run_pending(worker)
+            reviews.flush()
+            self.stdout.write(f'Ran {done} job(s).')
+            return
+        running = set()
+        last_sweep = 0.0
+        executor = ThreadPoolExecutor(max_workers=options['concurrency'], thread_name_prefix='job')
+        try:
+            while True:
+                if time.monotonic() - last_sweep >= settings.JOB_TIMEOUT / 10:
+                    stale = jobs.requeue_stale()
+                    if stale:
+                        self.stderr.write(f'Requeued {stale} stale job(s).')
+                    last_sweep = time.monotonic()
+                free = options['concurrency'] - len(running)
+                claimed = jobs.claim(worker, free) if free else []
+                running.update(executor.submit(run_job, job) for job in claimed)
+                if running:
+                    running = wait(running, timeout=options['poll'], return_when=FIRST_COMPLETED).not_done
+                else:
+                    time.sleep(options['poll'])
+        except KeyboardInterrupt:
+            self.stdout.write(f'Stopping; waiting for {len(running)} running job(s).')
+        finally:
+            executor.shutdown(wait=True)
+            reviews.flush()
@@ -0,0 +1,62 @@
+"""
+Mastery bitmaps of subscriptions.
+
+A subscriber's statuses are kept as one bit per card of the shared deck, bit
+``position - 1`` being set when the card at that position is MASTERED. The
+bitmap is stored little-endian with trailing zero bytes dropped, so a
+10,000-card deck costs at most 1,250 bytes per subscriber and a fresh
+subscription nothing. Counting, finding the next card still being learned
+and resetting are integer operations on the whole bitmap instead of queries
+over CardProgress rows.
+"""
+
+
+def _value(bits):
+    return int.from_bytes(bits, 'little')
+
+
+def _bytes(value):
+    return value.to_bytes((value.bit_length() + 7) // 8, 'little')
+
+
+def is_mastered(bits, position):
+    index = position - 1
+    return index // 8 < len(bits) and bool(bits[index // 8] >> (index % 8) & 1)
+
+
+def set_mastered(bits, position, mastered):
+    value = _value(bits)
+    if mastered:
+        value |= 1 << (position - 1)
+    else:
+        value &= ~(1 << (position - 1))
+    return _bytes(value)
+
+
+def count(bits):
+    return bin(_value(bits)).count('1')
+
+
+def next_learning(bits, after, length):
+    """The first position after ``after`` and up to ``length`` whose bit is clear, or -1."""
+    if after >= length:
+        return -1
+    learning = ~_value(bits) & ((1 << length) - 1)
+    learning >>= after
+    if not learning:
+        return -1
+    return after + (learning & -learning).bit_length()
+
+
+def remove_position(bits, position):
+    """Drops the bit of ``position``, moving every later one down, as Card.close_gap does with cards."""
+    value = _value(bits)
+    low = value & ((1 << (position - 1)) - 1)
+    return _bytes(low | value >> position << (position - 1))
+
+
+def from_positions(positions):
+    value = 0
+    for position in positions:
+        value |= 1 << (position - 1)
+    return _bytes(value)
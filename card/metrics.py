@@ -0,0 +1,173 @@
+"""
+Per-request metrics, aggregated in process and exported in the Prometheus text format.
+
+card.middleware.MetricsMiddleware opens a RequestStats for every request and
+files it under the URL name, method and status once the response is ready.
+While it is open, the execute wrapper installed on every connection counts
+the queries and their time, and the template backend below times renders.
+Outside of a measured request both only cost a context variable lookup.
+Like the review log, the aggregates are per process; Prometheus sums them
+over the workers it scrapes.
+"""
+import contextvars
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates as BaseDjangoTemplates
+
+PREFIX = 'learn_it'
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+current = contextvars.ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'sql', 'template')
+
+    def __init__(self):
+        self.queries = 0
+        self.sql = 0.0
+        self.template = 0.0
+
+
+class Series:
+    __slots__ = ('count', 'duration', 'view', 'template', 'sql', 'queries', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.view = 0.0
+        self.template = 0.0
+        self.sql = 0.0
+        self.queries = 0
+        self.buckets = [0] * len(BUCKETS)
+
+
+_lock = threading.Lock()
+_series = {}
+_profiles = {}
+
+
+def record_query(execute, sql, params, many, context):
+    stats = current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.sql += time.perf_counter() - start
+
+
+def instrument(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class TimedTemplate:
+    """A backend template whose renders count towards the current request."""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        stats = current.get()
+        if stats is None:
+            return self.template.render(context, request)
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            stats.template += time.perf_counter() - start
+
+
+class DjangoTemplates(BaseDjangoTemplates):
+    """The Django template backend, with renders timed for the metrics."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+def observe(view, method, status, stats, duration):
+    """Adds one finished request; ``duration`` covers the view and its template rendering."""
+    with _lock:
+        series = _series.get((view, method, status))
+        if series is None:
+            series = _series[view, method, status] = Series()
+        series.count += 1
+        series.duration += duration
+        series.view += duration - stats.template
+        series.template += stats.template
+        series.sql += stats.sql
+        series.queries += stats.queries
+        for i, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                series.buckets[i] += 1
+
+
+def save_profile(view, profiler):
+    """Writes a sampled profile to PROFILE_DIR/<view>/, readable with pstats or snakeviz."""
+    directory = os.path.join(settings.PROFILE_DIR, view)
+    os.makedirs(directory, exist_ok=True)
+    profiler.dump_stats(os.path.join(directory, f'{time.time():.6f}.prof'))
+    with _lock:
+        _profiles[view] = _profiles.get(view, 0) + 1
+
+
+def reset():
+    with _lock:
+        _series.clear()
+        _profiles.clear()
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels.items()) + '}'
+
+
+def exposition():
+    """The aggregates in the Prometheus text exposition format."""
+    from . import reviews
+
+    with _lock:
+        series = sorted((key, (s.count, s.duration, s.view, s.template, s.sql, s.queries, s.buckets[:]))
+                        for key, s in _series.items())
+        profiles = sorted(_profiles.items())
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+        lines.append(f'# TYPE {PREFIX}_{name} {kind}')
+        lines.extend(f'{PREFIX}_{name}{suffix} {value}' for suffix, value in samples)
+
+    def per_series(field):
+        return [(_labels(view=view, method=method, status=status), values[field])
+                for (view, method, status), values in series]
+
+    histogram = []
+    for (view, method, status), (count, duration, *_, buckets) in series:
+        for bound, observed in zip(BUCKETS, buckets):
+            histogram.append((f'_bucket{_labels(view=view, method=method, status=status, le=bound)}', observed))
+        histogram.append((f'_bucket{_labels(view=view, method=method, status=status, le="+Inf")}', count))
+        histogram.append((f'_sum{_labels(view=view, method=method, status=status)}', round(duration, 6)))
+        histogram.append((f'_count{_labels(view=view, method=method, status=status)}', count))
+    metric('request_duration_seconds', 'histogram', 'Time spent in the view and its template rendering.', histogram)
+    metric('request_view_seconds_total', 'counter', 'Time spent in views, excluding template rendering.',
+           [(labels, round(value, 6)) for labels, value in per_series(2)])
+    metric('request_template_seconds_total', 'counter', 'Time spent rendering templates.',
+           [(labels, round(value, 6)) for labels, value in per_series(3)])
+    metric('request_sql_seconds_total', 'counter', 'Time spent executing SQL.',
+           [(labels, round(value, 6)) for labels, value in per_series(4)])
+    metric('request_sql_queries_total', 'counter', 'SQL queries executed.', per_series(5))
+    metric('profiles_total', 'counter', 'Requests profiled with cProfile.',
+           [(_labels(view=view), count) for view, count in profiles])
+    metric('review_log_pending', 'gauge', 'Review events waiting to be flushed.', [('', reviews.pending())])
+    return '\n'.join(lines) + '\n'
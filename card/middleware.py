@@ -0,0 +1,78 @@
+import asyncio
+import cProfile
+import random
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.urls import Resolver404, resolve
+
+from . import metrics
+
+
+class MetricsMiddleware:
+    """Records the time, SQL and template rendering of every request in card.metrics.
+
+    It goes last in MIDDLEWARE, so the numbers cover the view and its
+    template rendering rather than the other middleware. Requests for the URL
+    names in PROFILE_URL_NAMES are also run under cProfile, a
+    PROFILE_SAMPLE_RATE fraction of them, when served through WSGI. Under
+    ASGI views run on other threads, out of the profiler's reach.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Marks the instance as a coroutine function, so Django awaits __call__.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        for connection in connections.all():
+            metrics.instrument(connection)
+        profiled = self.profiled_view(request)
+        profiler = cProfile.Profile() if profiled else None
+        stats = metrics.RequestStats()
+        token = metrics.current.set(stats)
+        start = time.perf_counter()
+        try:
+            if profiler:
+                profiler.enable()
+            response = self.get_response(request)
+        finally:
+            if profiler:
+                profiler.disable()
+            metrics.current.reset(token)
+        self.observe(request, response, stats, time.perf_counter() - start)
+        if profiler:
+            metrics.save_profile(profiled, profiler)
+        return response
+
+    async def __acall__(self, request):
+        stats = metrics.RequestStats()
+        token = metrics.current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.current.reset(token)
+        self.observe(request, response, stats, time.perf_counter() - start)
+        return response
+
+    def profiled_view(self, request):
+        """The URL name of the request if it is sampled for profiling, else None."""
+        if not settings.PROFILE_URL_NAMES or random.random() >= settings.PROFILE_SAMPLE_RATE:
+            return None
+        try:
+            url_name = resolve(request.path_info).url_name
+        except Resolver404:
+            return None
+        return url_name if url_name in settings.PROFILE_URL_NAMES else None
+
+    def observe(self, request, response, stats, duration):
+        match = request.resolver_match
+        view = match.url_name if match and match.url_name else 'unmatched'
+        metrics.observe(view, request.method, response.status_code, stats, duration)
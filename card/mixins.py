@@ -0,0 +1,78 @@
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.http import Http404
+
+from .cache import owned_deck_ids, invalidate_owned_decks
+from .models import Deck
+
+
+def owns_deck(user, deck_pk):
+    """Whether ``user`` is the author of the deck; raises Http404 if there is no such deck.
+
+    Decks never change hands and their ids are never reused, so a hit in the
+    cached id set is final. A miss is checked against the database, because
+    the deck may have been created by another worker since the set was cached.
+    """
+    if deck_pk in owned_deck_ids(user):
+        return True
+    author_id = Deck.objects.filter(id=deck_pk).values_list('author_id', flat=True).first()
+    if author_id is None:
+        raise Http404()
+    if author_id == user.id:
+        invalidate_owned_decks(user.id)
+        return True
+    return False
+
+
+class DeckOwnerMixin(LoginRequiredMixin, UserPassesTestMixin):
+    """Only lets the author of the deck named by ``deck_url_kwarg`` through.
+
+    The object of single-object views is fetched once per request and reused.
+    """
+    login_url = '/accounts/login/'
+    redirect_field_name = 'login'
+    deck_url_kwarg = 'pk'
+
+    def test_func(self):
+        deck_pk = self.kwargs[self.deck_url_kwarg]
+        if deck_pk in getattr(self.request, 'owned_deck_ids', ()):
+            return True
+        return owns_deck(self.request.user, deck_pk)
+
+    def get_object(self, queryset=None):
+        if not hasattr(self, '_object'):
+            self._object = super().get_object(queryset)
+        return self._object
+
+
+class PositionPageMixin:
+    """Pages through a deck by card position (``?after=`` / ``?before=``).
+
+    Unlike OFFSET pagination, every page is a range scan on the (deck, position)
+    index, so late pages cost the same as the first one.
+    """
+    page_size = 60
+
+    def get_position(self, name):
+        try:
+            return max(0, int(self.request.GET[name]))
+        except (KeyError, ValueError):
+            return None
+
+    def get_page(self, cards):
+        before = self.get_position('before')
+        if before is not None:
+            page = list(cards.filter(position__lt=before).order_by('-position')[:self.page_size + 1])
+            self.has_previous = len(page) > self.page_size
+            self.has_next = True
+            return page[:self.page_size][::-1]
+        page = list(cards.filter(position__gt=self.get_position('after') or 0).order_by('position')[:self.page_size + 1])
+        self.has_previous = bool(self.get_position('after'))
+        self.has_next = len(page) > self.page_size
+        return page[:self.page_size]
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        cards = context[self.context_object_name]
+        context['previous_before'] = cards[0].position if cards and self.has_previous else None
+        context['next_after'] = cards[-1].position if cards and self.has_next else None
+        return context
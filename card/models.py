@@ -1,38 +1,173 @@
-from django.db.models import Model, CharField, ForeignKey, CASCADE, TextField, TextChoices, ImageField, DO_NOTHING
+import os
+import random
+import struct
+
+from django.db import transaction, IntegrityError
+from django.db.models import Model, CharField, ForeignKey, CASCADE, PROTECT, TextField, TextChoices, ImageField, \
+    PositiveIntegerField, PositiveSmallIntegerField, FloatField, DateField, DateTimeField, BooleanField, BinaryField, \
+    JSONField, Manager, Index, UniqueConstraint, \
+    Max, F, Q
+from django.db.models.functions import Substr
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.utils import timezone
+
+from . import images, jobs, mastery, scheduler, reviews, search
 
 
 class Image(Model):
-    img = ImageField(upload_to='images')
+    img = ImageField(upload_to=images.sharded_path)
+    thumbnail = ImageField(upload_to=images.sharded_path, blank=True)
+    thumbnail_webp = ImageField(upload_to=images.sharded_path, blank=True)
+    display = ImageField(upload_to=images.sharded_path, blank=True)
+    display_webp = ImageField(upload_to=images.sharded_path, blank=True)
+    sha256 = CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
+    uploaded_at = DateTimeField(default=timezone.now, editable=False)
+
+    FILE_FIELDS = ('img', 'thumbnail', 'thumbnail_webp', 'display', 'display_webp')
 
     def __str__(self):
         return self.img.name
 
+    @classmethod
+    def from_upload(cls, upload):
+        """Returns the image with the uploaded bytes, storing them only if they are new.
+
+        Files are named after the SHA-256 of their content, so identical uploads
+        share one row and one set of files.
+        """
+        digest = images.content_hash(upload)
+        image = cls.objects.filter(sha256=digest).first()
+        if image is not None:
+            return image
+        upload.name = digest + (os.path.splitext(upload.name)[1].lower() or '.jpg')
+        image = cls(img=upload, sha256=digest)
+        try:
+            with transaction.atomic():
+                image.save()
+        except IntegrityError:
+            # Someone stored the same bytes concurrently; their copy wins and
+            # ours is left for the garbage collector's file sweep.
+            return cls.objects.get(sha256=digest)
+        jobs.enqueue('image.variants', image_id=image.id)
+        return image
+
+    def file_names(self):
+        return [getattr(self, field).name for field in self.FILE_FIELDS if getattr(self, field)]
+
+    def generate_variants(self):
+        """Renders the missing variants; cached pages showing the image are re-rendered."""
+        from .cache import invalidate_deck_list
+
+        images.generate_variants(self)
+        self.save(update_fields=[field for field in self.FILE_FIELDS if field != 'img'])
+        Card.objects.filter(Q(question_img=self) | Q(answer_img=self)).update(version=F('version') + 1)
+        decks = Deck.all_objects.filter(Q(img=self) | Q(card__question_img=self) | Q(card__answer_img=self))
+        decks.update(updated_at=timezone.now())
+        # The UPDATE sends no deck_changed signal, so the cached deck lists
+        # would keep the old updated_at and with it the old fragments.
+        for author_id in decks.order_by().values_list('author_id', flat=True).distinct():
+            invalidate_deck_list(author_id)
+
+    @property
+    def variants(self):
+        """Variant URLs for templates; JPEG/PNG variants fall back to the original."""
+        return {
+            'thumbnail': (self.thumbnail or self.img).url,
+            'thumbnail_webp': self.thumbnail_webp.url if self.thumbnail_webp else None,
+            'display': (self.display or self.img).url,
+            'display_webp': self.display_webp.url if self.display_webp else None,
+        }
+
+
+class LiveDeckManager(Manager):
+    def get_queryset(self):
+        return super().get_queryset().filter(deleting=False)
+
 
 class Deck(Model):
     name = CharField(max_length=128)
     author = ForeignKey(User, on_delete=CASCADE, related_name='author')
-    img = ForeignKey(Image, on_delete=CASCADE, null=True, blank=True)
+    img = ForeignKey(Image, on_delete=PROTECT, null=True, blank=True)
+    card_count = PositiveIntegerField(default=0)
+    mastered_count = PositiveIntegerField(default=0)
+    # Stamped whenever the deck or any of its cards changes; versions the study bundle.
+    updated_at = DateTimeField(auto_now=True)
+    # Set by schedule_deletion; the deck is hidden until a job has removed it.
+    deleting = BooleanField(default=False)
+    # Other users may subscribe to shared decks; they study its cards without copying them.
+    shared = BooleanField(default=False)
+
+    objects = LiveDeckManager()
+    all_objects = Manager()
+
+    COUNTER_FIELDS = ('card_count', 'mastered_count')
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # Counters are only ever changed with F() updates, so a plain save of a
+        # stale instance must not write them back.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
     def get_absolute_url(self):
         return reverse('deck-detail', args=[str(self.id)])
 
+    def schedule_deletion(self):
+        """Hides the deck at once and leaves removing it and its cards to a background job."""
+        with transaction.atomic():
+            self.deleting = True
+            self.save(update_fields=['deleting'])
+            search.remove_deck(self.id)
+            jobs.enqueue('deck.delete', deck_id=self.id)
+
     def update_img(self, img):
         self.img = img
-        self.save()
+        self.save(update_fields=['img', 'updated_at'])
+
+    @staticmethod
+    def update_counters(deck_pk, cards=0, mastered=0):
+        """Adjusts the counters and stamps ``updated_at``, so it also marks the deck as changed."""
+        changes = {'updated_at': timezone.now()}
+        if cards:
+            changes['card_count'] = F('card_count') + cards
+        if mastered:
+            changes['mastered_count'] = F('mastered_count') + mastered
+        Deck.objects.filter(id=deck_pk).update(**changes)
+
+    @staticmethod
+    def touch(deck_pk):
+        Deck.objects.filter(id=deck_pk).update(updated_at=timezone.now())
+
+    def bundle_etag(self):
+        return Deck.etag(self.id, self.updated_at)
+
+    @staticmethod
+    def etag(deck_pk, updated_at):
+        return f'{deck_pk}-{int(updated_at.timestamp() * 1000000)}'
 
     @staticmethod
     def next_red_card_index(deck_pk, index):
-        cards = Card.objects.filter(deck__id=deck_pk)
-        for card in cards[index:]:
-            index += 1
-            if card.status == 'LEARNING':
-                return index
-        return -1
+        position = Card.objects.filter(
+            deck__id=deck_pk,
+            status=Card.QuestionStatus.LEARNING,
+            position__gt=index
+        ).order_by('position').values_list('position', flat=True).first()
+        return position if position is not None else -1
+
+    @staticmethod
+    def due_cards(deck_pk, now=None):
+        """Cards of the deck that are due for review, longest overdue first."""
+        return Card.objects.filter(
+            deck__id=deck_pk,
+            due__lte=now or timezone.now()
+        ).order_by('due', 'position')
 
 
 class Card(Model):
@@ -43,31 +178,462 @@ class Card(Model):
 
     deck = ForeignKey(Deck, on_delete=CASCADE)
     question = TextField()
-    question_img = ForeignKey(Image, on_delete=DO_NOTHING, related_name='question', null=True, blank=True)
+    question_img = ForeignKey(Image, on_delete=PROTECT, related_name='question', null=True, blank=True)
     answer = TextField()
-    answer_img = ForeignKey(Image, on_delete=DO_NOTHING, related_name='answer', null=True, blank=True)
+    answer_img = ForeignKey(Image, on_delete=PROTECT, related_name='answer', null=True, blank=True)
     status = CharField(
         max_length=24,
         choices=QuestionStatus.choices,
         default=QuestionStatus.LEARNING
     )
+    position = PositiveIntegerField(default=0)
+    repetitions = PositiveIntegerField(default=0)
+    interval = PositiveIntegerField(default=0)
+    ease = FloatField(default=scheduler.DEFAULT_EASE)
+    due = DateTimeField(default=timezone.now)
+    # Reviews that ended in LEARNING, counted by card.stats when the review log is flushed.
+    lapses = PositiveIntegerField(default=0)
+    # Bumped whenever CONTENT_FIELDS are saved; versions the cached template fragments of the card.
+    version = PositiveIntegerField(default=1)
+
+    class Meta:
+        ordering = ['position']
+        indexes = [
+            Index(fields=['deck', 'status', 'position'], name='card_deck_status_position'),
+            Index(fields=['deck', 'due', 'position'], name='card_deck_due'),
+            Index(fields=['deck', '-lapses', 'position'], name='card_deck_lapses'),
+        ]
+        constraints = [
+            UniqueConstraint(fields=['deck', 'position'], name='card_unique_deck_position'),
+        ]
+
+    # What the study bundle carries; changing any of them changes the deck's version.
+    BUNDLE_FIELDS = {'question', 'answer', 'question_img', 'answer_img', 'status', 'position'}
+    CONTENT_FIELDS = {'question', 'answer', 'question_img', 'answer_img'}
 
     def __str__(self):
         return self.question
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        card = super().from_db(db, field_names, values)
+        card._saved_status = card.__dict__.get('status')
+        return card
+
+    def is_mastered(self):
+        return self.status == Card.QuestionStatus.MASTERED
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            if self._state.adding:
+                if not self.position:
+                    Deck.objects.select_for_update().filter(id=self.deck_id).first()
+                    last = Card.objects.filter(deck_id=self.deck_id).aggregate(last=Max('position'))['last']
+                    self.position = (last or 0) + 1
+                super().save(*args, **kwargs)
+                Deck.update_counters(self.deck_id, cards=1, mastered=int(self.is_mastered()))
+            else:
+                update_fields = kwargs.get('update_fields')
+                if update_fields is None or self.CONTENT_FIELDS & set(update_fields):
+                    self.version += 1
+                    if update_fields is not None:
+                        kwargs['update_fields'] = [*update_fields, 'version']
+                super().save(*args, **kwargs)
+                saved_status = getattr(self, '_saved_status', None)
+                if saved_status is not None and saved_status != self.status:
+                    Deck.update_counters(self.deck_id, mastered=1 if self.is_mastered() else -1)
+                elif update_fields is None or self.BUNDLE_FIELDS & set(update_fields):
+                    Deck.touch(self.deck_id)
+            self._saved_status = self.status
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            search.remove_card(self.id)
+            result = super().delete(*args, **kwargs)
+            Card.close_gap(self.deck_id, self.position)
+            Subscription.remove_position(self.deck_id, self.position)
+            Deck.update_counters(self.deck_id, cards=-1, mastered=-int(self.is_mastered()))
+        return result
+
+    @staticmethod
+    def close_gap(deck_pk, position):
+        """Shifts every card after ``position`` one place down, keeping positions dense.
+
+        The shift goes through a range above the current maximum, so the
+        (deck, position) unique constraint holds after every single row update.
+        """
+        later = Card.objects.filter(deck__id=deck_pk, position__gt=position)
+        last = later.aggregate(last=Max('position'))['last']
+        if last is None:
+            return
+        later.update(position=F('position') + last)
+        Card.objects.filter(deck__id=deck_pk, position__gt=last).update(position=F('position') - last - 1)
+
+    @staticmethod
+    def update_status(deck_pk, position, status, author, card_id=None):
+        """Sets the status of the card at ``position`` in one of ``author``'s decks.
+
+        Returns True when a row actually changed, in which case the deck
+        counters are adjusted in the same transaction and the change is added
+        to the review log. Callers that know the card's id pass it as
+        ``card_id``; the UPDATE then checks id, position and author itself
+        and the lookup of the id is skipped.
+        """
+        if card_id is None:
+            card_id = Card.objects.filter(
+                deck__id=deck_pk,
+                deck__author=author,
+                position=position
+            ).exclude(status=status).values_list('id', flat=True).first()
+            if card_id is None:
+                return False
+            cards = Card.objects.filter(id=card_id)
+        else:
+            cards = Card.objects.filter(id=card_id, deck__id=deck_pk, deck__author=author, position=position)
+        with transaction.atomic():
+            changed = cards.exclude(status=status).update(status=status)
+            if changed:
+                mastered = status == Card.QuestionStatus.MASTERED
+                Deck.update_counters(deck_pk, mastered=1 if mastered else -1)
+                reviews.record(card_id, deck_pk, mastered)
+        return bool(changed)
+
+    @staticmethod
+    def update_statuses(deck_pk, statuses, author):
+        """Applies a batch of status changes to cards of one of ``author``'s decks.
+
+        ``statuses`` maps card ids to their new status, e.g. everything studied
+        during an offline session. Each status costs one read and one UPDATE
+        however many cards change, and the counters are adjusted once.
+        Returns the number of cards that changed.
+        """
+        changed = {}
+        with transaction.atomic():
+            for status in Card.QuestionStatus.values:
+                ids = [pk for pk, value in statuses.items() if value == status]
+                if not ids:
+                    continue
+                ids = list(Card.objects.filter(
+                    deck__id=deck_pk,
+                    deck__author=author,
+                    id__in=ids
+                ).exclude(status=status).values_list('id', flat=True))
+                if ids:
+                    changed[status] = Card.objects.filter(id__in=ids).exclude(status=status).update(status=status)
+                    for card_id in ids:
+                        reviews.record(card_id, deck_pk, status == Card.QuestionStatus.MASTERED)
+            if changed:
+                mastered = changed.get(Card.QuestionStatus.MASTERED, 0) - changed.get(Card.QuestionStatus.LEARNING, 0)
+                Deck.update_counters(deck_pk, mastered=mastered)
+        return sum(changed.values())
+
+    def review(self, grade, now=None):
+        """Reschedules the card after a review graded 0-5 and stores the result."""
+        now = now or timezone.now()
+        self.repetitions, self.interval, self.ease = scheduler.sm2(self.repetitions, self.interval, self.ease, grade)
+        self.due = scheduler.next_due(now, self.interval)
+        fields = ['repetitions', 'interval', 'ease', 'due']
+        status = Card.QuestionStatus.MASTERED if grade >= scheduler.PASSING_GRADE else Card.QuestionStatus.LEARNING
+        # Scheduling fields are not in the bundle, so the deck is only marked
+        # as changed when the status actually flips.
+        if status != self.status:
+            self.status = status
+            fields.append('status')
+        self.save(update_fields=fields)
+        reviews.record(self.id, self.deck_id, self.is_mastered(), grade, now)
+
     def mark_as_learned(self):
-        self.status = "MASTERED"
-        self.save()
+        self.set_status(Card.QuestionStatus.MASTERED)
 
     def mark_as_not_learned(self):
-        self.status = "LEARNING"
-        self.save()
+        self.set_status(Card.QuestionStatus.LEARNING)
+
+    def set_status(self, status):
+        if status == self.status:
+            return
+        self.status = status
+        self.save(update_fields=['status'])
+        reviews.record(self.id, self.deck_id, self.is_mastered())
 
     def update_question_img(self, img):
         self.question_img = img
-        self.save()
+        self.save(update_fields=['question_img'])
 
     def update_answer_img(self, img):
         self.answer_img = img
-        self.save()
+        self.save(update_fields=['answer_img'])
+
+
+class ReviewEvent(Model):
+    """One study result: a status change, or an SM-2 review with its grade."""
+    card = ForeignKey(Card, on_delete=CASCADE, related_name='reviews')
+    mastered = BooleanField()
+    grade = PositiveSmallIntegerField(null=True, blank=True)
+    reviewed_at = DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            Index(fields=['card', 'reviewed_at'], name='review_card_time'),
+        ]
+
+
+
+class DeckDay(Model):
+    """Study totals of one deck for one day, kept up to date by card.stats."""
+    deck = ForeignKey(Deck, on_delete=CASCADE, related_name='days')
+    day = DateField()
+    reviews = PositiveIntegerField(default=0)
+    learned = PositiveIntegerField(default=0)
+    forgotten = PositiveIntegerField(default=0)
+    # The deck's mastered_count as of the last review of the day.
+    mastered = PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['day']
+        constraints = [
+            UniqueConstraint(fields=['deck', 'day'], name='deckday_unique_deck_day'),
+        ]
+
+
+class StudySession(Model):
+    """A fixed study order over some of the cards of a deck.
+
+    The order is stored as a packed array of card ids, so the card at any
+    step is found by reading four bytes of it in the database, whatever the
+    size of the deck or the session.
+    """
+    ID_FORMAT = '<I'
+    ID_SIZE = struct.calcsize(ID_FORMAT)
+
+    user = ForeignKey(User, on_delete=CASCADE, related_name='study_sessions')
+    deck = ForeignKey(Deck, on_delete=CASCADE, related_name='study_sessions')
+    cards = BinaryField()
+    length = PositiveIntegerField()
+    created_at = DateTimeField(default=timezone.now)
+
+    @classmethod
+    def start(cls, user, deck_pk, shuffle=False, learning_only=False, sample=None, seed=None):
+        """Replaces ``user``'s session of the deck with a new one; None if no card qualifies.
+
+        The only read of the deck is its card ids, taken from the (deck,
+        status, position) index. ``sample`` picks that many of them at random,
+        kept in deck order unless ``shuffle`` is set.
+        """
+        cards = Card.objects.filter(deck__id=deck_pk)
+        if learning_only:
+            cards = cards.filter(status=Card.QuestionStatus.LEARNING)
+        ids = list(cards.order_by('position').values_list('id', flat=True))
+        rng = random.Random(seed)
+        if sample and sample < len(ids):
+            ids = [ids[i] for i in sorted(rng.sample(range(len(ids)), sample))]
+        if shuffle:
+            rng.shuffle(ids)
+        cls.objects.filter(user=user, deck_id=deck_pk).delete()
+        if not ids:
+            return None
+        return cls.objects.create(
+            user=user,
+            deck_id=deck_pk,
+            cards=struct.pack(f'<{len(ids)}I', *ids),
+            length=len(ids)
+        )
+
+    @classmethod
+    def step(cls, session_pk, user, step):
+        """``(deck_id, length, card_id)`` at the 1-based ``step`` of one of ``user``'s sessions, or None."""
+        if step < 1:
+            return None
+        row = cls.objects.filter(id=session_pk, user=user, length__gte=step).annotate(
+            card=Substr('cards', (step - 1) * cls.ID_SIZE + 1, cls.ID_SIZE, output_field=BinaryField())
+        ).values_list('deck_id', 'length', 'card').first()
+        if row is None:
+            return None
+        deck_id, length, card = row
+        return deck_id, length, struct.unpack(cls.ID_FORMAT, bytes(card))[0]
+
+
+class Subscription(Model):
+    """A user studying someone else's shared deck.
+
+    The cards stay in the shared deck and are read from there. The
+    subscriber's copies of the cards they edited, and their statuses, are
+    CardProgress rows, which only exist for cards the subscriber changed;
+    every other card is LEARNING and reads as the author wrote it. The
+    statuses are also kept in ``mastered_bits`` (see card.mastery), which
+    comes with the subscription and answers the deck-wide questions.
+    """
+    user = ForeignKey(User, on_delete=CASCADE, related_name='subscriptions')
+    deck = ForeignKey(Deck, on_delete=CASCADE, related_name='subscriptions')
+    mastered_bits = BinaryField(default=b'')
+    created_at = DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['user', 'deck'], name='subscription_unique_user_deck'),
+        ]
+
+    def get_absolute_url(self):
+        return reverse('subscription-detail', args=[str(self.id)])
+
+    def mastered_count(self):
+        return mastery.count(self.mastered_bits)
+
+    def next_red_card_index(self, index):
+        """Like Deck.next_red_card_index, with the subscriber's statuses."""
+        return mastery.next_learning(self.mastered_bits, index, self.deck.card_count)
+
+    def status_at(self, position):
+        if mastery.is_mastered(self.mastered_bits, position):
+            return Card.QuestionStatus.MASTERED
+        return Card.QuestionStatus.LEARNING
+
+    def card_at(self, position):
+        """The card at ``position`` as the subscriber sees it, or None."""
+        card = Card.objects.filter(deck__id=self.deck_id, position=position).select_related(
+            'question_img', 'answer_img'
+        ).first()
+        if card is None:
+            return None
+        card.status = self.status_at(position)
+        copy = self.progress.filter(card=card, edited=True).select_related('question_img', 'answer_img').first()
+        return copy.apply(card) if copy else card
+
+    def cards(self, cards):
+        """Applies the subscriber's statuses and copies to cards of the shared deck, in place."""
+        copies = {
+            row.card_id: row for row in self.progress.filter(
+                card__in=[card.id for card in cards], edited=True
+            ).select_related('question_img', 'answer_img')
+        }
+        for card in cards:
+            card.status = self.status_at(card.position)
+            if card.id in copies:
+                copies[card.id].apply(card)
+        return cards
+
+    def update_bits(self, change):
+        """Applies ``change`` to the bitmap in place; returns whether it changed.
+
+        The UPDATE only matches the bitmap ``change`` was computed from, so a
+        concurrent write makes it start over from the new one rather than
+        being lost.
+        """
+        while True:
+            bits = bytes(self.mastered_bits)
+            changed = change(bits)
+            if changed == bits:
+                return False
+            if Subscription.objects.filter(id=self.id, mastered_bits=bits).update(mastered_bits=changed):
+                self.mastered_bits = changed
+                return True
+            self.mastered_bits = Subscription.objects.values_list('mastered_bits', flat=True).get(id=self.id)
+
+    def set_status(self, card_id, status):
+        """Stores the subscriber's status of a card of the deck; returns whether it changed."""
+        position = Card.objects.filter(id=card_id, deck__id=self.deck_id).values_list('position', flat=True).first()
+        if position is None:
+            return False
+        mastered = status == Card.QuestionStatus.MASTERED
+        with transaction.atomic():
+            changed = self.progress.filter(card_id=card_id).exclude(status=status).update(status=status)
+            if not changed and mastered:
+                CardProgress.objects.get_or_create(subscription=self, card_id=card_id, defaults={'status': status})
+            return self.update_bits(lambda bits: mastery.set_mastered(bits, position, mastered))
+
+    def reset(self):
+        """Starts the deck over: every card LEARNING again, the subscriber's copies kept."""
+        with transaction.atomic():
+            self.progress.filter(edited=False).delete()
+            self.progress.update(status=Card.QuestionStatus.LEARNING)
+            Subscription.objects.filter(id=self.id).update(mastered_bits=b'')
+            self.mastered_bits = b''
+
+    def rebuild_bits(self):
+        """Recomputes the bitmap from the CardProgress rows."""
+        self.mastered_bits = mastery.from_positions(self.progress.filter(
+            status=Card.QuestionStatus.MASTERED
+        ).values_list('card__position', flat=True))
+        Subscription.objects.filter(id=self.id).update(mastered_bits=self.mastered_bits)
+
+    @staticmethod
+    def remove_position(deck_pk, position):
+        """Keeps the bitmaps in line with the deck after the card at ``position`` was deleted."""
+        for subscription in Subscription.objects.filter(deck__id=deck_pk).only('id', 'mastered_bits'):
+            if len(subscription.mastered_bits) * 8 >= position:
+                subscription.update_bits(lambda bits: mastery.remove_position(bits, position))
+
+    def edit(self, card, question, answer):
+        """Stores the subscriber's own version of a card of the deck, copying it on the first edit."""
+        with transaction.atomic():
+            copy, _ = CardProgress.objects.select_for_update().get_or_create(subscription=self, card=card, defaults={
+                'status': self.status_at(card.position),
+            })
+            if not copy.edited:
+                copy.edited = True
+                copy.question_img_id = card.question_img_id
+                copy.answer_img_id = card.answer_img_id
+            else:
+                copy.version += 1
+            copy.question = question
+            copy.answer = answer
+            copy.save()
+        return copy
+
+
+class CardProgress(Model):
+    """A subscriber's status of a card of a shared deck and, once edited, their copy of it."""
+    subscription = ForeignKey(Subscription, on_delete=CASCADE, related_name='progress')
+    card = ForeignKey(Card, on_delete=CASCADE, related_name='progress')
+    status = CharField(max_length=24, choices=Card.QuestionStatus.choices, default=Card.QuestionStatus.LEARNING)
+    # Set on the subscriber's first edit, when the content below is copied from the card.
+    edited = BooleanField(default=False)
+    question = TextField(blank=True)
+    question_img = ForeignKey(Image, on_delete=PROTECT, related_name='+', null=True, blank=True)
+    answer = TextField(blank=True)
+    answer_img = ForeignKey(Image, on_delete=PROTECT, related_name='+', null=True, blank=True)
+    version = PositiveIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            Index(fields=['subscription', 'status'], name='progress_subscription_status'),
+        ]
+        constraints = [
+            UniqueConstraint(fields=['subscription', 'card'], name='progress_unique_subscription_card'),
+        ]
+
+    def apply(self, card):
+        """Gives ``card`` the content of the subscriber's copy."""
+        card.question = self.question
+        card.answer = self.answer
+        card.question_img = self.question_img
+        card.answer_img = self.answer_img
+        # Template fragments are keyed on the card version; the copy gets its own.
+        card.version = f'{card.version}-{self.id}-{self.version}'
+        return card
+
+
+class Job(Model):
+    """A unit of background work for card.jobs, claimed by one worker at a time.
+
+    Finished jobs are deleted; failed ones stay with their last error.
+    """
+    class Status(TextChoices):
+        QUEUED = 'QUEUED', 'Queued'
+        RUNNING = 'RUNNING', 'Running'
+        FAILED = 'FAILED', 'Failed'
+
+    kind = CharField(max_length=64)
+    payload = JSONField(default=dict)
+    status = CharField(max_length=8, choices=Status.choices, default=Status.QUEUED)
+    attempts = PositiveSmallIntegerField(default=0)
+    max_attempts = PositiveSmallIntegerField(default=5)
+    run_after = DateTimeField(default=timezone.now)
+    locked_by = CharField(max_length=128, blank=True)
+    locked_at = DateTimeField(null=True, blank=True)
+    last_error = TextField(blank=True)
+    created_at = DateTimeField(default=timezone.now)
 
+    class Meta:
+        indexes = [
+            Index(fields=['status', 'run_after'], name='job_status_due'),
+        ]
@@ -0,0 +1,91 @@
+"""
+Buffered review log.
+
+Study clicks only change the card itself on the request path. The review
+history is kept in a per-process buffer once the click's transaction commits
+and written to ReviewEvent with one bulk INSERT per batch, when the buffer
+reaches REVIEW_LOG_BATCH_SIZE events or its oldest event is older than
+REVIEW_LOG_FLUSH_SECONDS. The same flush folds the batch into the daily
+rollups of card.stats. Whatever is left is flushed when the process exits.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction, DatabaseError, IntegrityError
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_buffer = []
+_oldest = None
+
+
+def record(card_id, deck_id, mastered, grade=None, reviewed_at=None):
+    """Logs a review of the card once the current transaction commits."""
+    event = (card_id, deck_id, mastered, grade, reviewed_at or timezone.now())
+    transaction.on_commit(lambda: _append(event))
+
+
+def _append(event):
+    global _oldest
+    with _lock:
+        if not _buffer:
+            _oldest = time.monotonic()
+        _buffer.append(event)
+        full = len(_buffer) >= getattr(settings, 'REVIEW_LOG_BATCH_SIZE', 200)
+        stale = time.monotonic() - _oldest >= getattr(settings, 'REVIEW_LOG_FLUSH_SECONDS', 10)
+    if full or stale:
+        flush()
+
+
+def pending():
+    with _lock:
+        return len(_buffer)
+
+
+def buffered():
+    """A copy of the events waiting to be flushed."""
+    with _lock:
+        return _buffer[:]
+
+
+def _store(batch):
+    from .models import ReviewEvent
+    from . import stats
+
+    with transaction.atomic():
+        ReviewEvent.objects.bulk_create([
+            ReviewEvent(card_id=card_id, mastered=mastered, grade=grade, reviewed_at=reviewed_at)
+            for card_id, deck_id, mastered, grade, reviewed_at in batch
+        ], batch_size=500)
+        stats.apply(batch)
+
+
+def flush():
+    """Writes the buffered events and returns how many were stored."""
+    from .models import Card
+
+    with _lock:
+        batch = _buffer[:]
+        _buffer.clear()
+    if not batch:
+        return 0
+    try:
+        try:
+            _store(batch)
+        except IntegrityError:
+            # Cards deleted since their review was buffered take their history with them.
+            existing = set(Card.objects.filter(id__in={event[0] for event in batch}).values_list('id', flat=True))
+            batch = [event for event in batch if event[0] in existing]
+            _store(batch)
+    except DatabaseError:
+        logger.exception('Dropped %d review events', len(batch))
+        return 0
+    return len(batch)
+
+
+atexit.register(flush)
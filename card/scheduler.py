@@ -0,0 +1,34 @@
+"""
+SM-2 spaced-repetition scheduling.
+
+Recall quality is graded 0-5. Grades below ``PASSING_GRADE`` restart the
+repetition sequence; passing grades grow the interval by the card's ease
+factor, which is adjusted after every passing review.
+"""
+from datetime import timedelta
+
+PASSING_GRADE = 3
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+
+# Grades used when the learner only toggles the binary "Learned" checkbox.
+MASTERED_GRADE = 4
+LEARNING_GRADE = 1
+
+
+def sm2(repetitions, interval, ease, grade):
+    """Returns the ``(repetitions, interval, ease)`` that follow a review graded ``grade``."""
+    if grade < PASSING_GRADE:
+        return 0, 1, ease
+    if repetitions == 0:
+        interval = 1
+    elif repetitions == 1:
+        interval = 6
+    else:
+        interval = round(interval * ease)
+    ease = max(MIN_EASE, ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+    return repetitions + 1, interval, ease
+
+
+def next_due(reviewed_at, interval):
+    return reviewed_at + timedelta(days=interval)
@@ -0,0 +1,131 @@
+"""
+Full-text search over card questions and answers.
+
+On SQLite the cards are mirrored into an FTS5 table that the receivers in
+card.signals keep in sync. The owner and the deck are stored as UNINDEXED
+columns and checked on the matches, which is cheaper than intersecting with
+per-owner tokens whose doclists grow with the user's deck sizes. On
+PostgreSQL an expression GIN index over ``to_tsvector`` is kept up to date by
+the database itself; the question is weighted A and the answer B, so ts_rank
+puts question hits first. Both use the ``simple`` configuration, without
+stemming, since decks are often in foreign languages.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+TABLE = 'card_search'
+PAGE_SIZE = 20
+# bm25 weights of the question and answer columns.
+WEIGHTS = (2.0, 1.0)
+# On PostgreSQL; ts_rank's default weights count A (question) 1.0 and B (answer) 0.4.
+VECTOR = (
+    "(setweight(to_tsvector('simple', card_card.question), 'A') || "
+    "setweight(to_tsvector('simple', card_card.answer), 'B'))"
+)
+
+
+def fts5():
+    return connection.vendor == 'sqlite'
+
+
+def create_index():
+    with connection.cursor() as cursor:
+        if fts5():
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5('
+                "question, answer, owner UNINDEXED, deck UNINDEXED, "
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+        elif connection.vendor == 'postgresql':
+            # The unweighted index of earlier versions no longer matches VECTOR.
+            cursor.execute('DROP INDEX IF EXISTS card_search_vector')
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS card_search_weighted ON card_card USING GIN ({VECTOR})')
+
+
+def _index_where(condition, params):
+    if not fts5():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT OR REPLACE INTO {TABLE} (rowid, question, answer, owner, deck) '
+            f'SELECT card_card.id, card_card.question, card_card.answer, card_deck.author_id, card_deck.id '
+            f'FROM card_card JOIN card_deck ON card_deck.id = card_card.deck_id WHERE {condition}',
+            params
+        )
+
+
+def index_card(card_pk):
+    _index_where('card_card.id = %s', [card_pk])
+
+
+def remove_card(card_pk):
+    if fts5():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [card_pk])
+
+
+def index_deck(deck_pk, after_position=0):
+    """Indexes the cards of the deck past ``after_position``, e.g. after a bulk import."""
+    _index_where('card_card.deck_id = %s AND card_card.position > %s', [deck_pk, after_position])
+
+
+def remove_deck(deck_pk):
+    if fts5():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {TABLE} WHERE rowid IN (SELECT id FROM card_card WHERE deck_id = %s)', [deck_pk])
+
+
+def rebuild():
+    if fts5():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {TABLE}')
+        _index_where('1 = 1', [])
+
+
+def terms(query):
+    return re.findall(r'\w+', query.lower())[:16]
+
+
+def search(user, query, page=1, deck_pk=None):
+    """Returns one page of ``user``'s cards matching every word of ``query``, best first.
+
+    The last word also matches as a prefix. The second value tells whether
+    there is a next page.
+    """
+    from .models import Card
+
+    words = terms(query)
+    if not words:
+        return [], False
+    offset = (page - 1) * PAGE_SIZE
+    with connection.cursor() as cursor:
+        if fts5():
+            cursor.execute(
+                f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s AND owner = %s AND (%s IS NULL OR deck = %s) '
+                f'ORDER BY bm25({TABLE}, {", ".join(map(str, WEIGHTS))}) LIMIT %s OFFSET %s',
+                [' AND '.join(f'"{word}"' for word in words) + '*', user.id, deck_pk, deck_pk, PAGE_SIZE + 1, offset]
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        elif connection.vendor == 'postgresql':
+            tsquery = ' & '.join(words) + ':*'
+            cursor.execute(
+                f'SELECT card_card.id FROM card_card JOIN card_deck ON card_deck.id = card_card.deck_id '
+                f"WHERE card_deck.author_id = %s AND (%s IS NULL OR card_deck.id = %s) "
+                f"AND {VECTOR} @@ to_tsquery('simple', %s) "
+                f"ORDER BY ts_rank({VECTOR}, to_tsquery('simple', %s)) DESC, card_card.id LIMIT %s OFFSET %s",
+                [user.id, deck_pk, deck_pk, tsquery, tsquery, PAGE_SIZE + 1, offset]
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        else:
+            cards = Card.objects.filter(deck__author=user)
+            if deck_pk:
+                cards = cards.filter(deck__id=deck_pk)
+            for word in words:
+                cards = cards.filter(Q(question__icontains=word) | Q(answer__icontains=word))
+            ids = list(cards.order_by('id').values_list('id', flat=True)[offset:offset + PAGE_SIZE + 1])
+    found = Card.objects.filter(id__in=ids[:PAGE_SIZE]).select_related('deck').only(
+        'id', 'question', 'answer', 'status', 'position', 'deck__id', 'deck__name'
+    ).in_bulk()
+    return [found[pk] for pk in ids[:PAGE_SIZE] if pk in found], len(ids) > PAGE_SIZE
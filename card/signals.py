@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete, pre_delete, post_migrate
+from django.dispatch import receiver
+
+from . import metrics, search
+from .cache import invalidate_deck_list, invalidate_owned_decks
+from .models import Deck, Card
+
+
+@receiver(post_save, sender=Deck)
+@receiver(post_delete, sender=Deck)
+def deck_changed(sender, instance, **kwargs):
+    invalidate_deck_list(instance.author_id)
+    invalidate_owned_decks(instance.author_id)
+
+
+# Single cards leave the search index in Card.delete; a post_delete receiver
+# would stop deck deletion from removing the deck's cards in bulk.
+@receiver(pre_delete, sender=Deck)
+def deck_deleting(sender, instance, **kwargs):
+    search.remove_deck(instance.id)
+
+
+@receiver(post_save, sender=Card)
+def card_saved(sender, instance, update_fields, **kwargs):
+    if update_fields is None or {'question', 'answer'} & set(update_fields):
+        search.index_card(instance.id)
+
+
+@receiver(post_migrate)
+def create_search_index(sender, app_config, **kwargs):
+    if app_config.name == 'card':
+        search.create_index()
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    if settings.METRICS_ENABLED:
+        metrics.instrument(connection)
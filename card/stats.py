@@ -0,0 +1,145 @@
+"""
+Study statistics kept as daily rollups.
+
+Every flush of the review log (card.reviews) folds its batch into one DeckDay
+row per deck and day, and counts failed reviews into Card.lapses, in the same
+transaction that stores the events. The dashboards only read these rollups,
+so their cost grows with the number of days shown, not with the number of
+cards or reviews.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.utils import timezone
+
+DAYS = 30
+
+
+def _totals(batch):
+    """Sums review-log events into ``{(deck_id, day): (reviews, learned, forgotten)}`` and lapses per card."""
+    totals = {}
+    lapses = Counter()
+    for card_id, deck_id, mastered, grade, reviewed_at in batch:
+        reviews, learned, forgotten = totals.get((deck_id, timezone.localdate(reviewed_at)), (0, 0, 0))
+        totals[deck_id, timezone.localdate(reviewed_at)] = (reviews + 1, learned + mastered, forgotten + (not mastered))
+        if not mastered:
+            lapses[card_id] += 1
+    return totals, lapses
+
+
+def apply(batch):
+    """Adds a batch of review-log events ``(card_id, deck_id, mastered, grade, reviewed_at)`` to the rollups."""
+    from .models import Deck, Card, DeckDay
+
+    totals, lapses = _totals(batch)
+    if not totals:
+        return
+    DeckDay.objects.bulk_create(
+        [DeckDay(deck_id=deck_id, day=day) for deck_id, day in totals],
+        ignore_conflicts=True
+    )
+    mastered_count = Subquery(Deck.all_objects.filter(id=OuterRef('deck_id')).values('mastered_count')[:1])
+    for (deck_id, day), (reviews, learned, forgotten) in totals.items():
+        DeckDay.objects.filter(deck_id=deck_id, day=day).update(
+            reviews=F('reviews') + reviews,
+            learned=F('learned') + learned,
+            forgotten=F('forgotten') + forgotten,
+            mastered=mastered_count
+        )
+    by_count = {}
+    for card_id, count in lapses.items():
+        by_count.setdefault(count, []).append(card_id)
+    for count, card_ids in by_count.items():
+        Card.objects.filter(id__in=card_ids).update(lapses=F('lapses') + count)
+
+
+def pending_days(batch, deck_ids):
+    """Day totals ``{day: (reviews, learned, forgotten)}`` of events of ``deck_ids`` that are not flushed yet.
+
+    The dashboards add these in memory, so a page view never writes the
+    review log out.
+    """
+    days = {}
+    for (deck_id, day), counts in _totals(batch)[0].items():
+        if deck_id in deck_ids:
+            days[day] = tuple(a + b for a, b in zip(days.get(day, (0, 0, 0)), counts))
+    return days
+
+
+def _window(days):
+    today = timezone.localdate()
+    return [today - timedelta(days=n) for n in range(days - 1, -1, -1)]
+
+
+def deck_history(deck_pk, days=DAYS, pending=None, mastered_count=None):
+    """One entry per day of the last ``days`` days, gaps included.
+
+    ``mastered`` is carried over from the last day with reviews, so it draws
+    the deck's mastery curve. ``pending`` holds the unflushed totals from
+    ``pending_days``; days with such events take ``mastered_count``, just as
+    the flush would.
+    """
+    from .models import DeckDay
+
+    window = _window(days)
+    rows = DeckDay.objects.filter(deck_id=deck_pk, day__gte=window[0])
+    found = {row.day: row for row in rows}
+    mastered = DeckDay.objects.filter(
+        deck_id=deck_pk,
+        day__lt=window[0]
+    ).order_by('-day').values_list('mastered', flat=True).first() or 0
+    pending = pending or {}
+    history = []
+    for day in window:
+        row = found.get(day)
+        if row is not None:
+            mastered = row.mastered
+        if day in pending and mastered_count is not None:
+            mastered = mastered_count
+        reviews, learned, forgotten = pending.get(day, (0, 0, 0))
+        history.append({
+            'day': day,
+            'reviews': (row.reviews if row else 0) + reviews,
+            'learned': (row.learned if row else 0) + learned,
+            'forgotten': (row.forgotten if row else 0) + forgotten,
+            'mastered': mastered,
+        })
+    return history
+
+
+def user_history(user, days=DAYS, pending=None):
+    """Daily review totals over all of ``user``'s decks for the last ``days`` days, plus ``pending``."""
+    from .models import DeckDay
+
+    window = _window(days)
+    found = {
+        row['day']: row
+        for row in DeckDay.objects.filter(deck__author=user, day__gte=window[0]).order_by().values('day').annotate(
+            reviews=Sum('reviews'),
+            learned=Sum('learned'),
+            forgotten=Sum('forgotten')
+        )
+    }
+    empty = {'reviews': 0, 'learned': 0, 'forgotten': 0}
+    pending = pending or {}
+    history = []
+    for day in window:
+        row = found.get(day, empty)
+        reviews, learned, forgotten = pending.get(day, (0, 0, 0))
+        history.append({
+            'day': day,
+            'reviews': row['reviews'] + reviews,
+            'learned': row['learned'] + learned,
+            'forgotten': row['forgotten'] + forgotten,
+        })
+    return history
+
+
+def hardest_cards(deck_pk, limit=10):
+    """The cards of the deck that were failed most often."""
+    from .models import Card
+
+    return Card.objects.filter(deck__id=deck_pk, lapses__gt=0).order_by('-lapses', 'position').only(
+        'id', 'deck_id', 'question', 'position', 'status', 'lapses'
+    )[:limit]
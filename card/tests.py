@@ -1,3 +1,1310 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import re
+import io
+import tempfile
+from datetime import timedelta
+from unittest import mock, skipUnless
+from urllib.parse import urlencode
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image as PILImage
+
+from .forms import CardForm
+from .models import Deck, Card, ReviewEvent, DeckDay, StudySession, Image, Job, Subscription, CardProgress
+from . import images, jobs, mastery, metrics, reviews, scheduler, search, stats, transfer
+from .views import serve_media
+
+
+def clear_caches():
+    # Ids are reused after each test's rollback, so fragments keyed on them must go too.
+    for alias in settings.CACHES:
+        caches[alias].clear()
+
+
+class QueryBudgetTestCase(TestCase):
+    """
+    Every view in card/views.py gets a query budget, checked against a deck
+    larger than one card-list page. Budgets include the two queries for the
+    session and the user, and the savepoints of atomic blocks.
+    """
+    deck_size = 150
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('learner', password='secret')
+        cls.deck = Deck.objects.create(name='Deck', author=cls.user)
+        Card.objects.bulk_create(
+            Card(deck=cls.deck, question=f'Question {i}', answer=f'Answer {i}', position=i,
+                 status=Card.QuestionStatus.MASTERED if i % 3 else Card.QuestionStatus.LEARNING)
+            for i in range(1, cls.deck_size + 1)
+        )
+        Deck.update_counters(cls.deck.id, cards=cls.deck_size, mastered=cls.deck_size - cls.deck_size // 3)
+
+    def setUp(self):
+        clear_caches()
+        # A browser signs in through the login form, which sets the CSRF cookie
+        # that deck pages require before they revalidate.
+        self.client.get(reverse('login'))
+        self.client.force_login(self.user)
+
+    def assertQueryBudget(self, budget, method, url, data=None, **extra):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data or {}, **extra)
+        self.assertLessEqual(
+            len(queries), budget,
+            f'{method.upper()} {url} ran {len(queries)} queries:\n' + '\n'.join(query['sql'] for query in queries)
+        )
+        return response
+
+    def study_data(self, position, status=Card.QuestionStatus.MASTERED, **data):
+        card = Card.objects.get(deck=self.deck, position=position)
+        return dict({
+            'cardId': card.id,
+            'cardQty': self.deck_size,
+            'markAsLearned': status,
+            'markAsLearnedInit': card.status,
+        }, **data)
+
+
+class StudyViewQueryTests(QueryBudgetTestCase):
+
+    def test_card(self):
+        response = self.assertQueryBudget(5, 'get', reverse('card', args=[self.deck.id, 120]))
+        self.assertContains(response, 'Question 120')
+
+    def test_card_with_cached_ownership(self):
+        self.client.get(reverse('deck-detail', args=[self.deck.id]))
+        self.assertQueryBudget(5, 'get', reverse('card', args=[self.deck.id, 120]))
+
+    def test_card_of_other_user(self):
+        self.client.force_login(User.objects.create_user('other'))
+        response = self.assertQueryBudget(5, 'get', reverse('card', args=[self.deck.id, 1]))
+        self.assertTemplateUsed(response, '403.html')
+
+    def test_next_card(self):
+        data = self.study_data(3)
+        self.assertQueryBudget(7, 'post', reverse('next-card', args=[self.deck.id, 3]), data)
+
+    def test_next_red_card(self):
+        data = self.study_data(3)
+        self.assertQueryBudget(8, 'post', reverse('next-red-card', args=[self.deck.id, 3]), data)
+
+    def test_repeated_posts_count_once(self):
+        data = self.study_data(3)
+        for name in ('next-card', 'next-card', 'next-red-card'):
+            self.client.post(reverse(name, args=[self.deck.id, 3]), data)
+        self.assertEqual(Deck.objects.get(id=self.deck.id).mastered_count, self.deck_size - self.deck_size // 3 + 1)
+        self.assertTrue(Card.objects.get(deck=self.deck, position=3).is_mastered())
+
+    def test_study_step(self):
+        url = reverse('study-step', args=[self.deck.id, 3])
+        # Three queries per card: the conditional UPDATE, the counter UPDATE
+        # that goes with it and the next-card lookup. The savepoint pair comes
+        # from the atomic block inside the test's transaction.
+        response = self.assertQueryBudget(7, 'post', url, self.study_data(3, mode='next'))
+        self.assertEqual(response.json()['card_no'], 4)
+        response = self.assertQueryBudget(3, 'post', url, self.study_data(3, mode='red'))
+        self.assertEqual(response.json()['card_no'], 6)
+
+    def test_study_step_ignores_a_card_id_from_another_position(self):
+        data = self.study_data(3, mode='next', cardId=Card.objects.get(deck=self.deck, position=6).id)
+        self.client.post(reverse('study-step', args=[self.deck.id, 3]), data)
+        self.assertFalse(Card.objects.filter(deck=self.deck, position__in=[3, 6], status=Card.QuestionStatus.MASTERED).exists())
+
+    def test_study_step_due(self):
+        url = reverse('study-step', args=[self.deck.id, 3])
+        response = self.assertQueryBudget(9, 'post', url, self.study_data(3, mode='due'))
+        self.assertEqual(response.json()['card_no'], 1)
+
+    def test_due_card(self):
+        self.assertQueryBudget(4, 'get', reverse('due-card', args=[self.deck.id]))
+
+    def test_next_due_card(self):
+        self.assertQueryBudget(9, 'post', reverse('next-due-card', args=[self.deck.id, 3]), {'grade': 4})
+
+
+class DeckViewQueryTests(QueryBudgetTestCase):
+
+    def test_home(self):
+        self.assertQueryBudget(2, 'get', reverse('home'))
+
+    def test_deck_list(self):
+        self.assertQueryBudget(3, 'get', reverse('deck-list'))
+        self.assertQueryBudget(2, 'get', reverse('deck-list'))
+
+    def test_deck_detail(self):
+        response = self.assertQueryBudget(4, 'get', reverse('deck-detail', args=[self.deck.id]))
+        self.assertContains(response, f'{self.deck_size - self.deck_size // 3}/{self.deck_size}')
+
+    def test_deck_create(self):
+        self.assertQueryBudget(2, 'get', reverse('deck-create'))
+        self.assertQueryBudget(3, 'post', reverse('deck-create'), {'deck-name': 'New deck'})
+
+    def test_deck_update(self):
+        url = reverse('deck-update', args=[self.deck.id])
+        self.assertQueryBudget(4, 'get', url)
+        self.assertQueryBudget(4, 'post', url, {'name': 'Renamed'})
+
+    def test_deck_delete(self):
+        url = reverse('deck-delete', args=[self.deck.id])
+        self.assertQueryBudget(4, 'get', url)
+        self.assertQueryBudget(8, 'post', url)
+        self.assertFalse(Deck.objects.filter(id=self.deck.id).exists())
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertFalse(Deck.all_objects.filter(id=self.deck.id).exists())
+        self.assertFalse(Card.objects.filter(deck_id=self.deck.id).exists())
+
+    def test_deck_import(self):
+        url = reverse('deck-import', args=[self.deck.id])
+        self.assertQueryBudget(3, 'get', url)
+        upload = SimpleUploadedFile('cards.csv', b'question,answer\n' + b'q,a\n' * 100)
+        self.assertQueryBudget(10, 'post', url, {'file': upload})
+        self.assertEqual(Card.objects.filter(deck=self.deck).count(), self.deck_size + 100)
+
+    def test_deck_export(self):
+        response = self.assertQueryBudget(3, 'get', reverse('deck-export', args=[self.deck.id]))
+        with CaptureQueriesContext(connection) as queries:
+            lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(len(lines), self.deck_size + 1)
+        self.assertEqual(len(queries), 1)
+
+
+class CardViewQueryTests(QueryBudgetTestCase):
+
+    def test_card_list(self):
+        url = reverse('card-list', args=[self.deck.id])
+        response = self.assertQueryBudget(4, 'get', url)
+        self.assertEqual([card.position for card in response.context['cards']], list(range(1, 61)))
+        response = self.assertQueryBudget(4, 'get', url, {'after': 120})
+        self.assertEqual([card.position for card in response.context['cards']], list(range(121, 151)))
+        self.assertIsNone(response.context['next_after'])
+        response = self.assertQueryBudget(4, 'get', url, {'before': 121})
+        self.assertEqual(response.context['cards'][0].position, 61)
+
+    def test_card_create(self):
+        url = reverse('add-card', args=[self.deck.id])
+        self.assertQueryBudget(3, 'get', url)
+        response = self.assertQueryBudget(9, 'post', url, {'card-question': 'Q', 'card-answer': 'A', 'card-status': 'LEARNING'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_card_update(self):
+        card = Card.objects.get(deck=self.deck, position=10)
+        url = reverse('card-update', args=[self.deck.id, card.id])
+        self.assertQueryBudget(4, 'get', url)
+        response = self.assertQueryBudget(8, 'post', url, {'question': 'Q', 'answer': 'A', 'status': 'MASTERED'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_card_update_keeps_columns_changed_meanwhile(self):
+        card = Card.objects.get(deck=self.deck, position=10)
+        form = CardForm({'question': 'Q', 'answer': 'A', 'status': card.status}, instance=card, deck_id=self.deck.id)
+        Card.objects.filter(id=card.id).update(position=self.deck_size + 1, lapses=3)
+        self.assertTrue(form.is_valid())
+        form.save()
+        card = Card.objects.get(id=card.id)
+        self.assertEqual((card.question, card.position, card.lapses), ('Q', self.deck_size + 1, 3))
+
+    def test_card_delete(self):
+        card = Card.objects.get(deck=self.deck, position=10)
+        url = reverse('card-delete', args=[self.deck.id, card.id])
+        self.assertQueryBudget(4, 'get', url)
+        self.assertQueryBudget(14, 'post', url)
+        self.assertEqual(Card.objects.get(deck=self.deck, position=10).question, 'Question 11')
+
+    def test_card_of_other_deck_is_not_editable(self):
+        other = Deck.objects.create(name='Other', author=User.objects.create_user('other'))
+        card = Card.objects.create(deck=other, question='Q', answer='A')
+        response = self.client.get(reverse('card-update', args=[self.deck.id, card.id]))
+        self.assertTemplateUsed(response, '404.html')
+
+
+class OfflineStudyTests(QueryBudgetTestCase):
+
+    def test_bundle(self):
+        url = reverse('deck-bundle', args=[self.deck.id])
+        response = self.assertQueryBudget(6, 'get', url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        response = self.client.get(url)
+        bundle = response.json()
+        self.assertEqual(len(bundle['cards']), self.deck_size)
+        self.assertEqual(dict(zip(bundle['fields'], bundle['cards'][2]))['status'], Card.QuestionStatus.LEARNING)
+        response = self.assertQueryBudget(3, 'get', url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_bundle_version_follows_cards(self):
+        url = reverse('deck-bundle', args=[self.deck.id])
+        etag = self.client.get(url)['ETag']
+        Card.update_status(self.deck.id, 3, Card.QuestionStatus.MASTERED, self.user)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_bundle_of_other_user(self):
+        self.client.force_login(User.objects.create_user('other'))
+        response = self.client.get(reverse('deck-bundle', args=[self.deck.id]))
+        self.assertTemplateUsed(response, '403.html')
+
+    def test_sync(self):
+        cards = dict(Card.objects.filter(deck=self.deck, position__in=[1, 3, 6]).values_list('position', 'id'))
+        other = Card.objects.create(deck=Deck.objects.create(name='Other', author=User.objects.create_user('other')),
+                                    question='Q', answer='A')
+        changes = [[cards[3], 'MASTERED'], [cards[6], 'LEARNING'], [cards[6], 'MASTERED'],
+                   [cards[1], 'LEARNING'], [other.id, 'MASTERED']]
+        response = self.assertQueryBudget(
+            11, 'post', reverse('deck-sync', args=[self.deck.id]),
+            json.dumps({'changes': changes}), content_type='application/json'
+        )
+        self.assertEqual(response.json()['changed'], 3)
+        self.assertEqual(response.json()['mastered_questions'], self.deck_size - self.deck_size // 3 + 1)
+        self.assertEqual(Card.objects.get(id=other.id).status, Card.QuestionStatus.LEARNING)
+
+    def test_sync_rejects_malformed_changes(self):
+        response = self.client.post(reverse('deck-sync', args=[self.deck.id]), '{"changes": 1}',
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_service_worker_is_served_from_root(self):
+        response = self.client.get(reverse('service-worker'))
+        self.assertEqual(response['Content-Type'], 'application/javascript')
+
+    def test_missing_service_worker(self):
+        with mock.patch('card.views.finders.find', return_value=None):
+            self.assertTemplateUsed(self.client.get(reverse('service-worker')), '404.html')
+
+
+class HttpCachingTests(QueryBudgetTestCase):
+
+    def test_unchanged_pages_are_not_modified(self):
+        for url in (reverse('deck-detail', args=[self.deck.id]), reverse('card-list', args=[self.deck.id]),
+                    reverse('card', args=[self.deck.id, 3])):
+            response = self.client.get(url)
+            self.assertIn('no-cache', response['Cache-Control'])
+            response = self.assertQueryBudget(3, 'get', url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.templates, [])
+
+    def test_last_modified(self):
+        url = reverse('deck-detail', args=[self.deck.id])
+        last_modified = self.client.get(url)['Last-Modified']
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+    def test_card_changes_invalidate_pages(self):
+        url = reverse('card', args=[self.deck.id, 3])
+        etag = self.client.get(url)['ETag']
+        Card.update_status(self.deck.id, 6, Card.QuestionStatus.MASTERED, self.user)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_reviews_only_invalidate_pages_when_the_status_changes(self):
+        url = reverse('card', args=[self.deck.id, 2])
+        etag = self.client.get(url)['ETag']
+        card = Card.objects.get(deck=self.deck, position=2)
+        card.review(5)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        card.review(1)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_logging_in_again_invalidates_pages(self):
+        url = reverse('card', args=[self.deck.id, 3])
+        response = self.client.get(url)
+        self.client.logout()
+        self.client.get(reverse('login'))
+        self.client.post(reverse('login'), {'username': 'learner', 'password': 'secret'})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'],
+                                   HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_pending_messages_are_not_hidden(self):
+        url = reverse('deck-detail', args=[self.deck.id])
+        etag = self.client.get(url)['ETag']
+        upload = SimpleUploadedFile('cards.csv', b'question,answer\n' + b'q,a\n' * 100)
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root, JOB_INLINE_IMPORT_BYTES=100):
+            self.client.post(reverse('deck-import', args=[self.deck.id]), {'file': upload})
+        self.assertContains(self.client.get(url, HTTP_IF_NONE_MATCH=etag), 'The import has been queued')
+
+    def test_no_validators_for_other_users(self):
+        self.client.force_login(User.objects.create_user('other'))
+        response = self.client.get(reverse('deck-detail', args=[self.deck.id]))
+        self.assertFalse(response.has_header('ETag'))
+        self.assertTemplateUsed(response, '403.html')
+
+    def test_content_addressed_media_is_immutable(self):
+        name = hashlib.sha256(b'image').hexdigest()
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            for path in (f'images/{name[:2]}/{name}_thumbnail.jpg', 'images/default_deck_thumbnail.jpg'):
+                os.makedirs(os.path.join(media_root, os.path.dirname(path)), exist_ok=True)
+                with open(os.path.join(media_root, path), 'wb') as file:
+                    file.write(b'image')
+            request = RequestFactory().get('/')
+            self.assertIn('immutable', serve_media(request, f'images/{name[:2]}/{name}_thumbnail.jpg')['Cache-Control'])
+            self.assertFalse(serve_media(request, 'images/default_deck_thumbnail.jpg').has_header('Cache-Control'))
+
+
+class StudySessionTests(QueryBudgetTestCase):
+    """Sessions fix an order over some cards, and every step reads one id of it."""
+
+    def session_positions(self, session):
+        positions = dict(Card.objects.filter(deck=self.deck).values_list('id', 'position'))
+        return [positions[StudySession.step(session.id, self.user, step)[2]] for step in range(1, session.length + 1)]
+
+    def test_shuffled_session_covers_deck_once(self):
+        positions = self.session_positions(StudySession.start(self.user, self.deck.id, shuffle=True, seed=1))
+        self.assertEqual(sorted(positions), list(range(1, self.deck_size + 1)))
+        self.assertNotEqual(positions, sorted(positions))
+
+    def test_learning_only_sample_keeps_deck_order(self):
+        session = StudySession.start(self.user, self.deck.id, learning_only=True, sample=10, seed=1)
+        positions = self.session_positions(session)
+        self.assertEqual(len(positions), 10)
+        self.assertEqual(positions, sorted(positions))
+        self.assertTrue(all(position % 3 == 0 for position in positions))
+
+    def test_new_session_replaces_previous_one(self):
+        StudySession.start(self.user, self.deck.id)
+        session = StudySession.start(self.user, self.deck.id, sample=5)
+        self.assertEqual(list(StudySession.objects.values_list('id', flat=True)), [session.id])
+
+    def test_start_view(self):
+        url = reverse('session-create', args=[self.deck.id])
+        self.assertQueryBudget(3, 'get', url)
+        response = self.client.post(url, {'shuffle': 'on', 'sample': '20'})
+        session = StudySession.objects.get()
+        self.assertRedirects(response, reverse('session-card', args=[session.id, 1]))
+        self.assertEqual(session.length, 20)
+
+    def test_start_view_without_matching_cards(self):
+        deck = Deck.objects.create(name='Empty', author=self.user)
+        response = self.client.post(reverse('session-create', args=[deck.id]), {'learning_only': 'on'})
+        self.assertContains(response, 'No card of this deck matches.')
+
+    def test_steps(self):
+        session = StudySession.start(self.user, self.deck.id, learning_only=True, sample=2)
+        card_id = StudySession.step(session.id, self.user, 1)[2]
+        response = self.assertQueryBudget(4, 'get', reverse('session-card', args=[session.id, 1]))
+        self.assertContains(response, '1/2')
+        response = self.assertQueryBudget(8, 'post', reverse('session-step', args=[session.id, 1]), {
+            'markAsLearned': 'MASTERED', 'markAsLearnedInit': 'LEARNING'
+        })
+        self.assertRedirects(response, reverse('session-card', args=[session.id, 2]))
+        self.assertEqual(Card.objects.get(id=card_id).status, Card.QuestionStatus.MASTERED)
+        response = self.client.post(reverse('session-step', args=[session.id, 2]), {})
+        self.assertRedirects(response, reverse('deck-detail', args=[self.deck.id]), fetch_redirect_response=False)
+        self.assertTemplateUsed(self.client.get(reverse('session-card', args=[session.id, 3])), '404.html')
+
+    def test_session_of_other_user(self):
+        session = StudySession.start(self.user, self.deck.id)
+        self.client.force_login(User.objects.create_user('stranger'))
+        self.assertTemplateUsed(self.client.get(reverse('session-card', args=[session.id, 1])), '404.html')
+
+
+class TemplateFragmentTests(QueryBudgetTestCase):
+    """Rendered cards and deck headers are cached under their versions."""
+
+    def test_card_items_are_cached_per_version(self):
+        url = reverse('card-list', args=[self.deck.id])
+        self.client.get(url)
+        # A write that bypasses Card.save keeps the version, so the cached item is served.
+        Card.objects.filter(deck=self.deck, position=1).update(question='Sneaky edit')
+        self.assertNotContains(self.client.get(url), 'Sneaky edit')
+        card = Card.objects.get(deck=self.deck, position=1)
+        card.question = 'Proper edit'
+        card.save()
+        self.assertContains(self.client.get(url), 'Proper edit')
+
+    def test_status_change_rerenders_card_item(self):
+        url = reverse('card-list', args=[self.deck.id])
+        self.assertContains(self.client.get(url), 'border-danger', count=20)
+        Card.update_status(self.deck.id, 3, Card.QuestionStatus.MASTERED, self.user)
+        self.assertContains(self.client.get(url), 'border-danger', count=19)
+
+    def test_image_update_bumps_version(self):
+        card = Card.objects.get(deck=self.deck, position=1)
+        card.update_question_img(None)
+        self.assertEqual(Card.objects.get(id=card.id).version, 2)
+
+    def test_deck_header_follows_counters(self):
+        url = reverse('deck-detail', args=[self.deck.id])
+        self.assertContains(self.client.get(url), '100/150')
+        Card.update_status(self.deck.id, 3, Card.QuestionStatus.MASTERED, self.user)
+        self.assertContains(self.client.get(url), '101/150')
+
+
+class MasteryTests(SimpleTestCase):
+
+    def test_bits(self):
+        bits = mastery.from_positions([1, 3, 10])
+        self.assertEqual(len(bits), 2)
+        self.assertEqual([mastery.is_mastered(bits, p) for p in (1, 2, 3, 10, 11, 100)],
+                         [True, False, True, True, False, False])
+        self.assertEqual(mastery.count(bits), 3)
+        self.assertEqual(mastery.set_mastered(mastery.set_mastered(bits, 2, True), 10, False), mastery.from_positions([1, 2, 3]))
+        self.assertEqual(mastery.set_mastered(b'', 1, False), b'')
+
+    def test_next_learning(self):
+        bits = mastery.from_positions([1, 2, 4])
+        self.assertEqual(mastery.next_learning(bits, 0, 5), 3)
+        self.assertEqual(mastery.next_learning(bits, 3, 5), 5)
+        self.assertEqual(mastery.next_learning(bits, 3, 4), -1)
+        self.assertEqual(mastery.next_learning(b'', 0, 0), -1)
+        self.assertEqual(mastery.next_learning(mastery.from_positions(range(1, 1001)), 0, 1001), 1001)
+
+    def test_remove_position(self):
+        bits = mastery.from_positions([1, 3, 4, 9])
+        self.assertEqual(mastery.remove_position(bits, 3), mastery.from_positions([1, 3, 8]))
+        self.assertEqual(mastery.remove_position(bits, 2), mastery.from_positions([1, 2, 3, 8]))
+        self.assertEqual(mastery.remove_position(bits, 20), bits)
+
+
+class SubscriptionTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Deck.objects.filter(id=self.deck.id).update(shared=True)
+        self.student = User.objects.create_user('student')
+        self.client.force_login(self.student)
+        self.subscription = Subscription.objects.create(user=self.student, deck=self.deck)
+
+    def study(self, position, status, mode='next'):
+        card = Card.objects.get(deck=self.deck, position=position)
+        return self.assertQueryBudget(12, 'post', reverse('subscription-step', args=[self.subscription.id, position]), {
+            'cardId': card.id, 'markAsLearned': status, 'markAsLearnedInit': '', 'mode': mode,
+        })
+
+    def test_subscribing_copies_no_cards(self):
+        self.subscription.delete()
+        self.assertContains(self.client.get(reverse('shared-deck-list')), 'Subscribe')
+        cards = Card.objects.count()
+        response = self.assertQueryBudget(7, 'post', reverse('deck-subscribe', args=[self.deck.id]))
+        subscription = Subscription.objects.get(user=self.student)
+        self.assertRedirects(response, reverse('subscription-detail', args=[subscription.id]))
+        self.assertEqual(Card.objects.count(), cards)
+        response = self.assertQueryBudget(4, 'get', reverse('subscription-detail', args=[subscription.id]))
+        self.assertContains(response, f'0/{self.deck_size}')
+
+    def test_only_shared_decks_of_others_can_be_subscribed(self):
+        own = Deck.objects.create(name='Own', author=self.student, shared=True)
+        private = Deck.objects.create(name='Private', author=self.user)
+        for deck in (own, private):
+            self.assertTemplateUsed(self.client.post(reverse('deck-subscribe', args=[deck.id])), '404.html')
+        self.assertNotContains(self.client.get(reverse('shared-deck-list')), 'Private')
+
+    def test_progress_is_kept_per_subscriber(self):
+        self.assertRedirects(self.study(3, 'MASTERED'), reverse('subscription-card', args=[self.subscription.id, 4]),
+                             fetch_redirect_response=False)
+        self.assertEqual(Card.objects.get(deck=self.deck, position=3).status, Card.QuestionStatus.LEARNING)
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.mastered_count(), 1)
+        self.assertEqual(self.subscription.next_red_card_index(2), 4)
+        response = self.assertQueryBudget(6, 'get', reverse('subscription-card', args=[self.subscription.id, 3]))
+        self.assertEqual(response.context['card'].status, Card.QuestionStatus.MASTERED)
+        self.assertEqual(response.context['next_red'], 4)
+        self.study(3, 'LEARNING')
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.mastered_count(), 0)
+
+    def test_card_list_shows_the_subscribers_statuses(self):
+        self.study(2, 'MASTERED')
+        response = self.assertQueryBudget(5, 'get', reverse('subscription-card-list', args=[self.subscription.id]))
+        statuses = {card.position: card.status for card in response.context['cards']}
+        self.assertEqual((statuses[1], statuses[2]), (Card.QuestionStatus.LEARNING, Card.QuestionStatus.MASTERED))
+        self.assertNotContains(response, reverse('card-delete', args=[self.deck.id, response.context['cards'][0].id]))
+
+    def test_edits_copy_the_card(self):
+        url = reverse('subscription-card-update', args=[self.subscription.id, 2])
+        self.assertContains(self.client.get(url), 'Question 2')
+        cards = Card.objects.count()
+        self.client.post(url, {'question': 'My question', 'answer': 'My answer'})
+        self.client.post(url, {'question': 'My question, again', 'answer': 'My answer'})
+        self.assertEqual(Card.objects.count(), cards)
+        self.assertEqual(CardProgress.objects.get(subscription=self.subscription).version, 2)
+        self.assertContains(self.client.get(reverse('subscription-card', args=[self.subscription.id, 2])),
+                            'My question, again')
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('card', args=[self.deck.id, 2]))
+        self.assertContains(response, 'Question 2')
+        self.assertNotContains(response, 'My question')
+
+    def test_subscriptions_are_private(self):
+        self.client.force_login(self.user)
+        for url in (reverse('subscription-detail', args=[self.subscription.id]),
+                    reverse('subscription-card', args=[self.subscription.id, 1])):
+            self.assertTemplateUsed(self.client.get(url), '404.html')
+
+    def test_deleted_cards_leave_the_bitmap(self):
+        for position in (2, 5, 6):
+            self.study(position, 'MASTERED')
+        self.client.force_login(self.user)
+        self.client.post(reverse('card-delete', args=[self.deck.id, Card.objects.get(deck=self.deck, position=5).id]))
+        self.subscription.refresh_from_db()
+        self.assertEqual(bytes(self.subscription.mastered_bits), mastery.from_positions([2, 5]))
+        rebuilt = Subscription.objects.get(id=self.subscription.id)
+        rebuilt.rebuild_bits()
+        self.assertEqual(rebuilt.mastered_bits, bytes(self.subscription.mastered_bits))
+
+    def test_bitmap_updates_are_not_lost(self):
+        stale = Subscription.objects.get(id=self.subscription.id)
+        self.subscription.set_status(Card.objects.get(deck=self.deck, position=1).id, 'MASTERED')
+        stale.set_status(Card.objects.get(deck=self.deck, position=9).id, 'MASTERED')
+        self.subscription.refresh_from_db()
+        self.assertEqual(bytes(self.subscription.mastered_bits), mastery.from_positions([1, 9]))
+
+    def test_reset_keeps_copies(self):
+        self.study(3, 'MASTERED')
+        self.study(4, 'MASTERED')
+        self.client.post(reverse('subscription-card-update', args=[self.subscription.id, 4]),
+                         {'question': 'Mine', 'answer': 'Mine'})
+        self.client.post(reverse('subscription-reset', args=[self.subscription.id]))
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.mastered_count(), 0)
+        copy = CardProgress.objects.get(subscription=self.subscription)
+        self.assertEqual((copy.card.position, copy.status), (4, Card.QuestionStatus.LEARNING))
+
+    def test_unsubscribe(self):
+        self.study(3, 'MASTERED')
+        self.client.post(reverse('subscription-delete', args=[self.subscription.id]))
+        self.assertFalse(CardProgress.objects.exists())
+        self.assertEqual(Card.objects.filter(deck=self.deck).count(), self.deck_size)
+
+
+class JobTests(QueryBudgetTestCase):
+
+    def test_deleted_deck_is_hidden_until_the_job_runs(self):
+        self.deck.schedule_deletion()
+        self.assertTemplateUsed(self.client.get(reverse('deck-detail', args=[self.deck.id])), '404.html')
+        self.assertNotContains(self.client.get(reverse('deck-list')), reverse('deck-detail', args=[self.deck.id]))
+        self.assertEqual(Card.objects.filter(deck_id=self.deck.id).count(), self.deck_size)
+        jobs.run_pending()
+        self.assertFalse(Card.objects.filter(deck_id=self.deck.id).exists())
+        self.assertFalse(Job.objects.exists())
+
+    def test_image_variants_are_rendered_in_the_background(self):
+        picture = io.BytesIO()
+        PILImage.new('RGB', (800, 600), 'red').save(picture, 'PNG')
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            image = Image.from_upload(SimpleUploadedFile('red.png', picture.getvalue()))
+            Card.objects.filter(deck=self.deck, position=1).update(question_img=image)
+            self.assertFalse(image.thumbnail)
+            stamp = Deck.objects.get(id=self.deck.id).updated_at
+            self.assertEqual(jobs.run_pending(), 1)
+            image.refresh_from_db()
+            self.assertTrue(image.thumbnail and image.display)
+            self.assertEqual(Card.objects.get(deck=self.deck, position=1).version, 2)
+            self.assertGreater(Deck.objects.get(id=self.deck.id).updated_at, stamp)
+
+    def test_large_imports_are_queued(self):
+        url = reverse('deck-import', args=[self.deck.id])
+        upload = SimpleUploadedFile('cards.csv', b'question,answer\n' + b'q,a\n' * 100)
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root, JOB_INLINE_IMPORT_BYTES=100):
+            response = self.client.post(url, {'file': upload}, follow=True)
+            self.assertContains(response, 'The import has been queued')
+            self.assertEqual(Card.objects.filter(deck=self.deck).count(), self.deck_size)
+            self.assertEqual(jobs.run_pending(), 1)
+            self.assertEqual(Card.objects.filter(deck=self.deck).count(), self.deck_size + 100)
+            self.assertEqual(os.listdir(os.path.join(media_root, 'imports')), [])
+
+    def test_failed_jobs_are_retried_with_backoff(self):
+        calls = []
+
+        def flaky(**payload):
+            calls.append(payload)
+            raise RuntimeError('flaky')
+
+        jobs.HANDLERS['test.flaky'] = flaky
+        self.addCleanup(jobs.HANDLERS.pop, 'test.flaky')
+        with self.settings(JOB_MAX_ATTEMPTS=2, JOB_RETRY_DELAY=30):
+            job = jobs.enqueue('test.flaky', n=1)
+        with self.assertLogs('card.jobs', 'WARNING'):
+            self.assertEqual(jobs.run_pending(), 0)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Status.QUEUED, 1))
+        self.assertIn('RuntimeError: flaky', job.last_error)
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=25))
+        # Not due yet, so nothing runs.
+        self.assertEqual(jobs.run_pending(), 0)
+        self.assertEqual(len(calls), 1)
+        Job.objects.filter(id=job.id).update(run_after=timezone.now())
+        with self.assertLogs('card.jobs', 'ERROR'):
+            jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, len(calls)), (Job.Status.FAILED, 2, 2))
+
+    def test_permanent_failures_are_not_retried(self):
+        url = reverse('deck-import', args=[self.deck.id])
+        upload = SimpleUploadedFile('cards.jsonl', b'{"question": "q"}\n' * 100)
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root, JOB_INLINE_IMPORT_BYTES=100):
+            self.client.post(url, {'file': upload})
+            with self.assertLogs('card.jobs', 'ERROR'):
+                jobs.run_pending()
+            job = Job.objects.get()
+            self.assertEqual((job.status, job.attempts), (Job.Status.FAILED, 1))
+            self.assertIn('PermanentFailure', job.last_error)
+            self.assertEqual(os.listdir(os.path.join(media_root, 'imports')), [])
+
+    def test_non_string_values_fail_the_import_for_good(self):
+        lines = b'{"question": "q", "answer": "a"}\n\n{"question": "q", "answer": 42}\n'
+        with self.assertRaisesMessage(transfer.ImportFailed, 'Line 3: "answer" must be a string.'):
+            transfer.import_cards(self.deck.id, io.BytesIO(lines), 'jsonl')
+        url = reverse('deck-import', args=[self.deck.id])
+        upload = SimpleUploadedFile('cards.jsonl', lines * 10)
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root, JOB_INLINE_IMPORT_BYTES=100):
+            self.client.post(url, {'file': upload})
+            with self.assertLogs('card.jobs', 'ERROR'):
+                jobs.run_pending()
+            job = Job.objects.get()
+            self.assertEqual((job.status, job.attempts), (Job.Status.FAILED, 1))
+            self.assertIn('Line 3: "answer" must be a string.', job.last_error)
+        self.assertEqual(Card.objects.filter(deck=self.deck).count(), self.deck_size)
+
+    def test_stale_jobs_are_requeued(self):
+        job = jobs.enqueue('image.variants', image_id=0)
+        self.assertEqual(jobs.claim('gone', 10), [job])
+        self.assertEqual(jobs.claim('other', 10), [])
+        self.assertEqual(jobs.requeue_stale(), 0)
+        with self.settings(JOB_TIMEOUT=0):
+            self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(jobs.run_pending(), 1)
+
+
+class DeckListCacheTests(TransactionTestCase):
+    """Every deck change drops the author's cached deck list once it commits."""
+
+    def setUp(self):
+        clear_caches()
+        self.user = User.objects.create_user('author')
+        self.client.force_login(self.user)
+        self.deck = Deck.objects.create(name='First deck', author=self.user)
+        self.assertContains(self.deck_list(), 'First deck')
+
+    def deck_list(self):
+        return self.client.get(reverse('deck-list'))
+
+    def test_create(self):
+        self.client.post(reverse('deck-create'), {'deck-name': 'Second deck'})
+        self.assertContains(self.deck_list(), 'Second deck')
+
+    def test_rename(self):
+        self.client.post(reverse('deck-update', args=[self.deck.id]), {'name': 'Renamed deck'})
+        response = self.deck_list()
+        self.assertContains(response, 'Renamed deck')
+        self.assertNotContains(response, 'First deck')
+
+    def test_image_change(self):
+        picture = io.BytesIO()
+        PILImage.new('RGB', (40, 40), 'red').save(picture, 'PNG')
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            self.client.post(reverse('deck-update', args=[self.deck.id]), {
+                'name': 'First deck',
+                'new_deck_img': SimpleUploadedFile('red.png', picture.getvalue()),
+            })
+            image = Deck.objects.get(id=self.deck.id).img
+            self.assertContains(self.deck_list(), image.img.url)
+
+    def test_delete(self):
+        self.client.post(reverse('deck-delete', args=[self.deck.id]))
+        self.assertNotContains(self.deck_list(), 'First deck')
+
+    def test_other_users_lists_are_kept(self):
+        other = User.objects.create_user('other')
+        Deck.objects.create(name='Other deck', author=other)
+        self.client.force_login(other)
+        self.assertContains(self.deck_list(), 'Other deck')
+        Deck.objects.filter(author=other).update(name='Changed behind the cache')
+        self.client.force_login(self.user)
+        self.client.post(reverse('deck-update', args=[self.deck.id]), {'name': 'Renamed deck'})
+        self.client.force_login(other)
+        self.assertContains(self.deck_list(), 'Other deck')
+
+
+class ImageJobTests(TransactionTestCase):
+    """Jobs whose cache invalidation only happens once their transaction commits."""
+
+    def setUp(self):
+        clear_caches()
+        self.user = User.objects.create_user('author')
+        self.client.force_login(self.user)
+
+    def test_deck_list_shows_variants_after_the_job(self):
+        picture = io.BytesIO()
+        PILImage.new('RGB', (800, 600), 'red').save(picture, 'PNG')
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            image = Image.from_upload(SimpleUploadedFile('red.png', picture.getvalue()))
+            Deck.objects.create(name='Deck', author=self.user, img=image)
+            self.assertContains(self.client.get(reverse('deck-list')), image.img.url)
+            self.assertEqual(jobs.run_pending(), 1)
+            image.refresh_from_db()
+            response = self.client.get(reverse('deck-list'))
+        self.assertContains(response, image.thumbnail.url)
+        self.assertNotContains(response, image.img.url)
+
+
+def metric_value(text, name, **labels):
+    pattern = re.escape(f'{name}{{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}') + r' (\S+)'
+    found = re.search(pattern, text)
+    return float(found.group(1)) if found else None
+
+
+METRICS_SETTINGS = dict(METRICS_ENABLED=True, MIDDLEWARE=settings.MIDDLEWARE + ['card.middleware.MetricsMiddleware'])
+
+
+@override_settings(**METRICS_SETTINGS)
+class MetricsTests(QueryBudgetTestCase):
+    """Per-request SQL, view and template numbers, exported at /metrics."""
+
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+
+    def test_request_is_recorded(self):
+        self.client.get(reverse('card', args=[self.deck.id, 1]))
+        text = self.client.get(reverse('metrics')).content.decode()
+        labels = dict(view='card', method='GET', status=200)
+        self.assertEqual(metric_value(text, 'learn_it_request_sql_queries_total', **labels), 5)
+        self.assertEqual(metric_value(text, 'learn_it_request_duration_seconds_count', **labels), 1)
+        self.assertEqual(metric_value(text, 'learn_it_request_duration_seconds_bucket', **labels, le='+Inf'), 1)
+        self.assertGreater(metric_value(text, 'learn_it_request_template_seconds_total', **labels), 0)
+        self.assertGreater(metric_value(text, 'learn_it_request_sql_seconds_total', **labels), 0)
+
+    def test_metrics_are_local_only(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.5')
+        self.assertTemplateUsed(response, '404.html')
+
+    def test_sampled_requests_are_profiled(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                self.settings(PROFILE_URL_NAMES=['deck-detail'], PROFILE_SAMPLE_RATE=1.0, PROFILE_DIR=directory):
+            self.client.get(reverse('deck-detail', args=[self.deck.id]))
+            self.client.get(reverse('deck-list'))
+            self.assertEqual(len(os.listdir(os.path.join(directory, 'deck-detail'))), 1)
+            self.assertEqual(os.listdir(directory), ['deck-detail'])
+        text = self.client.get(reverse('metrics')).content.decode()
+        self.assertEqual(metric_value(text, 'learn_it_profiles_total', view='deck-detail'), 1)
+
+
+@override_settings(**METRICS_SETTINGS)
+class AsyncMetricsTests(TransactionTestCase):
+    """Under ASGI the middleware stays asynchronous and still sees the queries of pooled views."""
+
+    def setUp(self):
+        clear_caches()
+        metrics.reset()
+        self.user = User.objects.create_user('learner')
+        self.deck = Deck.objects.create(name='Deck', author=self.user)
+        Card.objects.create(deck=self.deck, question='Question', answer='Answer')
+        self.async_client.force_login(self.user)
+
+    async def test_async_request_is_recorded(self):
+        response = await self.async_client.get(reverse('card', args=[self.deck.id, 1]))
+        self.assertContains(response, 'Question')
+        text = metrics.exposition()
+        self.assertGreater(metric_value(text, 'learn_it_request_sql_queries_total', view='card', method='GET', status=200), 0)
+
+
+class AsyncStudyViewTests(TransactionTestCase):
+    """The study flow served through ASGI, where views run on the thread pool."""
+
+    def setUp(self):
+        clear_caches()
+        self.user = User.objects.create_user('learner')
+        self.deck = Deck.objects.create(name='Deck', author=self.user)
+        for i in range(1, 4):
+            Card.objects.create(deck=self.deck, question=f'Question {i}', answer=f'Answer {i}')
+        self.async_client.force_login(self.user)
+
+    def tearDown(self):
+        reviews.flush()
+
+    async def test_card(self):
+        response = await self.async_client.get(reverse('card', args=[self.deck.id, 2]))
+        self.assertContains(response, 'Question 2')
+
+    async def test_deck_detail(self):
+        response = await self.async_client.get(reverse('deck-detail', args=[self.deck.id]))
+        self.assertContains(response, '0/3')
+
+    async def test_study_step(self):
+        data = {'mode': 'next', 'markAsLearned': 'MASTERED', 'markAsLearnedInit': 'LEARNING'}
+        # AsyncClient in Django 3.1 cannot send multipart bodies.
+        response = await self.async_client.post(
+            reverse('study-step', args=[self.deck.id, 1]), urlencode(data),
+            content_type='application/x-www-form-urlencoded'
+        )
+        self.assertEqual(response.json()['card_no'], 2)
+        self.assertEqual(response.json()['mastered_questions'], 1)
+
+    async def test_next_card_requires_login(self):
+        response = await AsyncClient().post(reverse('next-card', args=[self.deck.id, 1]))
+        self.assertEqual(response.status_code, 302)
+
+
+class ReviewLogTests(TransactionTestCase):
+    """Review events are buffered after commit and written in batches."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('learner')
+        self.deck = Deck.objects.create(name='Deck', author=self.user)
+        self.card = Card.objects.create(deck=self.deck, question='Q', answer='A')
+
+    def tearDown(self):
+        reviews.flush()
+
+    def test_status_change_is_logged_after_flush(self):
+        self.assertTrue(Card.update_status(self.deck.id, 1, Card.QuestionStatus.MASTERED, self.user))
+        self.assertFalse(Card.update_status(self.deck.id, 1, Card.QuestionStatus.MASTERED, self.user))
+        self.assertEqual(reviews.pending(), 1)
+        self.assertFalse(ReviewEvent.objects.exists())
+        self.assertEqual(reviews.flush(), 1)
+        self.assertEqual(list(self.card.reviews.values_list('mastered', 'grade')), [(True, None)])
+
+    def test_rolled_back_review_is_not_logged(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.card.review(4)
+            raise RuntimeError()
+        self.assertEqual(reviews.pending(), 0)
+
+    @override_settings(REVIEW_LOG_BATCH_SIZE=2)
+    def test_full_buffer_is_flushed(self):
+        self.card.mark_as_learned()
+        self.card.review(1)
+        self.assertEqual(reviews.pending(), 0)
+        self.assertEqual(list(self.card.reviews.order_by('id').values_list('mastered', 'grade')), [(True, None), (False, 1)])
+
+    def test_events_of_deleted_cards_are_dropped(self):
+        other = Card.objects.create(deck=self.deck, question='Q2', answer='A2')
+        self.card.mark_as_learned()
+        other.mark_as_learned()
+        other.delete()
+        self.assertEqual(reviews.flush(), 1)
+        self.assertEqual(ReviewEvent.objects.get().card_id, self.card.id)
+
+    def test_status_save_writes_only_status(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.card.mark_as_learned()
+        update = next(query['sql'] for query in queries if query['sql'].startswith('UPDATE "card_card"'))
+        self.assertNotIn('"question"', update)
+
+
+class StatsTests(TransactionTestCase):
+    """Flushing the review log keeps the daily rollups that the dashboards read."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('learner')
+        self.client.force_login(self.user)
+        self.deck = Deck.objects.create(name='Deck', author=self.user)
+        self.cards = [Card.objects.create(deck=self.deck, question=f'Q{i}', answer='A') for i in range(1, 4)]
+
+    def tearDown(self):
+        reviews.flush()
+
+    def test_flush_updates_daily_rollup(self):
+        Card.update_status(self.deck.id, 1, Card.QuestionStatus.MASTERED, self.user)
+        Card.update_status(self.deck.id, 2, Card.QuestionStatus.MASTERED, self.user)
+        reviews.flush()
+        Card.update_status(self.deck.id, 2, Card.QuestionStatus.LEARNING, self.user)
+        reviews.flush()
+        day = DeckDay.objects.get()
+        self.assertEqual((day.reviews, day.learned, day.forgotten, day.mastered), (3, 2, 1, 1))
+        self.assertEqual(list(Card.objects.order_by('position').values_list('lapses', flat=True)), [0, 1, 0])
+
+    def test_history_fills_gaps_and_carries_mastery(self):
+        today = timezone.localdate()
+        DeckDay.objects.create(deck=self.deck, day=today - timedelta(days=40), reviews=5, mastered=2)
+        DeckDay.objects.create(deck=self.deck, day=today - timedelta(days=1), reviews=3, learned=1, mastered=3)
+        history = stats.deck_history(self.deck.id, days=3)
+        self.assertEqual([day['reviews'] for day in history], [0, 3, 0])
+        self.assertEqual([day['mastered'] for day in history], [2, 3, 3])
+
+    def test_hardest_cards(self):
+        for card in self.cards[1:]:
+            card.review(1)
+        self.cards[2].review(1)
+        reviews.flush()
+        self.assertEqual([card.id for card in stats.hardest_cards(self.deck.id)], [self.cards[2].id, self.cards[1].id])
+
+    def test_dashboards_read_rollups_only(self):
+        for card in self.cards:
+            card.review(1)
+            card.review(5)
+        reviews.flush()
+        for url in (reverse('deck-stats', args=[self.deck.id]), reverse('stats')):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(queries), 7, url)
+            self.assertFalse([query for query in queries if 'card_reviewevent' in query['sql']], url)
+        self.assertContains(self.client.get(reverse('deck-stats', args=[self.deck.id])), 'forgotten 1')
+
+    def test_dashboards_add_unflushed_events_without_writing(self):
+        Card.update_status(self.deck.id, 1, Card.QuestionStatus.MASTERED, self.user)
+        Card.update_status(self.deck.id, 2, Card.QuestionStatus.MASTERED, self.user)
+        reviews.flush()
+        Card.update_status(self.deck.id, 2, Card.QuestionStatus.LEARNING, self.user)
+        for url in (reverse('deck-stats', args=[self.deck.id]), reverse('stats')):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertFalse([query for query in queries if not query['sql'].startswith('SELECT')], url)
+            self.assertEqual(reviews.pending(), 1)
+            today = response.context['history'][-1]
+            self.assertEqual((today['reviews'], today['learned'], today['forgotten']), (3, 2, 1), url)
+        deck_today = self.client.get(reverse('deck-stats', args=[self.deck.id])).context['history'][-1]
+        self.assertEqual(deck_today['mastered'], 1)
+        self.assertEqual(DeckDay.objects.get().reviews, 2)
+
+    def test_other_users_deck_stats(self):
+        self.client.force_login(User.objects.create_user('stranger'))
+        self.assertTemplateUsed(self.client.get(reverse('deck-stats', args=[self.deck.id])), '403.html')
+
+
+class SearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('learner')
+        cls.deck = Deck.objects.create(name='Spanish', author=cls.user)
+        cls.other_deck = Deck.objects.create(name='French', author=cls.user)
+        cls.dog = Card.objects.create(deck=cls.deck, question='What is a dog?', answer='El perro')
+        cls.cat = Card.objects.create(deck=cls.deck, question='El gato', answer='A cat, not a dog')
+        cls.chien = Card.objects.create(deck=cls.other_deck, question='Le chien', answer='The dog')
+        stranger = User.objects.create_user('stranger')
+        Card.objects.create(deck=Deck.objects.create(name='Dogs', author=stranger), question='dog', answer='dog')
+
+    def found(self, query, **kwargs):
+        return [card.id for card in search.search(self.user, query, **kwargs)[0]]
+
+    def test_ranks_question_matches_first(self):
+        self.assertEqual(self.found('dog')[0], self.dog.id)
+        self.assertCountEqual(self.found('dog'), [self.dog.id, self.cat.id, self.chien.id])
+
+    def test_matches_every_word_and_last_word_prefix(self):
+        self.assertEqual(self.found('el per'), [self.dog.id])
+        self.assertEqual(self.found('"gato" OR'), [])
+
+    def test_deck_filter(self):
+        self.assertEqual(self.found('dog', deck_pk=self.other_deck.id), [self.chien.id])
+
+    def test_index_follows_edits_and_deletes(self):
+        # Fresh instances: Django 3.1 shares setUpTestData objects between tests.
+        card = Card.objects.get(id=self.chien.id)
+        card.question = 'Le loup'
+        card.answer = 'The wolf'
+        card.save()
+        self.assertEqual(self.found('wolf'), [card.id])
+        self.assertNotIn(card.id, self.found('dog'))
+        card.delete()
+        self.assertEqual(self.found('wolf'), [])
+        Deck.objects.get(id=self.deck.id).delete()
+        self.assertEqual(self.found('dog'), [])
+
+    def test_imported_cards_are_indexed(self):
+        upload = SimpleUploadedFile('cards.csv', b'question,answer\nla casa,the house\n')
+        self.client.force_login(self.user)
+        self.client.post(reverse('deck-import', args=[self.deck.id]), {'file': upload})
+        self.assertEqual(len(self.found('house')), 1)
+
+    def test_view_paginates(self):
+        Card.objects.bulk_create(
+            Card(deck=self.other_deck, question=f'word {i}', answer='', position=10 + i) for i in range(25)
+        )
+        search.index_deck(self.other_deck.id, after_position=9)
+        self.client.force_login(self.user)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('card-search'), {'q': 'word'})
+        self.assertEqual(len(response.context['cards']), search.PAGE_SIZE)
+        self.assertEqual(response.context['next_page'], 2)
+        response = self.client.get(reverse('card-search'), {'q': 'word', 'page': 2})
+        self.assertEqual(len(response.context['cards']), 5)
+        self.assertIsNone(response.context['next_page'])
+
+
+class CardPositionTests(TestCase):
+    """Positions are dense per deck, starting at 1."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.deck = Deck.objects.create(name='Deck', author=User.objects.create_user('author'))
+
+    def add_cards(self, deck, count):
+        return [Card.objects.create(deck=deck, question=f'Question {i}', answer=f'Answer {i}') for i in range(count)]
+
+    def positions(self, deck):
+        return list(Card.objects.filter(deck=deck).order_by('position').values_list('question', 'position'))
+
+    def test_new_cards_take_the_next_position(self):
+        self.add_cards(self.deck, 3)
+        self.assertEqual([position for _, position in self.positions(self.deck)], [1, 2, 3])
+
+    def test_deleting_a_card_closes_the_gap(self):
+        cards = self.add_cards(self.deck, 4)
+        cards[1].delete()
+        self.assertEqual(self.positions(self.deck), [('Question 0', 1), ('Question 2', 2), ('Question 3', 3)])
+        self.assertEqual(Card.objects.create(deck=self.deck, question='Q', answer='A').position, 4)
+
+    def test_close_gap_leaves_other_decks_alone(self):
+        other = Deck.objects.create(name='Other', author=self.deck.author)
+        self.add_cards(self.deck, 3)
+        self.add_cards(other, 3)
+        Card.objects.filter(deck=self.deck, position=1).delete()
+        Card.close_gap(self.deck.id, 1)
+        self.assertEqual([position for _, position in self.positions(self.deck)], [1, 2])
+        self.assertEqual([position for _, position in self.positions(other)], [1, 2, 3])
+
+    def test_number_card_positions_orders_cards_by_id(self):
+        other = Deck.objects.create(name='Other', author=self.deck.author)
+        Card.objects.bulk_create(
+            Card(deck=self.deck, question=f'Question {i}', answer=f'Answer {i}', position=position)
+            for i, position in enumerate([7, 0, 3])
+        )
+        self.add_cards(other, 2)
+        call_command('number_card_positions', self.deck.id, stdout=io.StringIO())
+        self.assertEqual(self.positions(self.deck), [('Question 0', 1), ('Question 1', 2), ('Question 2', 3)])
+        self.assertEqual([position for _, position in self.positions(other)], [1, 2])
+
+
+class DeckCounterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.deck = Deck.objects.create(name='Deck', author=User.objects.create_user('author'))
+
+    def counters(self):
+        return Deck.objects.filter(id=self.deck.id).values_list('card_count', 'mastered_count').get()
+
+    def test_counters_follow_card_changes(self):
+        learning = Card.objects.create(deck=self.deck, question='Q1', answer='A1')
+        mastered = Card.objects.create(
+            deck=self.deck, question='Q2', answer='A2', status=Card.QuestionStatus.MASTERED
+        )
+        self.assertEqual(self.counters(), (2, 1))
+        learning.mark_as_learned()
+        self.assertEqual(self.counters(), (2, 2))
+        learning.mark_as_learned()
+        self.assertEqual(self.counters(), (2, 2))
+        mastered.delete()
+        self.assertEqual(self.counters(), (1, 1))
+
+    def test_plain_deck_saves_keep_the_counters(self):
+        Card.objects.create(deck=self.deck, question='Q', answer='A')
+        self.deck.name = 'Renamed'
+        self.deck.save()
+        self.assertEqual(self.counters(), (1, 0))
+
+    def test_rebuild_deck_counters(self):
+        Card.objects.create(deck=self.deck, question='Q1', answer='A1')
+        Card.objects.create(deck=self.deck, question='Q2', answer='A2', status=Card.QuestionStatus.MASTERED)
+        empty = Deck.objects.create(name='Empty', author=self.deck.author)
+        Deck.objects.filter(id__in=[self.deck.id, empty.id]).update(card_count=7, mastered_count=5)
+        stamp = Deck.objects.get(id=self.deck.id).updated_at
+        call_command('rebuild_deck_counters', stdout=io.StringIO())
+        self.assertEqual(self.counters(), (2, 1))
+        self.assertGreater(Deck.objects.get(id=self.deck.id).updated_at, stamp)
+        self.assertEqual(Deck.objects.filter(id=empty.id).values_list('card_count', 'mastered_count').get(), (0, 0))
+
+
+class SchedulerTests(SimpleTestCase):
+
+    def test_first_passing_reviews_use_fixed_intervals(self):
+        self.assertEqual(scheduler.sm2(0, 0, scheduler.DEFAULT_EASE, 5)[:2], (1, 1))
+        self.assertEqual(scheduler.sm2(1, 1, scheduler.DEFAULT_EASE, 5)[:2], (2, 6))
+
+    def test_later_intervals_grow_by_the_ease_before_the_review(self):
+        self.assertEqual(scheduler.sm2(2, 6, 2.5, 4)[:2], (3, 15))
+        self.assertEqual(scheduler.sm2(3, 15, 2.0, 4)[:2], (4, 30))
+
+    def test_ease_follows_the_grade(self):
+        self.assertAlmostEqual(scheduler.sm2(2, 6, 2.5, 5)[2], 2.6)
+        self.assertAlmostEqual(scheduler.sm2(2, 6, 2.5, 4)[2], 2.5)
+        self.assertAlmostEqual(scheduler.sm2(2, 6, 2.5, 3)[2], 2.36)
+
+    def test_ease_never_drops_below_the_minimum(self):
+        self.assertEqual(scheduler.sm2(2, 6, scheduler.MIN_EASE, 3)[2], scheduler.MIN_EASE)
+
+    def test_failing_grades_restart_the_sequence(self):
+        self.assertEqual(scheduler.sm2(4, 30, 2.2, 2), (0, 1, 2.2))
+        self.assertEqual(scheduler.sm2(4, 30, 2.2, 0), (0, 1, 2.2))
+
+    def test_next_due(self):
+        now = timezone.now()
+        self.assertEqual(scheduler.next_due(now, 6), now + timedelta(days=6))
+
+
+class ImageStorageTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def upload(self, color, name=None):
+        picture = io.BytesIO()
+        PILImage.new('RGB', (32, 32), color).save(picture, 'PNG')
+        return SimpleUploadedFile(name or f'{color}.png', picture.getvalue())
+
+    def test_identical_uploads_share_one_image(self):
+        image = Image.from_upload(self.upload('red'))
+        self.assertEqual(Image.from_upload(self.upload('red', 'copy.PNG')), image)
+        self.assertNotEqual(Image.from_upload(self.upload('blue')), image)
+        self.assertEqual(Image.objects.count(), 2)
+        self.assertEqual(image.img.name, f'images/{image.sha256[:2]}/{image.sha256}.png')
+
+    def test_collect_images_deletes_old_unreferenced_images(self):
+        kept = Image.from_upload(self.upload('red'))
+        orphan = Image.from_upload(self.upload('blue'))
+        Deck.objects.create(name='Deck', author=User.objects.create_user('author'), img=kept)
+        Image.objects.update(uploaded_at=timezone.now() - timedelta(days=1))
+        recent = Image.from_upload(self.upload('green'))
+        call_command('collect_images', stdout=io.StringIO())
+        self.assertEqual(set(Image.objects.all()), {kept, recent})
+        self.assertTrue(default_storage.exists(kept.img.name))
+        for name in orphan.file_names():
+            self.assertFalse(default_storage.exists(name))
+
+    def test_collect_images_keeps_images_of_subscriber_copies(self):
+        kept = Image.from_upload(self.upload('red'))
+        Image.from_upload(self.upload('blue'))
+        author = User.objects.create_user('author')
+        deck = Deck.objects.create(name='Deck', author=author, shared=True)
+        card = Card.objects.create(deck=deck, question='Q', answer='A')
+        subscription = Subscription.objects.create(user=User.objects.create_user('subscriber'), deck=deck)
+        CardProgress.objects.create(subscription=subscription, card=card, edited=True, answer_img=kept)
+        Image.objects.update(uploaded_at=timezone.now() - timedelta(days=1))
+        call_command('collect_images', stdout=io.StringIO())
+        self.assertEqual(list(Image.objects.all()), [kept])
+
+    def test_collect_images_keeps_images_of_decks_being_deleted(self):
+        kept = Image.from_upload(self.upload('red'))
+        orphan = Image.from_upload(self.upload('blue'))
+        Deck.objects.create(name='Deck', author=User.objects.create_user('author'), img=kept).schedule_deletion()
+        Image.objects.update(uploaded_at=timezone.now() - timedelta(days=1))
+        call_command('collect_images', stdout=io.StringIO())
+        self.assertEqual(list(Image.objects.all()), [kept])
+
+
+class TransferTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('author')
+        cls.deck = Deck.objects.create(name='Deck', author=cls.user)
+        Card.objects.create(deck=cls.deck, question='Old question', answer='Old answer')
+
+    def setUp(self):
+        clear_caches()
+
+    def cards(self):
+        return list(Card.objects.filter(deck=self.deck).order_by('position').values_list(
+            'question', 'answer', 'status', 'position'
+        ))
+
+    def counters(self):
+        return Deck.objects.filter(id=self.deck.id).values_list('card_count', 'mastered_count').get()
+
+    def test_csv_import(self):
+        stream = io.BytesIO('\ufeffquestion,answer,status\nHund,dog,mastered\n"Katze, die",cat,\n'.encode())
+        self.assertEqual(transfer.import_cards(self.deck.id, stream, 'csv'), 2)
+        self.assertEqual(self.cards()[1:], [('Hund', 'dog', 'MASTERED', 2), ('Katze, die', 'cat', 'LEARNING', 3)])
+        self.assertEqual(self.counters(), (3, 1))
+
+    def test_jsonl_import(self):
+        stream = io.BytesIO(b'{"question": "Hund", "answer": "dog"}\n\n{"question": "Katze", "answer": "cat", '
+                            b'"status": "MASTERED"}\n')
+        self.assertEqual(transfer.import_cards(self.deck.id, stream, 'jsonl', batch_size=1), 2)
+        self.assertEqual(self.cards()[1:], [('Hund', 'dog', 'LEARNING', 2), ('Katze', 'cat', 'MASTERED', 3)])
+        self.assertEqual(self.counters(), (3, 1))
+
+    def test_one_invalid_record_rolls_back_the_import(self):
+        stream = io.BytesIO(b'question,answer,status\nHund,dog,\nKatze,cat,unsure\n')
+        with self.assertRaisesMessage(transfer.ImportFailed, 'Card 3 has an unknown status "UNSURE".'):
+            transfer.import_cards(self.deck.id, stream, 'csv', batch_size=1)
+        self.assertEqual(self.cards(), [('Old question', 'Old answer', 'LEARNING', 1)])
+        self.assertEqual(self.counters(), (1, 0))
+
+    def test_import_view_shows_the_error(self):
+        self.client.force_login(self.user)
+        upload = SimpleUploadedFile('cards.csv', b'question,answer\nHund,\n')
+        response = self.client.post(reverse('deck-import', args=[self.deck.id]), {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response, 'form', 'file', 'Card 2 needs both a question and an answer.')
+        self.assertEqual(self.counters(), (1, 0))
+
+    def test_export(self):
+        Card.objects.create(deck=self.deck, question='Katze, die', answer='cat', status=Card.QuestionStatus.MASTERED)
+        self.assertEqual(''.join(transfer.export_cards(self.deck.id, 'csv')).splitlines(), [
+            'question,answer,status',
+            'Old question,Old answer,LEARNING',
+            '"Katze, die",cat,MASTERED',
+        ])
+        self.assertEqual([json.loads(line) for line in transfer.export_cards(self.deck.id, 'jsonl')], [
+            {'question': 'Old question', 'answer': 'Old answer', 'status': 'LEARNING'},
+            {'question': 'Katze, die', 'answer': 'cat', 'status': 'MASTERED'},
+        ])
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('deck-export', args=[self.deck.id]), {'format': 'jsonl'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 2)
+
+
+class ImageVariantTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def picture(self, mode, size, fmt='PNG'):
+        picture = io.BytesIO()
+        PILImage.new(mode, size).save(picture, fmt)
+        return picture.getvalue()
+
+    def stored(self, data, name):
+        return Image.objects.create(img=SimpleUploadedFile(name, data))
+
+    def test_format_follows_transparency(self):
+        for mode, extension, fmt in (('RGB', 'jpg', 'JPEG'), ('RGBA', 'png', 'PNG'), ('P', 'png', 'PNG')):
+            rendered, data = images.render(PILImage.new(mode, (10, 10)), (400, 400), webp=False)
+            self.assertEqual(rendered, extension, mode)
+            self.assertEqual(PILImage.open(io.BytesIO(data)).format, fmt, mode)
+
+    @skipUnless(images.webp_supported(), 'Pillow was built without WebP')
+    def test_webp_variant(self):
+        extension, data = images.render(PILImage.new('RGBA', (10, 10)), (400, 400), webp=True)
+        self.assertEqual((extension, PILImage.open(io.BytesIO(data)).format), ('webp', 'WEBP'))
+
+    def test_variants_fit_their_box_without_upscaling(self):
+        image = self.stored(self.picture('RGB', (1600, 800), 'JPEG'), 'wide.jpg')
+        images.generate_variants(image)
+        with PILImage.open(image.thumbnail) as thumbnail, PILImage.open(image.display) as display:
+            self.assertEqual((thumbnail.size, display.size), ((400, 200), (1024, 512)))
+        image = self.stored(self.picture('RGB', (300, 200), 'JPEG'), 'small.jpg')
+        images.generate_variants(image)
+        with PILImage.open(image.display) as display:
+            self.assertEqual(display.size, (300, 200))
+
+    def test_webp_variants_are_skipped_without_support(self):
+        image = self.stored(self.picture('RGB', (50, 50)), 'red.png')
+        with mock.patch.object(images, 'webp_supported', return_value=False):
+            images.generate_variants(image)
+        self.assertTrue(image.thumbnail.name.endswith('_thumbnail.jpg'))
+        self.assertFalse(image.thumbnail_webp or image.display_webp)
+        self.assertIsNone(image.variants['thumbnail_webp'])
+
+    def test_undecodable_upload_falls_back_to_the_original(self):
+        image = self.stored(b'not a picture', 'broken.png')
+        image.generate_variants()
+        image.refresh_from_db()
+        self.assertFalse(image.thumbnail or image.display)
+        self.assertEqual(image.variants['thumbnail'], image.img.url)
+        self.assertEqual(image.variants['display'], image.img.url)
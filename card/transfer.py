@@ -0,0 +1,121 @@
+"""
+Streaming deck import and export in CSV or JSON Lines.
+
+Both formats carry one card per record with ``question``, ``answer`` and an
+optional ``status`` column. Imports are written in ``bulk_create`` batches
+inside a single transaction; exports walk the deck with ``iterator()``, so
+neither side holds the whole deck in memory.
+"""
+import codecs
+import csv
+import json
+
+from django.db import transaction
+from django.db.models import Max
+
+from . import search
+from .models import Deck, Card
+
+FORMATS = ('csv', 'jsonl')
+FIELDS = ('question', 'answer', 'status')
+BATCH_SIZE = 1000
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+class ImportFailed(Exception):
+    pass
+
+
+def guess_format(filename, default='csv'):
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return extension if extension in FORMATS else default
+
+
+def read_csv(stream):
+    yield from csv.DictReader(codecs.iterdecode(stream, 'utf-8-sig'))
+
+
+def read_jsonl(stream):
+    for line_no, line in enumerate(codecs.iterdecode(stream, 'utf-8-sig'), start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise ImportFailed(f'Line {line_no} is not valid JSON.')
+        if not isinstance(record, dict):
+            raise ImportFailed(f'Line {line_no} is not a JSON object.')
+        for field in FIELDS:
+            if not isinstance(record.get(field, ''), (str, type(None))):
+                raise ImportFailed(f'Line {line_no}: "{field}" must be a string.')
+        yield record
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+}
+
+
+def build_card(deck_pk, position, record):
+    question = (record.get('question') or '').strip()
+    answer = (record.get('answer') or '').strip()
+    if not question or not answer:
+        raise ImportFailed(f'Card {position} needs both a question and an answer.')
+    status = (record.get('status') or Card.QuestionStatus.LEARNING).strip().upper()
+    if status not in Card.QuestionStatus.values:
+        raise ImportFailed(f'Card {position} has an unknown status "{status}".')
+    return Card(deck_id=deck_pk, question=question, answer=answer, status=status, position=position)
+
+
+def import_cards(deck_pk, stream, fmt, batch_size=BATCH_SIZE):
+    """Appends the cards read from ``stream`` to the deck and returns how many were added.
+
+    Nothing is written unless every record is valid.
+    """
+    records = READERS[fmt](stream)
+    added = mastered = 0
+    with transaction.atomic():
+        Deck.objects.select_for_update().filter(id=deck_pk).first()
+        last = Card.objects.filter(deck__id=deck_pk).aggregate(last=Max('position'))['last'] or 0
+        batch = []
+        try:
+            for record in records:
+                card = build_card(deck_pk, last + added + len(batch) + 1, record)
+                mastered += card.is_mastered()
+                batch.append(card)
+                if len(batch) == batch_size:
+                    Card.objects.bulk_create(batch)
+                    added += len(batch)
+                    batch = []
+        except (csv.Error, UnicodeDecodeError) as error:
+            raise ImportFailed(f'The file could not be read: {error}')
+        if batch:
+            Card.objects.bulk_create(batch)
+            added += len(batch)
+        Deck.update_counters(deck_pk, cards=added, mastered=mastered)
+        search.index_deck(deck_pk, after_position=last)
+    return added
+
+
+class Echo:
+    """File-like object whose ``write`` hands the line back to the caller."""
+
+    def write(self, value):
+        return value
+
+
+def export_cards(deck_pk, fmt):
+    """Yields the deck's cards, in position order, serialised as ``fmt``."""
+    rows = Card.objects.filter(deck__id=deck_pk).order_by('position').values_list(*FIELDS).iterator()
+    if fmt == 'jsonl':
+        for row in rows:
+            yield json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False) + '\n'
+    else:
+        writer = csv.writer(Echo())
+        yield writer.writerow(FIELDS)
+        for row in rows:
+            yield writer.writerow(row)
@@ -1,13 +1,34 @@
+import json
+import os
+import uuid
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.files.storage import default_storage
+from django.contrib.staticfiles import finders
 from django.shortcuts import render, redirect
 from django.urls import reverse, reverse_lazy
-from django.core.exceptions import ObjectDoesNotExist
-from django.http import Http404
-from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
+from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
+from django.db.models import Q, OuterRef, Subquery
+from django.http import Http404, HttpResponse, HttpResponseRedirect, HttpResponseBadRequest, JsonResponse, \
+    StreamingHttpResponse, FileResponse
+from django.contrib.auth.decorators import login_required
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.views.decorators.gzip import gzip_page
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import require_POST, require_GET
+from django.views.static import serve
+from django.views.generic import View, TemplateView, ListView, DetailView, CreateView, UpdateView, DeleteView, FormView
 from multi_form_view import MultiModelFormView
 
-from .models import Deck, Card, Image
-from .forms import DeckForm, CardForm, ImageForm
+from .models import Deck, Card, Image, StudySession, Subscription
+from .forms import DeckForm, CardForm, ImageForm, DeckImportForm, StudySessionForm, CardCopyForm
+from .cache import deck_list
+from .decorators import async_view, deck_condition
+from .mixins import DeckOwnerMixin, PositionPageMixin, owns_deck
+from .transfer import FORMATS, CONTENT_TYPES, ImportFailed, guess_format, import_cards, export_cards
+from . import images, jobs, metrics, reviews, scheduler, search, stats
 
 
 def error_404_view(request, exception):
@@ -22,62 +43,333 @@ def home(request):
     return render(request, 'home.html')
 
 
+def posted_card_id(data):
+    try:
+        return int(data['cardId'])
+    except (KeyError, ValueError):
+        return None
+
+
+def update_posted_card(request, deck_pk, i):
+    if not owns_deck(request.user, deck_pk):
+        raise PermissionDenied()
+    if request.POST['markAsLearned'] != request.POST['markAsLearnedInit']:
+        if request.POST['markAsLearned'] == Card.QuestionStatus.MASTERED:
+            status = Card.QuestionStatus.MASTERED
+        else:
+            status = Card.QuestionStatus.LEARNING
+        # The conditional UPDATE only counts a transition once, however often it is posted.
+        Card.update_status(deck_pk, i, status, request.user, posted_card_id(request.POST))
+
+
+@async_view
+@login_required(login_url='/accounts/login/')
+@require_POST
 def next_card(request, deck_pk, i):
-    if request.method == 'POST':
-        card = Card.objects.get(id=request.POST['cardId'])
-        if request.POST['markAsLearned'] != request.POST['markAsLearnedInit']:
-            if request.POST['markAsLearned'] == "MASTERED":
-                card.mark_as_learned()
-            else:
-                card.mark_as_not_learned()
+    update_posted_card(request, deck_pk, i)
     if i < int(request.POST['cardQty']):
         return redirect('card', deck_pk, i + 1)
     else:
         return redirect('deck-detail', deck_pk)
 
 
+@async_view
+@login_required(login_url='/accounts/login/')
+@require_POST
 def next_red_card(request, deck_pk, i):
-    if request.method == 'POST':
-        card = Card.objects.get(id=request.POST['cardId'])
-        if request.POST['markAsLearned'] != request.POST['markAsLearnedInit']:
-            if request.POST['markAsLearned'] == "MASTERED":
-                card.mark_as_learned()
-            else:
-                card.mark_as_not_learned()
-        if i < int(request.POST['cardQty']):
-            index = Deck.next_red_card_index(deck_pk, i)
+    update_posted_card(request, deck_pk, i)
+    if i < int(request.POST['cardQty']):
+        index = Deck.next_red_card_index(deck_pk, i)
+        if index > 0:
             return redirect('card', deck_pk, index)
-        else:
-            return redirect('deck-detail', deck_pk)
+    return redirect('deck-detail', deck_pk)
+
+
+def review_grade(data):
+    """Reads an explicit 0-5 ``grade``, falling back to the "Learned" checkbox."""
+    try:
+        return min(5, max(0, int(data['grade'])))
+    except (KeyError, ValueError):
+        if data.get('markAsLearned') == Card.QuestionStatus.MASTERED:
+            return scheduler.MASTERED_GRADE
+        return scheduler.LEARNING_GRADE
+
+
+@login_required(login_url='/accounts/login/')
+def due_card(request, deck_pk):
+    if not owns_deck(request.user, deck_pk):
+        raise PermissionDenied()
+    card = Deck.due_cards(deck_pk).only('position').first()
+    if card is None:
+        return redirect('deck-detail', deck_pk)
+    return redirect('card', deck_pk, card.position)
+
+
+@login_required(login_url='/accounts/login/')
+@require_POST
+def next_due_card(request, deck_pk, i):
+    try:
+        card = Card.objects.get(deck__id=deck_pk, deck__author=request.user, position=i)
+    except ObjectDoesNotExist:
+        raise Http404()
+    card.review(review_grade(request.POST))
+    return due_card(request, deck_pk)
+
+
+def image_url(image, variant='display'):
+    return image.variants[variant] if image else None
+
+
+def study_payload(card, next_red):
+    deck_pk = card.deck_id
+    return {
+        'done': False,
+        'url': reverse('card', args=[deck_pk, card.position]),
+        'study_url': reverse('study-step', args=[deck_pk, card.position]),
+        'next_card_url': reverse('next-card', args=[deck_pk, card.position]),
+        'next_red_card_url': reverse('next-red-card', args=[deck_pk, card.position]),
+        'next_due_card_url': reverse('next-due-card', args=[deck_pk, card.position]),
+        'card': {
+            'id': card.id,
+            'question': card.question,
+            'question_img': image_url(card.question_img),
+            'question_img_webp': image_url(card.question_img, 'display_webp'),
+            'answer': card.answer,
+            'answer_img': image_url(card.answer_img),
+            'answer_img_webp': image_url(card.answer_img, 'display_webp'),
+            'status': card.status,
+        },
+        'card_no': card.position,
+        'cards_qty': card.deck.card_count,
+        'mastered_questions': card.deck.mastered_count,
+        'next_red': next_red,
+    }
+
+
+@async_view
+@login_required(login_url='/accounts/login/')
+@require_POST
+def study_step(request, deck_pk, i):
+    """Stores the status of card ``i`` and returns the next card as JSON.
+
+    ``mode`` is ``next`` for the following card, ``red`` for the next card
+    still being learned or ``due`` for the card that has been due the longest.
+    In the first two modes the status write is skipped when the client reports
+    no change, and the next card, the red card after it, the deck counters and
+    the images all come back from a single query. ``due`` always records a
+    review, graded by ``grade`` or the "Learned" checkbox.
+    """
+    related = ('deck', 'question_img', 'answer_img')
+    if request.POST.get('mode') == 'due':
+        try:
+            card = Card.objects.get(deck__id=deck_pk, deck__author=request.user, position=i)
+        except ObjectDoesNotExist:
+            raise Http404()
+        card.review(review_grade(request.POST))
+        card = Deck.due_cards(deck_pk).select_related(*related).first()
+        if card:
+            return JsonResponse(study_payload(card, Deck.next_red_card_index(deck_pk, card.position)))
+        return JsonResponse({'done': True, 'url': reverse('deck-detail', args=[deck_pk])})
+
+    status = request.POST.get('markAsLearned')
+    if status in Card.QuestionStatus.values and status != request.POST.get('markAsLearnedInit'):
+        Card.update_status(deck_pk, i, status, request.user, posted_card_id(request.POST))
+
+    cards = Card.objects.select_related(*related).filter(
+        deck__id=deck_pk,
+        deck__author=request.user
+    ).order_by('position')
+    learning = Q(status=Card.QuestionStatus.LEARNING)
+    if request.POST.get('mode') == 'red':
+        cards = list(cards.filter(learning, position__gt=i)[:2])
+    else:
+        cards = list(cards.filter(Q(position=i + 1) | learning & Q(position__gt=i + 1))[:2])
+        if cards and cards[0].position != i + 1:
+            cards = []
 
+    if cards:
+        return JsonResponse(study_payload(cards[0], cards[1].position if len(cards) > 1 else -1))
+    if not owns_deck(request.user, deck_pk):
+        raise PermissionDenied()
+    return JsonResponse({'done': True, 'url': reverse('deck-detail', args=[deck_pk])})
 
-class QACardView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
+
+class StudySessionCreateView(DeckOwnerMixin, FormView):
+    """Starts a shuffled, filtered or sampled study session over the deck."""
+    form_class = StudySessionForm
+    template_name = 'study_session_form.html'
+    login_url = '/accounts/login/'
+    redirect_field_name = 'login'
+
+    def form_valid(self, form):
+        session = StudySession.start(self.request.user, self.kwargs['pk'], **form.cleaned_data)
+        if session is None:
+            form.add_error(None, 'No card of this deck matches.')
+            return self.form_invalid(form)
+        return redirect('session-card', session.id, 1)
+
+
+@login_required(login_url='/accounts/login/')
+@require_GET
+def session_card(request, session_pk, step):
+    found = StudySession.step(session_pk, request.user, step)
+    if found is None:
+        raise Http404()
+    deck_pk, length, card_id = found
+    card = Card.objects.select_related('question_img', 'answer_img').filter(id=card_id, deck__id=deck_pk).first()
+    if card is None:
+        # Deleted since the session started.
+        if step < length:
+            return redirect('session-card', session_pk, step + 1)
+        return redirect('deck-detail', deck_pk)
+    return render(request, 'session_card.html', {
+        'card': card,
+        'session_pk': session_pk,
+        'step': step,
+        'length': length,
+    })
+
+
+@login_required(login_url='/accounts/login/')
+@require_POST
+def session_step(request, session_pk, step):
+    """Stores the status of the card at ``step`` and moves on to the next step."""
+    found = StudySession.step(session_pk, request.user, step)
+    if found is None:
+        raise Http404()
+    deck_pk, length, card_id = found
+    status = request.POST.get('markAsLearned')
+    if status in Card.QuestionStatus.values and status != request.POST.get('markAsLearnedInit'):
+        Card.update_statuses(deck_pk, {card_id: status}, request.user)
+    if step < length:
+        return redirect('session-card', session_pk, step + 1)
+    return redirect('deck-detail', deck_pk)
+
+
+BUNDLE_FIELDS = (
+    'id', 'position', 'question', 'answer', 'status',
+    'question_img', 'question_img_webp', 'answer_img', 'answer_img_webp',
+)
+MAX_SYNC_CHANGES = 500
+
+
+@login_required(login_url='/accounts/login/')
+@require_GET
+@gzip_page
+@deck_condition()
+def deck_bundle(request, pk):
+    """The whole deck for offline study, as one gzipped JSON document.
+
+    Cards are rows in the order of ``fields``. The ETag changes with
+    ``Deck.updated_at``, so clients revalidate with one cheap query and only
+    download the bundle again after the deck changed.
+    """
+    if not owns_deck(request.user, pk):
+        raise PermissionDenied()
+    deck = Deck.objects.get(id=pk)
+    cards = Card.objects.filter(deck__id=pk).select_related('question_img', 'answer_img').only(
+        'id', 'deck_id', 'position', 'question', 'answer', 'status', *(
+            f'{image}__{field}' for image in ('question_img', 'answer_img') for field in Image.FILE_FIELDS
+        )
+    ).order_by('position')
+    return JsonResponse({
+        'deck': {'id': deck.id, 'name': deck.name, 'version': deck.bundle_etag()},
+        'sync_url': reverse('deck-sync', args=[pk]),
+        'fields': BUNDLE_FIELDS,
+        'cards': [
+            [card.id, card.position, card.question, card.answer, card.status,
+             image_url(card.question_img), image_url(card.question_img, 'display_webp'),
+             image_url(card.answer_img), image_url(card.answer_img, 'display_webp')]
+            for card in cards
+        ],
+    })
+
+
+@login_required(login_url='/accounts/login/')
+@require_POST
+def deck_sync(request, pk):
+    """Applies the status changes made while offline: ``{"changes": [[card_id, status], ...]}``.
+
+    Later changes of the same card win. Responds with the deck counters and
+    bundle version after the changes.
+    """
+    try:
+        changes = json.loads(request.body)['changes']
+        statuses = {int(card_id): status for card_id, status in changes if status in Card.QuestionStatus.values}
+    except (ValueError, KeyError, TypeError):
+        return HttpResponseBadRequest('Expected {"changes": [[card_id, status], ...]}.')
+    if len(changes) > MAX_SYNC_CHANGES:
+        return HttpResponseBadRequest(f'At most {MAX_SYNC_CHANGES} changes per request.')
+    if not owns_deck(request.user, pk):
+        raise PermissionDenied()
+    changed = Card.update_statuses(pk, statuses, request.user)
+    deck = Deck.objects.only('id', 'card_count', 'mastered_count', 'updated_at').get(id=pk)
+    return JsonResponse({
+        'changed': changed,
+        'cards_qty': deck.card_count,
+        'mastered_questions': deck.mastered_count,
+        'version': deck.bundle_etag(),
+    })
+
+
+class OfflineStudyView(DeckOwnerMixin, DetailView):
+    """Shell page of the offline study mode; the cards come from the bundle."""
+    model = Deck
+    template_name = 'offline_study.html'
+    context_object_name = 'deck'
+
+    def get_queryset(self):
+        return Deck.objects.only('id', 'name', 'author_id')
+
+
+def service_worker(request):
+    # Served from the site root, since a worker only controls pages below its own URL.
+    path = finders.find('sw.js')
+    if path is None:
+        raise Http404()
+    response = FileResponse(open(path, 'rb'), content_type='application/javascript')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def prometheus_metrics(request):
+    """The request metrics of this process, for Prometheus to scrape from an allowed address."""
+    if not settings.METRICS_ENABLED or request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        raise Http404()
+    return HttpResponse(metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def serve_media(request, path):
+    """Serves MEDIA_ROOT in development; content-addressed uploads are marked immutable."""
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    if response.status_code == 200 and images.CONTENT_ADDRESSED.match(path):
+        patch_cache_control(response, public=True, max_age=365 * 24 * 60 * 60, immutable=True)
+    return response
+
+
+@method_decorator(deck_condition('deck_pk'), name='dispatch')
+class QACardView(DeckOwnerMixin, DetailView):
     model = Card
     template_name = 'card.html'
     context_object_name = 'card'
     login_url = '/accounts/login/'
     redirect_field_name = 'login'
+    deck_url_kwarg = 'deck_pk'
+    slug_field = 'position'
+    slug_url_kwarg = 'index'
 
-    def get_object(self, queryset=None):
-        try:
-            deck_pk = self.kwargs['deck_pk']
-            i = self.kwargs['index']
-            return Card.objects.filter(deck__id=deck_pk)[i-1]
-        except IndexError:
-            raise Http404()
+    def get_queryset(self):
+        return Card.objects.filter(deck__id=self.kwargs['deck_pk']).select_related('deck', 'question_img', 'answer_img')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['card_no'] = self.kwargs['index']
         context['next_card_no'] = self.kwargs['index']+1
         context['deck_pk'] = self.kwargs['deck_pk']
-        context['cards_qty'] = len(Card.objects.filter(deck__id=self.kwargs['deck_pk']))
+        context['cards_qty'] = self.object.deck.card_count
         context['next_red'] = Deck.next_red_card_index(self.kwargs['deck_pk'], self.kwargs['index'])
         return context
 
-    def test_func(self):
-        return self.request.user == self.get_object().deck.author
-
 
 class DeckListView(LoginRequiredMixin, ListView):
     template_name = 'deck_list.html'
@@ -86,40 +378,112 @@ class DeckListView(LoginRequiredMixin, ListView):
     redirect_field_name = 'login'
 
     def get_queryset(self):
-        return Deck.objects.filter(author=self.request.user)
+        return deck_list(self.request.user)
 
 
-class DeckDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
+@method_decorator(deck_condition(), name='dispatch')
+class DeckDetailView(DeckOwnerMixin, DetailView):
     model = Deck
     template_name = 'deck_detail.html'
     context_object_name = 'deck'
     login_url = '/accounts/login/'
     redirect_field_name = 'login'
 
+    def get_queryset(self):
+        return Deck.objects.select_related('img')
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['cards_qty'] = len(Card.objects.filter(deck=self.object))
-        context['mastered_questions'] = len(Card.objects.filter(deck=self.object).filter(status='MASTERED'))
+        context['cards_qty'] = self.object.card_count
+        context['mastered_questions'] = self.object.mastered_count
         return context
 
-    def test_func(self):
-        return self.request.user == self.get_object().author
 
-
-class CardListVIew(LoginRequiredMixin, UserPassesTestMixin, ListView):
+@method_decorator(deck_condition(), name='dispatch')
+class CardListVIew(DeckOwnerMixin, PositionPageMixin, ListView):
     template_name = 'card_list.html'
     context_object_name = 'cards'
     login_url = '/accounts/login/'
     redirect_field_name = 'login'
 
     def get_queryset(self):
-        return Card.objects.filter(deck__id=self.kwargs['pk'])
+        return self.get_page(
+            Card.objects.filter(deck__id=self.kwargs['pk']).only('id', 'deck_id', 'question', 'status', 'position', 'version')
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['deck_pk'] = self.kwargs['pk']
+        return context
 
-    def test_func(self):
+
+class CardSearchView(LoginRequiredMixin, ListView):
+    """Ranked full-text search over the user's cards (``?q=``, optionally ``?deck=`` and ``?page=``)."""
+    template_name = 'card_search.html'
+    context_object_name = 'cards'
+    login_url = '/accounts/login/'
+    redirect_field_name = 'login'
+
+    def get_number(self, name):
         try:
-            return self.request.user == Deck.objects.get(id=self.kwargs['pk']).author
-        except ObjectDoesNotExist:
-            raise Http404()
+            return max(1, int(self.request.GET[name]))
+        except (KeyError, ValueError):
+            return None
+
+    def get_queryset(self):
+        self.page = self.get_number('page') or 1
+        cards, self.has_next = search.search(
+            self.request.user, self.request.GET.get('q', ''), self.page, self.get_number('deck')
+        )
+        return cards
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['q'] = self.request.GET.get('q', '')
+        context['deck'] = self.get_number('deck')
+        context['previous_page'] = self.page - 1 if self.page > 1 else None
+        context['next_page'] = self.page + 1 if self.has_next else None
+        return context
+
+
+class DeckStatsView(DeckOwnerMixin, DetailView):
+    """Progress of one deck over the last days, read from the daily rollups."""
+    model = Deck
+    template_name = 'deck_stats.html'
+    context_object_name = 'deck'
+
+    def get_queryset(self):
+        return Deck.objects.only('id', 'name', 'author_id', 'card_count', 'mastered_count')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        pending = stats.pending_days(reviews.buffered(), {self.object.id})
+        history = stats.deck_history(self.object.id, pending=pending, mastered_count=self.object.mastered_count)
+        context['history'] = history
+        context['peak_reviews'] = max(day['reviews'] for day in history)
+        context['total_reviews'] = sum(day['reviews'] for day in history)
+        context['hardest_cards'] = stats.hardest_cards(self.object.id)
+        return context
+
+
+class StatsView(LoginRequiredMixin, TemplateView):
+    """Daily reviews over all of the user's decks, read from the daily rollups."""
+    template_name = 'stats.html'
+    login_url = '/accounts/login/'
+    redirect_field_name = 'login'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        decks = list(Deck.objects.filter(author=self.request.user).only(
+            'id', 'name', 'card_count', 'mastered_count'
+        ).order_by('id'))
+        pending = stats.pending_days(reviews.buffered(), {deck.id for deck in decks})
+        history = stats.user_history(self.request.user, pending=pending)
+        context['history'] = history
+        context['peak_reviews'] = max(day['reviews'] for day in history)
+        context['total_reviews'] = sum(day['reviews'] for day in history)
+        context['decks'] = decks
+        return context
 
 
 class DeckCreateView(LoginRequiredMixin, MultiModelFormView):
@@ -141,7 +505,7 @@ class DeckCreateView(LoginRequiredMixin, MultiModelFormView):
     def get_objects(self):
         self.deck_id = self.kwargs.get('deck_id', None)
         try:
-            deck = Deck.objects.get(id=self.deck_id)
+            deck = Deck.objects.get(id=self.deck_id) if self.deck_id is not None else None
         except ObjectDoesNotExist:
             deck = None
         return {
@@ -155,12 +519,14 @@ class DeckCreateView(LoginRequiredMixin, MultiModelFormView):
     def forms_valid(self, forms):
         deck = forms['deck_form'].save(commit=False)
         if forms['img_form'].instance.img:
-            deck.img = forms['img_form'].save()
+            deck.img = Image.from_upload(forms['img_form'].cleaned_data['img'])
         deck.save()
-        return super(DeckCreateView, self).forms_valid(forms)
+        # MultiModelFormView.forms_valid would save every form again, storing
+        # the raw upload a second time outside of Image.from_upload.
+        return HttpResponseRedirect(self.get_success_url())
 
 
-class DeckUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class DeckUpdateView(DeckOwnerMixin, UpdateView):
     model = Deck
     form_class = DeckForm
     template_name = 'deck_update_form.html'
@@ -175,35 +541,63 @@ class DeckUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     def post(self, request, *args, **kwargs):
         tmp = super().post(request, **kwargs)
         if 'new_deck_img' in request.FILES:
-            deck_img = Image(img=request.FILES['new_deck_img'])
-            deck_img.save()
-            self.object.update_img(deck_img)
+            self.object.update_img(Image.from_upload(request.FILES['new_deck_img']))
         return tmp
 
-    def test_func(self):
-        try:
-            return self.request.user == Deck.objects.get(id=self.kwargs['pk']).author
-        except ObjectDoesNotExist:
-            raise Http404()
-
 
-class DeckDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
+class DeckDeleteView(DeckOwnerMixin, DeleteView):
     model = Deck
     template_name = 'deck_confirm_delete.html'
     success_url = reverse_lazy('deck-list')
     login_url = '/accounts/login/'
     redirect_field_name = 'login'
 
-    def test_func(self):
-        print(self.request.user)
-        print(Deck.objects.get(id=self.kwargs['pk']).author)
+    def delete(self, request, *args, **kwargs):
+        # The cards go in a background job; the deck disappears right away.
+        self.object = self.get_object()
+        self.object.schedule_deletion()
+        return HttpResponseRedirect(self.get_success_url())
+
+
+class DeckImportView(DeckOwnerMixin, FormView):
+    form_class = DeckImportForm
+    template_name = 'deck_import_form.html'
+    login_url = '/accounts/login/'
+    redirect_field_name = 'login'
+
+    def form_valid(self, form):
+        upload = form.cleaned_data['file']
+        fmt = form.cleaned_data['format'] or guess_format(upload.name)
+        if upload.size > settings.JOB_INLINE_IMPORT_BYTES:
+            path = default_storage.save(os.path.join('imports', f'{uuid.uuid4().hex}.{fmt}'), upload)
+            jobs.enqueue('deck.import', deck_id=self.kwargs['pk'], path=path, fmt=fmt)
+            messages.info(self.request, 'The import has been queued; the cards will show up in a moment.')
+            return super().form_valid(form)
         try:
-            return self.request.user == Deck.objects.get(id=self.kwargs['pk']).author
-        except ObjectDoesNotExist:
+            import_cards(self.kwargs['pk'], upload, fmt)
+        except ImportFailed as error:
+            form.add_error('file', str(error))
+            return self.form_invalid(form)
+        return super().form_valid(form)
+
+    def get_success_url(self):
+        return reverse('deck-detail', args=[self.kwargs['pk']])
+
+
+class DeckExportView(DeckOwnerMixin, View):
+    login_url = '/accounts/login/'
+    redirect_field_name = 'login'
+
+    def get(self, request, *args, **kwargs):
+        fmt = request.GET.get('format', 'csv')
+        if fmt not in FORMATS:
             raise Http404()
+        response = StreamingHttpResponse(export_cards(self.kwargs['pk'], fmt), content_type=CONTENT_TYPES[fmt])
+        response['Content-Disposition'] = f'attachment; filename="deck-{self.kwargs["pk"]}.{fmt}"'
+        return response
 
 
-class CardCreateView(LoginRequiredMixin, UserPassesTestMixin, MultiModelFormView):
+class CardCreateView(DeckOwnerMixin, MultiModelFormView):
     form_classes = {
         'card_form': CardForm,
         'question_image_form': ImageForm,
@@ -224,7 +618,7 @@ class CardCreateView(LoginRequiredMixin, UserPassesTestMixin, MultiModelFormView
     def get_objects(self):
         self.card_id = self.kwargs.get('card_id', None)
         try:
-            card = Card.objects.get(id=self.card_id)
+            card = Card.objects.get(id=self.card_id) if self.card_id is not None else None
         except ObjectDoesNotExist:
             card = None
         return {
@@ -239,26 +633,24 @@ class CardCreateView(LoginRequiredMixin, UserPassesTestMixin, MultiModelFormView
     def forms_valid(self, forms):
         card = forms['card_form'].save(commit=False)
         if forms['question_image_form'].instance.img:
-            card.question_img = forms['question_image_form'].save()
+            card.question_img = Image.from_upload(forms['question_image_form'].cleaned_data['img'])
         if forms['answer_image_form'].instance.img:
-            card.answer_img = forms['answer_image_form'].save()
+            card.answer_img = Image.from_upload(forms['answer_image_form'].cleaned_data['img'])
         card.save()
-        return super(CardCreateView, self).forms_valid(forms)
+        return HttpResponseRedirect(self.get_success_url())
 
-    def test_func(self):
-        try:
-            return self.request.user == Deck.objects.get(id=self.kwargs['pk']).author
-        except ObjectDoesNotExist:
-            raise Http404()
 
-
-class CardUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class CardUpdateView(DeckOwnerMixin, UpdateView):
     model = Card
     form_class = CardForm
     template_name = 'card_update_form.html'
     success_url = reverse_lazy('deck-list')
     login_url = '/accounts/login/'
     redirect_field_name = 'login'
+    deck_url_kwarg = 'deck_pk'
+
+    def get_queryset(self):
+        return Card.objects.filter(deck__id=self.kwargs['deck_pk']).select_related('question_img', 'answer_img')
 
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
@@ -267,38 +659,179 @@ class CardUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['card'] = Card.objects.get(id=self.kwargs['pk'])
+        context['card'] = self.object
         return context
 
     def post(self, request, *args, **kwargs):
         tmp = super().post(request, **kwargs)
         if 'new_question_image' in request.FILES:
-            question_img = Image(img=request.FILES['new_question_image'])
-            question_img.save()
-            self.object.update_question_img(question_img)
+            self.object.update_question_img(Image.from_upload(request.FILES['new_question_image']))
         if 'new_answer_image' in request.FILES:
-            answer_img = Image(img=request.FILES['new_answer_image'])
-            answer_img.save()
-            self.object.update_answer_img(answer_img)
+            self.object.update_answer_img(Image.from_upload(request.FILES['new_answer_image']))
         return tmp
 
-    def test_func(self):
-        try:
-            return self.request.user == Deck.objects.get(id=self.kwargs['deck_pk']).author
-        except ObjectDoesNotExist:
-            raise Http404()
-
 
-class CardDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
+class CardDeleteView(DeckOwnerMixin, DeleteView):
     model = Card
     template_name = 'card_confirm_delete.html'
     success_url = reverse_lazy('deck-list')
     login_url = '/accounts/login/'
     redirect_field_name = 'login'
+    deck_url_kwarg = 'deck_pk'
+
+    def get_queryset(self):
+        return Card.objects.filter(deck__id=self.kwargs['deck_pk']).select_related('deck')
+
+
+class SharedDeckListView(LoginRequiredMixin, ListView):
+    """Decks other users share, and the ones the user subscribed to."""
+    template_name = 'shared_deck_list.html'
+    context_object_name = 'decks'
+    login_url = '/accounts/login/'
+    redirect_field_name = 'login'
+    paginate_by = 30
+
+    def get_queryset(self):
+        return Deck.objects.filter(shared=True).exclude(author=self.request.user).select_related(
+            'img', 'author'
+        ).annotate(subscription_id=Subquery(
+            Subscription.objects.filter(user=self.request.user, deck=OuterRef('pk')).values('id')[:1]
+        )).order_by('-id')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['subscriptions'] = Subscription.objects.filter(
+            user=self.request.user, deck__deleting=False
+        ).select_related('deck__author').order_by('deck__name')
+        return context
+
+
+@login_required(login_url='/accounts/login/')
+@require_POST
+def subscribe(request, pk):
+    deck = Deck.objects.filter(id=pk, shared=True).exclude(author=request.user).first()
+    if deck is None:
+        raise Http404()
+    subscription, _ = Subscription.objects.get_or_create(user=request.user, deck=deck)
+    return redirect(subscription)
+
 
-    def test_func(self):
+def get_subscription(request, pk):
+    """One of the user's subscriptions, with its deck; Http404 if there is no such subscription."""
+    subscription = Subscription.objects.select_related('deck__author', 'deck__img').filter(
+        id=pk, user=request.user, deck__deleting=False
+    ).first()
+    if subscription is None:
+        raise Http404()
+    return subscription
+
+
+class SubscriptionMixin(LoginRequiredMixin):
+    """Looks up the user's subscription named by the ``pk`` URL argument, once per request."""
+    login_url = '/accounts/login/'
+    redirect_field_name = 'login'
+
+    @property
+    def subscription(self):
+        if not hasattr(self, '_subscription'):
+            self._subscription = get_subscription(self.request, self.kwargs['pk'])
+        return self._subscription
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['subscription'] = self.subscription
+        context['deck'] = self.subscription.deck
+        return context
+
+
+class SubscriptionDetailView(SubscriptionMixin, TemplateView):
+    template_name = 'subscription_detail.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['cards_qty'] = self.subscription.deck.card_count
+        context['mastered_questions'] = self.subscription.mastered_count()
+        return context
+
+
+class SubscriptionCardListView(SubscriptionMixin, PositionPageMixin, ListView):
+    template_name = 'subscription_card_list.html'
+    context_object_name = 'cards'
+
+    def get_queryset(self):
+        return self.subscription.cards(self.get_page(
+            Card.objects.filter(deck__id=self.subscription.deck_id).only('id', 'deck_id', 'question', 'position', 'version')
+        ))
+
+
+@login_required(login_url='/accounts/login/')
+@require_GET
+def subscription_card(request, pk, index):
+    subscription = get_subscription(request, pk)
+    card = subscription.card_at(index)
+    if card is None:
+        raise Http404()
+    return render(request, 'subscription_card.html', {
+        'subscription': subscription,
+        'card': card,
+        'cards_qty': subscription.deck.card_count,
+        'next_red': subscription.next_red_card_index(index),
+    })
+
+
+@login_required(login_url='/accounts/login/')
+@require_POST
+def subscription_step(request, pk, index):
+    """Stores the subscriber's status of the posted card and moves on to the next (``mode=red``: red) card."""
+    subscription = get_subscription(request, pk)
+    status = request.POST.get('markAsLearned')
+    if status in Card.QuestionStatus.values and status != request.POST.get('markAsLearnedInit'):
         try:
-            return self.request.user == Deck.objects.get(id=self.kwargs['deck_pk']).author
-        except ObjectDoesNotExist:
-            raise Http404()
+            subscription.set_status(int(request.POST['cardId']), status)
+        except (KeyError, ValueError):
+            return HttpResponseBadRequest()
+    if request.POST.get('mode') == 'red':
+        index = subscription.next_red_card_index(index)
+        if index > 0:
+            return redirect('subscription-card', pk, index)
+    elif index < subscription.deck.card_count:
+        return redirect('subscription-card', pk, index + 1)
+    return redirect(subscription)
+
+
+class SubscriptionCardUpdateView(SubscriptionMixin, FormView):
+    """Edits the subscriber's own copy of a card, made on their first edit."""
+    form_class = CardCopyForm
+    template_name = 'subscription_card_form.html'
+
+    @property
+    def card(self):
+        if not hasattr(self, '_card'):
+            self._card = self.subscription.card_at(self.kwargs['index'])
+            if self._card is None:
+                raise Http404()
+        return self._card
+
+    def get_initial(self):
+        return {'question': self.card.question, 'answer': self.card.answer}
+
+    def form_valid(self, form):
+        self.subscription.edit(self.card, form.cleaned_data['question'], form.cleaned_data['answer'])
+        return super().form_valid(form)
+
+    def get_success_url(self):
+        return reverse('subscription-card', args=[self.kwargs['pk'], self.kwargs['index']])
+
+
+@login_required(login_url='/accounts/login/')
+@require_POST
+def subscription_reset(request, pk):
+    get_subscription(request, pk).reset()
+    return redirect('subscription-detail', pk)
+
 
+@login_required(login_url='/accounts/login/')
+@require_POST
+def unsubscribe(request, pk):
+    get_subscription(request, pk).delete()
+    return redirect('shared-deck-list')
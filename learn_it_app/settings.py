@@ -27,7 +27,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
 
-    'card'
+    'card.apps.CardConfig'
 ]
 
 MIDDLEWARE = [
@@ -42,11 +42,20 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'learn_it_app.urls'
 
+# Outside development templates are compiled once per process and kept in
+# memory by the cached loader, instead of being read and parsed per render.
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+if not DEBUG:
+    TEMPLATE_LOADERS = [('django.template.loaders.cached.Loader', TEMPLATE_LOADERS)]
+
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # The stock backend, with renders timed when request metrics are on.
+        'BACKEND': 'card.metrics.DjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR,'templates')],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -54,6 +63,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            'loaders': TEMPLATE_LOADERS,
         },
     },
 ]
@@ -61,15 +71,112 @@ TEMPLATES = [
 WSGI_APPLICATION = 'learn_it_app.wsgi.application'
 
 
+# Request metrics
+# METRICS=1 records the time, SQL and template rendering of every request and
+# serves the aggregates at /metrics to METRICS_ALLOWED_IPS; see card.metrics.
+# PROFILE_URL_NAMES (comma-separated URL names) also runs a PROFILE_SAMPLE_RATE
+# fraction of their requests under cProfile, writing the profiles to PROFILE_DIR.
+
+METRICS_ENABLED = os.environ.get('METRICS', '') == '1'
+METRICS_ALLOWED_IPS = os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+PROFILE_URL_NAMES = [name for name in os.environ.get('PROFILE_URL_NAMES', '').split(',') if name]
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.01))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', BASE_DIR / 'profiles')
+
+if METRICS_ENABLED:
+    MIDDLEWARE.append('card.middleware.MetricsMiddleware')
+
+
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
+# DATABASE_ENGINE picks the profile: 'sqlite' (default) for a single node,
+# 'postgresql' when several workers write concurrently (needs psycopg2, see
+# requirements-postgresql.txt).
+
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite')
+
+if DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DATABASE_NAME', 'learn_it'),
+            'USER': os.environ.get('DATABASE_USER', ''),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('DATABASE_HOST', ''),
+            'PORT': os.environ.get('DATABASE_PORT', ''),
+            # Keep connections open between requests instead of reconnecting every time.
+            'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 600)),
+            # Transaction-level poolers such as PgBouncer cannot keep server-side
+            # cursors open across transactions.
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DATABASE_POOLER', '') == 'pgbouncer',
+            'OPTIONS': {
+                'connect_timeout': 5,
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DATABASE_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # Seconds a writer waits for the lock before "database is locked".
+                'timeout': 20,
+            },
+        }
+    }
 
-DATABASES = {
+# Study results are buffered per process and written to the review log in
+# batches; see card.reviews.
+REVIEW_LOG_BATCH_SIZE = int(os.environ.get('REVIEW_LOG_BATCH_SIZE', 200))
+REVIEW_LOG_FLUSH_SECONDS = int(os.environ.get('REVIEW_LOG_FLUSH_SECONDS', 10))
+
+# Background jobs (card.jobs). The database backend queues them for the
+# run_jobs worker; card.jobs.ImmediateBackend runs them in the request's
+# process once its transaction commits, for setups without a worker.
+JOB_BACKEND = os.environ.get('JOB_BACKEND', 'card.jobs.DatabaseBackend')
+JOB_CONCURRENCY = int(os.environ.get('JOB_CONCURRENCY', 4))
+JOB_MAX_ATTEMPTS = 5
+# Seconds before the first retry; doubled for every further attempt.
+JOB_RETRY_DELAY = 30
+# A job running for longer is assumed to have lost its worker and is queued again.
+JOB_TIMEOUT = 600
+# Imports up to this size are still done inside the request.
+JOB_INLINE_IMPORT_BYTES = 256 * 1024
+
+# Applied to every new SQLite connection by card.signals. WAL lets readers run
+# alongside the single writer, and NORMAL sync is safe under WAL.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -20000,
+    'temp_store': 'MEMORY',
+    'mmap_size': 134217728,
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+# The local-memory default is per process; point CACHE_BACKEND at memcached
+# (or a file/database cache) when running more than one worker, with
+# CACHE_LOCATION and FRAGMENT_CACHE_LOCATION set to two different locations.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'learn-it'),
+    },
+    # Rendered {% cache %} fragments. Their keys carry the card or deck
+    # version, so stale entries are never read and simply age out. They get
+    # their own location, so they cannot evict or clear the default cache.
+    'template_fragments': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('FRAGMENT_CACHE_LOCATION', 'learn-it-fragments'),
+    },
 }
+if CACHES['template_fragments']['BACKEND'].endswith('LocMemCache'):
+    # The default of 300 entries would not even hold the cards of a few list pages.
+    CACHES['template_fragments']['OPTIONS'] = {'MAX_ENTRIES': 10000}
 
 
 # Password validation
@@ -109,9 +216,14 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.1/howto/static-files/
 
 STATIC_URL = '/static/'
-STATIC_ROOT = ''
+STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATICFILES_DIRS = ( os.path.join('static'), )
-# STATIC_ROOT = os.path.join(BASE_DIR,'/static/')
+
+# collectstatic writes content-hashed copies (styles.<hash>.css) that can be
+# served with far-future cache headers. The manifest only exists after
+# collectstatic, so development keeps the plain names.
+if not DEBUG:
+    STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.ManifestStaticFilesStorage'
 
 MEDIA_ROOT = BASE_DIR / 'media'
 MEDIA_URL = '/media/'
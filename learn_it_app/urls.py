@@ -1,11 +1,16 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from card.decorators import async_view
 from card.views import DeckListView, DeckDetailView, home, DeckCreateView, \
     DeckUpdateView, DeckDeleteView, CardCreateView, next_card, CardListVIew, CardDeleteView, CardUpdateView, \
-    QACardView, next_red_card
+    QACardView, next_red_card, study_step, due_card, next_due_card, DeckImportView, DeckExportView, \
+    CardSearchView, OfflineStudyView, DeckStatsView, StatsView, \
+    StudySessionCreateView, session_card, session_step, deck_bundle, deck_sync, service_worker, serve_media, \
+    prometheus_metrics, SharedDeckListView, subscribe, SubscriptionDetailView, SubscriptionCardListView, \
+    subscription_card, subscription_step, SubscriptionCardUpdateView, subscription_reset, unsubscribe
 
 # admin.site.register(Image)
 # admin.site.register(Deck)
@@ -18,17 +23,46 @@ urlpatterns = [
     path('deck/create/', DeckCreateView.as_view(), name='deck-create'),
     path('deck/update/<int:pk>/', DeckUpdateView.as_view(), name='deck-update'),
     path('deck/delete/<int:pk>/', DeckDeleteView.as_view(), name='deck-delete'),
-    path('deck/<int:pk>/', DeckDetailView.as_view(), name='deck-detail'),
-    path('deck/<int:deck_pk>/card/<int:index>/', QACardView.as_view(), name='card'),
+    path('deck/<int:pk>/', async_view(DeckDetailView.as_view()), name='deck-detail'),
+    path('deck/<int:pk>/import/', DeckImportView.as_view(), name='deck-import'),
+    path('deck/<int:pk>/export/', DeckExportView.as_view(), name='deck-export'),
+    path('deck/<int:pk>/stats/', DeckStatsView.as_view(), name='deck-stats'),
+    path('stats/', StatsView.as_view(), name='stats'),
+    path('deck/<int:pk>/offline/', OfflineStudyView.as_view(), name='deck-offline'),
+    path('api/deck/<int:pk>/bundle/', deck_bundle, name='deck-bundle'),
+    path('api/deck/<int:pk>/sync/', deck_sync, name='deck-sync'),
+    path('sw.js', service_worker, name='service-worker'),
+    path('metrics', prometheus_metrics, name='metrics'),
+    path('deck/<int:deck_pk>/card/<int:index>/', async_view(QACardView.as_view()), name='card'),
     path('deck/<int:pk>/cards/', CardListVIew.as_view(), name='card-list'),
+    path('search/', CardSearchView.as_view(), name='card-search'),
     path('deck/<int:pk>/add_card/', CardCreateView.as_view(), name="add-card"),
     path('deck/<int:deck_pk>/update_card/<int:pk>', CardUpdateView.as_view(), name="card-update"),
     path('deck/<int:deck_pk>/delete_card/<int:pk>', CardDeleteView.as_view(), name="card-delete"),
     path('deck/<int:deck_pk>/question/<int:i>/next', next_card, name='next-card'),
     path('deck/<int:deck_pk>/question/<int:i>/next-red', next_red_card, name='next-red-card'),
+    path('deck/<int:deck_pk>/question/<int:i>/next-due', next_due_card, name='next-due-card'),
+    path('deck/<int:deck_pk>/due/', due_card, name='due-card'),
+    path('deck/<int:pk>/session/', StudySessionCreateView.as_view(), name='session-create'),
+    path('session/<int:session_pk>/<int:step>/', session_card, name='session-card'),
+    path('session/<int:session_pk>/<int:step>/next', session_step, name='session-step'),
+    path('api/deck/<int:deck_pk>/study/<int:i>/', study_step, name='study-step'),
+    path('shared/', SharedDeckListView.as_view(), name='shared-deck-list'),
+    path('shared/<int:pk>/subscribe/', subscribe, name='deck-subscribe'),
+    path('subscription/<int:pk>/', SubscriptionDetailView.as_view(), name='subscription-detail'),
+    path('subscription/<int:pk>/cards/', SubscriptionCardListView.as_view(), name='subscription-card-list'),
+    path('subscription/<int:pk>/card/<int:index>/', subscription_card, name='subscription-card'),
+    path('subscription/<int:pk>/card/<int:index>/next', subscription_step, name='subscription-step'),
+    path('subscription/<int:pk>/card/<int:index>/edit/', SubscriptionCardUpdateView.as_view(),
+         name='subscription-card-update'),
+    path('subscription/<int:pk>/reset/', subscription_reset, name='subscription-reset'),
+    path('subscription/<int:pk>/delete/', unsubscribe, name='subscription-delete'),
     path('accounts/', include('accounts.urls')),
 
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT) + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+
+if settings.DEBUG:
+    urlpatterns += [re_path(r'^%s(?P<path>.*)$' % settings.MEDIA_URL.lstrip('/'), serve_media)]
 
 handler404 = 'card.views.error_404_view'
 handler403 = 'card.views.error_403_view'
@@ -0,0 +1,157 @@
+// Offline study mode: the whole deck comes from one bundle, studying never
+// waits for the server, and status changes are queued in localStorage until
+// they can be sent to the sync endpoint in batches.
+const offlineStudy = document.getElementById('offlineStudy')
+const MEDIA_CACHE = 'learn-it-media'
+const SYNC_BATCH = 500
+
+if ('serviceWorker' in navigator) {
+    navigator.serviceWorker.register('/sw.js')
+}
+
+if (offlineStudy) {
+    const queueKey = `learn-it:sync:${offlineStudy.dataset.deckId}`
+    const learned = document.getElementById('offlineStatus')
+    let bundle = null
+    let cards = []
+    let index = 0
+    let syncing = false
+
+    const field = name => bundle.fields.indexOf(name)
+    const pending = () => JSON.parse(localStorage.getItem(queueKey) || '[]')
+    const savePending = changes => localStorage.setItem(queueKey, JSON.stringify(changes))
+
+    function csrfToken() {
+        const cookie = document.cookie.split('; ').find(item => item.startsWith('csrftoken='))
+        return cookie ? decodeURIComponent(cookie.split('=')[1]) : ''
+    }
+
+    function showSyncState() {
+        const count = pending().length
+        document.getElementById('offlineSyncState').textContent =
+            count ? `${count} change(s) to sync${navigator.onLine ? '' : ' (offline)'}` : 'All changes synced'
+        const mastered = cards.filter(card => card[field('status')] === 'MASTERED').length
+        document.getElementById('offlineProgress').textContent = `${mastered}/${cards.length}`
+    }
+
+    function sync() {
+        const changes = pending().slice(0, SYNC_BATCH)
+        if (syncing || !changes.length || !navigator.onLine) {
+            showSyncState()
+            return Promise.resolve()
+        }
+        syncing = true
+        return fetch(bundle.sync_url, {
+            method: 'POST',
+            credentials: 'same-origin',
+            headers: {'Content-Type': 'application/json', 'X-CSRFToken': csrfToken()},
+            body: JSON.stringify({changes}),
+        })
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(response.statusText)
+                }
+                savePending(pending().slice(changes.length))
+                syncing = false
+                return sync()
+            })
+            .catch(() => {
+                syncing = false
+                showSyncState()
+            })
+    }
+
+    function showImage(wrapperId, imgId, url, webpUrl) {
+        const img = document.getElementById(imgId)
+        let source = img.parentElement.querySelector('source')
+        document.getElementById(wrapperId).classList.toggle('d-none', !url)
+        if (webpUrl) {
+            if (!source) {
+                source = document.createElement('source')
+                source.type = 'image/webp'
+                img.parentElement.prepend(source)
+            }
+            source.srcset = webpUrl
+        } else if (source) {
+            source.remove()
+        }
+        img.src = url || ''
+    }
+
+    function show(i) {
+        const card = cards[i]
+        index = i
+        document.getElementById('questionText').textContent = card[field('question')]
+        document.getElementById('answerText').textContent = card[field('answer')]
+        showImage('questionImgWrapper', 'questionImg', card[field('question_img')], card[field('question_img_webp')])
+        showImage('answerImgWrapper', 'answerImg', card[field('answer_img')], card[field('answer_img_webp')])
+        document.getElementById('collapseExample').classList.remove('show')
+        learned.checked = card[field('status')] === 'MASTERED'
+        document.getElementById('offlineNext').textContent = i + 1 < cards.length ? 'Next Card' : 'Finish'
+        document.getElementById('offlineNextRed').classList.toggle('d-none', nextRed() < 0)
+        showSyncState()
+    }
+
+    function nextRed() {
+        return cards.findIndex((card, i) => i > index && card[field('status')] === 'LEARNING')
+    }
+
+    function finish() {
+        sync().then(() => window.location.assign(offlineStudy.dataset.deckUrl))
+    }
+
+    function cacheImages() {
+        if (!('caches' in window)) {
+            return
+        }
+        const urls = new Set()
+        cards.forEach(card => ['question_img', 'question_img_webp', 'answer_img', 'answer_img_webp'].forEach(name => {
+            if (card[field(name)]) {
+                urls.add(card[field(name)])
+            }
+        }))
+        caches.open(MEDIA_CACHE).then(cache => urls.forEach(url => {
+            cache.match(url).then(hit => hit || cache.add(url).catch(() => null))
+        }))
+    }
+
+    learned.addEventListener('change', () => {
+        const card = cards[index]
+        card[field('status')] = learned.checked ? 'MASTERED' : 'LEARNING'
+        savePending(pending().concat([[card[field('id')], card[field('status')]]]))
+        document.getElementById('offlineNextRed').classList.toggle('d-none', nextRed() < 0)
+        showSyncState()
+    })
+    document.getElementById('offlineNext').addEventListener('click', () => {
+        index + 1 < cards.length ? show(index + 1) : finish()
+    })
+    document.getElementById('offlineNextRed').addEventListener('click', () => {
+        const i = nextRed()
+        i < 0 ? finish() : show(i)
+    })
+    window.addEventListener('online', sync)
+
+    fetch(offlineStudy.dataset.bundleUrl, {credentials: 'same-origin'})
+        .then(response => response.json())
+        .then(data => {
+            bundle = data
+            cards = bundle.cards
+            // Changes not synced yet are newer than any bundle the server or the cache returned.
+            const statuses = new Map(pending())
+            cards.forEach(card => {
+                if (statuses.has(card[field('id')])) {
+                    card[field('status')] = statuses.get(card[field('id')])
+                }
+            })
+            if (!cards.length) {
+                window.location.assign(offlineStudy.dataset.deckUrl)
+                return
+            }
+            show(0)
+            cacheImages()
+            sync()
+        })
+        .catch(() => {
+            document.getElementById('offlineSyncState').textContent = 'This deck is not available offline yet.'
+        })
+}
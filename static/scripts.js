@@ -1,17 +1,76 @@
 const status = document.getElementById('cardStatus')
-const sendStatus = document.getElementById('sendStatus')
-const sendStatus2 = document.getElementById('sendStatus2')
 
 if (status) {
     status.addEventListener('change', () => {
-        console.log('im in')
-        if (status.checked) {
-            sendStatus.value = "MASTERED"
-            sendStatus2.value = "MASTERED"
-        } else {
-            sendStatus.value = "LEARNING"
-            sendStatus2.value = "LEARNING"
-        }
+        document.querySelectorAll('input[name="markAsLearned"][type="hidden"]').forEach(input => {
+            input.value = status.checked ? "MASTERED" : "LEARNING"
+        })
     })
 }
 
+const studyCard = document.getElementById('studyCard')
+
+function showImage(wrapperId, imgId, url, webpUrl) {
+    const wrapper = document.getElementById(wrapperId)
+    const img = document.getElementById(imgId)
+    let source = img.parentElement.querySelector('source')
+    wrapper.classList.toggle('d-none', !url)
+    if (webpUrl) {
+        if (!source) {
+            source = document.createElement('source')
+            source.type = 'image/webp'
+            img.parentElement.prepend(source)
+        }
+        source.srcset = webpUrl
+    } else if (source) {
+        source.remove()
+    }
+    img.src = url || ''
+}
+
+function showCard(step) {
+    const card = step.card
+    document.getElementById('questionText').textContent = card.question
+    document.getElementById('answerText').textContent = card.answer
+    showImage('questionImgWrapper', 'questionImg', card.question_img, card.question_img_webp)
+    showImage('answerImgWrapper', 'answerImg', card.answer_img, card.answer_img_webp)
+    document.getElementById('collapseExample').classList.remove('show')
+
+    status.checked = card.status === "MASTERED"
+    document.querySelectorAll('input[name="cardId"]').forEach(input => input.value = card.id)
+    document.querySelectorAll('input[name="cardQty"]').forEach(input => input.value = step.cards_qty)
+    document.querySelectorAll('input[name^="markAsLearned"][type="hidden"]').forEach(input => input.value = card.status)
+    document.getElementById('nextCardForm').action = step.next_card_url
+    document.getElementById('nextRedForm').action = step.next_red_card_url
+    document.getElementById('nextDueForm').action = step.next_due_card_url
+    document.getElementById('nextCardButton').textContent = step.card_no < step.cards_qty ? 'Next Card' : 'Finish'
+    document.getElementById('nextRedButton').classList.toggle('d-none', step.next_red < 0)
+    studyCard.dataset.studyUrl = step.study_url
+}
+
+if (studyCard) {
+    document.querySelectorAll('.study-form').forEach(form => {
+        form.addEventListener('submit', event => {
+            event.preventDefault()
+            const data = new FormData(form)
+            data.append('mode', form.dataset.mode)
+            fetch(studyCard.dataset.studyUrl, {method: 'POST', body: data, credentials: 'same-origin'})
+                .then(response => {
+                    if (!response.ok) {
+                        throw new Error(response.statusText)
+                    }
+                    return response.json()
+                })
+                .then(step => {
+                    if (step.done) {
+                        window.location.assign(step.url)
+                        return
+                    }
+                    showCard(step)
+                    history.pushState(null, '', step.url)
+                })
+                .catch(() => form.submit())
+        })
+    })
+    window.addEventListener('popstate', () => window.location.reload())
+}
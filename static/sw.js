@@ -0,0 +1,56 @@
+// Service worker for the offline study mode.
+//
+// Uploaded images are stored under content-hash names and never change, so
+// they are served from the cache first. Pages, static files and deck bundles
+// go to the network first (bundles revalidate with their ETag) and fall back
+// to the last cached copy when offline.
+const SHELL_CACHE = 'learn-it-shell-v1'
+const MEDIA_CACHE = 'learn-it-media'
+const SHELL = ['/static/styles.css', '/static/scripts.js', '/static/offline.js']
+const NETWORK_FIRST = [/^\/static\//, /^\/api\/deck\/\d+\/bundle\/$/, /^\/deck\/\d+\/offline\/$/]
+
+self.addEventListener('install', event => {
+    event.waitUntil(caches.open(SHELL_CACHE).then(cache => cache.addAll(SHELL)).then(() => self.skipWaiting()))
+})
+
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(keys
+                .filter(key => key !== SHELL_CACHE && key !== MEDIA_CACHE)
+                .map(key => caches.delete(key))))
+            .then(() => self.clients.claim())
+    )
+})
+
+function cacheFirst(request) {
+    return caches.open(MEDIA_CACHE).then(cache => cache.match(request).then(hit => hit || fetch(request).then(response => {
+        if (response.ok) {
+            cache.put(request, response.clone())
+        }
+        return response
+    })))
+}
+
+function networkFirst(request) {
+    return caches.open(SHELL_CACHE).then(cache => fetch(request)
+        .then(response => {
+            if (response.ok) {
+                cache.put(request, response.clone())
+            }
+            return response
+        })
+        .catch(() => cache.match(request).then(hit => hit || Response.error())))
+}
+
+self.addEventListener('fetch', event => {
+    const url = new URL(event.request.url)
+    if (event.request.method !== 'GET' || url.origin !== self.location.origin) {
+        return
+    }
+    if (url.pathname.startsWith('/media/')) {
+        event.respondWith(cacheFirst(event.request))
+    } else if (NETWORK_FIRST.some(pattern => pattern.test(url.pathname))) {
+        event.respondWith(networkFirst(event.request))
+    }
+})